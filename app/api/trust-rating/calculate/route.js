@@ -161,8 +161,8 @@ export async function POST(req) {
     // Step 1: Fetch user statistics
     const userStats = await getUserStats(targetUserId, targetRole);
 
-    // Step 2: Call ML service
-    const mlResult = await callMLService(userStats);
+    // Step 2: Call ML service (the role picks the model it is scored with)
+    const mlResult = await callMLService({ ...userStats, role: targetRole });
     if (!mlResult.success)
       throw new Error(mlResult.error || "ML prediction failed");
 
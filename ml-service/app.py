@@ -1,271 +1,907 @@
 # app.py - Python Flask API for ML Model
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-import joblib
-import pandas as pd
 import numpy as np
+import json
 import os
 import sys
-import warnings
+import atexit
+import threading
+import time
+
+from model_loader import (
+    FEATURE_COLUMNS, load_model_bundle, model_signature
+)
+from features import (
+    MAX_VECTOR_VALUE, calculate_fallback_trust_score,
+    calculate_fallback_trust_score_columns, calculate_features,
+    calculate_features_columns, convert_to_likert_scale,
+    convert_to_likert_scale_array
+)
+from prediction_cache import PredictionCache
+from batcher import MicroBatcher
+from lanes import BatchPool, Lane, LaneFull
+from model_registry import DEFAULT_MODEL_NAME, ModelRegistry, ShadowScorer, load_registry_config
+from schema import USER_SCHEMA
+from serialization import encode_response
+from user_stats import UserStatsTable, load_dump
+import metrics
+
+class ServiceRequest(Request):
+    """
+    Request whose body limit (MAX_REQUEST_BYTES) skips /batch-predict/stream,
+    which reads its body a chunk at a time
+    """
+
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'batch_predict_stream':
+            return None
+        return super().max_content_length
+
 
 app = Flask(__name__)
+app.request_class = ServiceRequest
 CORS(app)  # Enable CORS for Next.js to call this API
 
 # Load the trained model once when server starts
 MODEL_PATH = os.getenv('MODEL_PATH', './models/trust_pipeline_best.joblib')
+# 'sklearn' runs the joblib Pipeline as-is; 'compiled' serves predictions from
+# forest_engine.CompiledForest built from the same Pipeline at load time
+INFERENCE_ENGINE = os.getenv('INFERENCE_ENGINE', 'sklearn')
+# 'r' memory-maps the arrays in an uncompressed joblib file so workers share them
+MODEL_MMAP_MODE = os.getenv('MODEL_MMAP_MODE') or None
+# 'auto' serves the compact .npz next to MODEL_PATH when it is current and
+# falls back to the joblib file; 'joblib' or 'npz' force one of them
+MODEL_FORMAT = os.getenv('MODEL_FORMAT', 'auto')
+# 'sync' loads the model while app.py is imported; 'background' returns at
+# once and loads it on a thread, with /health answering 'loading' meanwhile
+MODEL_LOAD_MODE = os.getenv('MODEL_LOAD_MODE', 'sync')
+# Seconds between checks of MODEL_PATH for a new file; 0 disables the watcher
+MODEL_WATCH_INTERVAL = float(os.getenv('MODEL_WATCH_INTERVAL', 0))
+# Shared secret for the /admin/* endpoints; unset disables them
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+# JSON file registering more models, role routes and a shadow model (see
+# model_registry.py); unset serves MODEL_PATH alone
+MODEL_REGISTRY_PATH = os.getenv('MODEL_REGISTRY_PATH') or None
+# Sampled batches waiting for the shadow model before new ones are dropped
+SHADOW_QUEUE_SIZE = int(os.getenv('SHADOW_QUEUE_SIZE', 100))
+
+# The model being served: a model_loader.LoadedModel, or None for fallback.
+# It is only ever replaced as a whole, so readers take one reference and use
+# it for the rest of the request.
 model = None
 
-def load_model():
-    global model
+def load_registry():
+    """The ModelRegistry and ShadowScorer (or None) that MODEL_REGISTRY_PATH describes"""
+    config = {'models': {}, 'routes': {}, 'shadow': None}
+    if MODEL_REGISTRY_PATH:
+        try:
+            config = load_registry_config(MODEL_REGISTRY_PATH)
+            print(f"🗂️ Model registry {MODEL_REGISTRY_PATH}: {len(config['models'])} extra model(s)")
+        except (OSError, ValueError) as e:
+            print(f"❌ Could not read model registry {MODEL_REGISTRY_PATH}: {e}; serving MODEL_PATH only")
+            config = {'models': {}, 'routes': {}, 'shadow': None}
+    loaded_registry = ModelRegistry(config['models'], config['routes'])
+    shadow = config['shadow']
+    if shadow is None:
+        return loaded_registry, None
+    return loaded_registry, ShadowScorer(loaded_registry, shadow['model'], shadow['sample_rate'], SHADOW_QUEUE_SIZE)
+
+# Every servable model by name ("default" is `model`), plus the role routes;
+# shadow_scorer is None unless the registry names a shadow model
+registry, shadow_scorer = load_registry()
+
+# Prediction cache: PREDICTION_CACHE_SIZE=0 disables it
+PREDICTION_CACHE_SIZE = int(os.getenv('PREDICTION_CACHE_SIZE', 10000))
+PREDICTION_CACHE_TTL = float(os.getenv('PREDICTION_CACHE_TTL', 300))
+
+def model_file_signature():
+    """(mtime, size) of the model file and its .npz, or None if both are missing"""
+    return model_signature(MODEL_PATH)
+
+prediction_cache = PredictionCache(
+    max_size=PREDICTION_CACHE_SIZE,
+    ttl_seconds=PREDICTION_CACHE_TTL,
+    signature_fn=model_file_signature
+)
+
+# Opt-in coalescing of concurrent single-row predictions: wait up to
+# PREDICT_BATCH_MAX_WAIT_MS for up to PREDICT_BATCH_MAX_SIZE rows
+PREDICT_BATCH_MAX_WAIT_MS = float(os.getenv('PREDICT_BATCH_MAX_WAIT_MS', 0))
+PREDICT_BATCH_MAX_SIZE = int(os.getenv('PREDICT_BATCH_MAX_SIZE', 32))
+
+request_batcher = None
+if PREDICT_BATCH_MAX_WAIT_MS > 0:
+    request_batcher = MicroBatcher(
+        max_batch_size=PREDICT_BATCH_MAX_SIZE,
+        max_wait_seconds=PREDICT_BATCH_MAX_WAIT_MS / 1000.0
+    )
+
+# Execution lanes (see lanes.py). /predict requests scored at once, and how
+# many more may wait, and for how long, before getting a 429
+PREDICT_LANE_CONCURRENCY = int(os.getenv('PREDICT_LANE_CONCURRENCY', 8))
+PREDICT_LANE_QUEUE = int(os.getenv('PREDICT_LANE_QUEUE', 32))
+PREDICT_LANE_MAX_WAIT_MS = float(os.getenv('PREDICT_LANE_MAX_WAIT_MS', 1000))
+# /batch-predict and /explain requests scored at once, and how many more may
+# wait (a queued request holds its request thread while it waits). Keep the
+# sum over both lanes below the request threads so /predict always gets one
+BATCH_LANE_CONCURRENCY = int(os.getenv('BATCH_LANE_CONCURRENCY', 2))
+BATCH_LANE_QUEUE = int(os.getenv('BATCH_LANE_QUEUE', 0))
+EXPLAIN_LANE_CONCURRENCY = int(os.getenv('EXPLAIN_LANE_CONCURRENCY', 1))
+EXPLAIN_LANE_QUEUE = int(os.getenv('EXPLAIN_LANE_QUEUE', 0))
+# Longest a queued /explain waits (a queued /batch-predict waits until its deadline)
+EXPLAIN_LANE_MAX_WAIT_MS = float(os.getenv('EXPLAIN_LANE_MAX_WAIT_MS', 1000))
+# Most users one /batch-predict or /explain call may send (413 beyond it);
+# /batch-predict/stream has no limit
+BATCH_MAX_USERS = int(os.getenv('BATCH_MAX_USERS', 20000))
+# Largest request body accepted before it is read or parsed (413 beyond it,
+# 0 for no limit); a 20,000-user batch is about 6 MB. /batch-predict/stream
+# has no limit
+MAX_REQUEST_BYTES = int(os.getenv('MAX_REQUEST_BYTES', 8 * 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES or None
+# Milliseconds a /batch-predict may spend scoring; users not scored by then
+# are returned as errors. A request can ask for less with "deadlineMs"
+BATCH_DEADLINE_MS = float(os.getenv('BATCH_DEADLINE_MS', 10000))
+# Worker processes scoring /batch-predict chunks next to the request
+# thread, per gunicorn worker; each holds its own copy of every served
+# model. 0 scores every chunk on the request thread
+BATCH_POOL_WORKERS = int(os.getenv('BATCH_POOL_WORKERS', 0))
+# Rows per chunk, and the smallest batch worth handing to the pool
+BATCH_CHUNK_ROWS = int(os.getenv('BATCH_CHUNK_ROWS', 1000))
+BATCH_POOL_MIN_ROWS = int(os.getenv('BATCH_POOL_MIN_ROWS', 200))
+# multiprocessing start method for the pool workers
+BATCH_POOL_START_METHOD = os.getenv('BATCH_POOL_START_METHOD', 'forkserver')
+
+predict_lane = Lane('predict', PREDICT_LANE_CONCURRENCY, PREDICT_LANE_QUEUE, PREDICT_LANE_MAX_WAIT_MS / 1000.0)
+batch_lane = Lane('batch', BATCH_LANE_CONCURRENCY, BATCH_LANE_QUEUE, BATCH_DEADLINE_MS / 1000.0)
+explain_lane = Lane('explain', EXPLAIN_LANE_CONCURRENCY, EXPLAIN_LANE_QUEUE, EXPLAIN_LANE_MAX_WAIT_MS / 1000.0)
+batch_pool = BatchPool(BATCH_POOL_WORKERS, BATCH_CHUNK_ROWS, BATCH_POOL_MIN_ROWS, BATCH_POOL_START_METHOD)
+
+# Error for a /batch-predict user whose chunk was not scored by the deadline
+DEADLINE_EXCEEDED = 'Not scored before the request deadline'
+
+# "shape" values /batch-predict accepts: one object per user, or parallel
+# arrays of userId, trustRating and method
+RESPONSE_SHAPES = ('rows', 'columns')
+
+# "method" values /batch-predict and /batch-predict/stream accept: the model
+# (with the fallback formula for rows it cannot score) or the formula only
+SCORING_METHODS = ('auto', 'fallback')
+
+# Rows scored per model call by /batch-predict/stream
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 1000))
+
+# /stats/events reports a user's score again once it has moved this many
+# points (0-100) from the last score it reported
+STATS_EMIT_THRESHOLD = float(os.getenv('STATS_EMIT_THRESHOLD', 1.0))
+# Snapshot file for the user stats table: restored at startup and rewritten
+# every STATS_SNAPSHOT_INTERVAL seconds while it has changes; unset keeps
+# the table in memory only
+STATS_SNAPSHOT_PATH = os.getenv('STATS_SNAPSHOT_PATH') or None
+STATS_SNAPSHOT_INTERVAL = float(os.getenv('STATS_SNAPSHOT_INTERVAL', 60))
+# CSV or Parquet dump of user stats (batch_score.py columns plus userId)
+# loaded into the table at startup, on top of any snapshot
+STATS_DUMP_PATH = os.getenv('STATS_DUMP_PATH') or None
+# Rows scored per model call when the whole table is rescored
+STATS_RESCORE_CHUNK_SIZE = int(os.getenv('STATS_RESCORE_CHUNK_SIZE', 10000))
+# Processes serving the app: gunicorn.conf.py sets SERVICE_WORKERS, and
+# uvicorn takes WEB_CONCURRENCY as its worker count. Every process keeps its
+# own stats table, so /stats/events, /admin/stats/load and snapshot writes
+# only run when there is exactly one
+SERVICE_WORKERS = int(os.getenv('SERVICE_WORKERS') or os.getenv('WEB_CONCURRENCY') or 1)
+STATS_WRITABLE = SERVICE_WORKERS == 1
+if not STATS_WRITABLE:
+    print(f"⚠️ {SERVICE_WORKERS} worker processes: /stats/events, /admin/stats/load and stats "
+          f"snapshots are off, since each worker would keep its own table (run one worker for them)")
+
+def load_stats_table():
+    """The snapshot at STATS_SNAPSHOT_PATH (or an empty table) plus STATS_DUMP_PATH"""
+    table = UserStatsTable()
+    if STATS_SNAPSHOT_PATH and os.path.exists(STATS_SNAPSHOT_PATH):
+        try:
+            table = UserStatsTable.load(STATS_SNAPSHOT_PATH)
+            print(f"📇 Restored stats for {len(table):,} users from {STATS_SNAPSHOT_PATH}")
+        except Exception as e:
+            print(f"⚠️ Could not restore user stats from {STATS_SNAPSHOT_PATH}: {e}, starting empty")
+    if STATS_DUMP_PATH:
+        try:
+            started = time.perf_counter()
+            stored, skipped = load_dump(table, STATS_DUMP_PATH)
+            print(f"📇 Loaded stats for {stored:,} users from {STATS_DUMP_PATH} "
+                  f"in {time.perf_counter() - started:.2f}s ({skipped:,} rows skipped)")
+        except Exception as e:
+            print(f"⚠️ Could not load user stats from {STATS_DUMP_PATH}: {e}")
+    return table
+
+# Raw stats of users, from dumps and /stats/events
+stats_table = load_stats_table()
+last_rescore = {'status': 'never', 'version': None, 'rows': 0, 'seconds': None, 'finished_at': None}
+
+def score_stats_rows(rows, active):
+    """
+    Score rows of the stats table with the given LoadedModel (or None).
+    Rows are scored with one model call; rows with out-of-range values, or
+    every row when the model is missing or fails, get the fallback formula
+    (vectorized, except for the out-of-range rows).
+
+    Returns (predictions_0_100, used_fallback) arrays.
+    """
+    raw = stats_table.raw_columns(rows)
+    scores = np.empty(len(rows), dtype=np.float64)
+    fallback = np.ones(len(rows), dtype=bool)
+    vectorizable = np.ones(len(rows), dtype=bool)
+    for values in raw.values():
+        vectorizable &= np.abs(values) < MAX_VECTOR_VALUE
+    if active is not None and len(rows):
+        try:
+            with metrics.stage('features'):
+                matrix = calculate_features_columns({f: v[vectorizable] for f, v in raw.items()})
+            scores[vectorizable] = np.minimum(100.0, np.maximum(0.0, active.predict(matrix)))
+            fallback[vectorizable] = False
+        except Exception as e:
+            print(f"⚠️ Rescoring stats failed: {e}, using fallback")
+    with metrics.stage('fallback'):
+        columns = fallback & vectorizable
+        if columns.any():
+            scores[columns] = calculate_fallback_trust_score_columns({f: v[columns] for f, v in raw.items()})
+        for i in np.flatnonzero(fallback & ~vectorizable):
+            scores[i] = calculate_fallback_trust_score(stats_table.row_payload(rows[i]))
+    return scores, fallback
+
+def rescore_stats_table(active):
+    """
+    Rescore every user in the stats table with active, STATS_RESCORE_CHUNK_SIZE
+    rows per model call. Stops early if another model is swapped in
+    meanwhile (that load rescores again). Never raises.
+    """
+    if active is None or not len(stats_table):
+        return
+    started = time.perf_counter()
+    last_rescore.update(status='running', version=active.version, rows=0, seconds=None)
     try:
-        # Suppress sklearn warnings during loading
-        warnings.filterwarnings('ignore', category=UserWarning)
-        
-        print(f"📦 Attempting to load model from {MODEL_PATH}")
-        print(f"🐍 Python version: {sys.version}")
-        print(f"📊 Pandas version: {pd.__version__}")
-        
+        with metrics.endpoint('stats_rescore'):
+            rows = stats_table.rescore(
+                lambda chunk: score_stats_rows(chunk, active),
+                chunk_size=STATS_RESCORE_CHUNK_SIZE,
+                should_stop=lambda: model is not active
+            )
+        last_rescore.update(status='ok' if model is active else 'superseded', rows=rows)
+        print(f"🔁 Rescored {rows:,} users with model {active.version} in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        print(f"❌ Rescoring user stats failed: {e}")
+        last_rescore.update(status='failed')
+    last_rescore.update(seconds=round(time.perf_counter() - started, 3), finished_at=time.time())
+
+# Serializes loads; requests never wait on it
+_reload_lock = threading.Lock()
+last_reload = {'status': 'never', 'error': None, 'finished_at': None, 'version': None}
+_failed_signature = None
+
+def load_model(path=None):
+    """
+    Load the model file (MODEL_PATH by default), validate it and swap it in.
+
+    The new model is fully loaded and smoke-tested before the global
+    reference changes, so concurrent requests keep using the previous model
+    until the swap. If loading fails, the previous model stays in service.
+    After a successful swap every user in the stats table is rescored.
+    Returns True on success.
+    """
+    global model, _failed_signature
+    path = path or MODEL_PATH
+    with _reload_lock:
         try:
-            import sklearn
-            print(f"🔧 Scikit-learn version: {sklearn.__version__}")
-        except ImportError:
-            print("⚠️ Scikit-learn not found, attempting to import")
-        
-        # Check if model file exists
-        if not os.path.exists(MODEL_PATH):
-            print(f"❌ Model file not found at {MODEL_PATH}")
-            print(f"📁 Current directory: {os.getcwd()}")
-            print(f"📂 Files in models/: {os.listdir('./models') if os.path.exists('./models') else 'models directory not found'}")
+            print(f"📦 Attempting to load model from {path}")
+            print(f"🐍 Python version: {sys.version}")
+            
+            # Check if model file exists
+            if model_signature(path) is None:
+                print(f"❌ Model file not found at {path}")
+                print(f"📁 Current directory: {os.getcwd()}")
+                print(f"📂 Files in models/: {os.listdir('./models') if os.path.exists('./models') else 'models directory not found'}")
+                last_reload.update(status='failed', error='model file not found',
+                                   finished_at=time.time(), version=None)
+                metrics.MODEL_LOADS.inc(status='failed')
+                return False
+            
+            loaded = load_model_bundle(path, INFERENCE_ENGINE, MODEL_MMAP_MODE, MODEL_FORMAT)
+            
+            # Atomic swap: one reference assignment
+            model = loaded
+            registry.set(DEFAULT_MODEL_NAME, loaded)
+            if batch_pool.started():
+                start_batch_pool()
+            _failed_signature = None
+            prediction_cache.clear()
+            last_reload.update(status='ok', error=None,
+                               finished_at=time.time(), version=loaded.version)
+            metrics.MODEL_LOADS.inc(status='ok')
+            metrics.MODEL_LOAD_DURATION.observe(loaded.load_seconds)
+            metrics.set_model(loaded.version, loaded.engine)
+            print(f"✅ Model {loaded.version} ({loaded.format}) is ready for predictions ({loaded.load_seconds:.2f}s)")
+            
+        except Exception as e:
+            print(f"❌ Error loading model: {e}")
+            import traceback
+            traceback.print_exc()
+            _failed_signature = model_signature(path)
+            last_reload.update(status='failed', error=str(e),
+                               finished_at=time.time(), version=None)
+            metrics.MODEL_LOADS.inc(status='failed')
+            if model is not None:
+                print(f"↩️ Keeping model {model.version} in service")
             return False
-        
-        # Try loading model with compatibility fixes
+    
+    # Outside the lock, so a newer load is not held up and can supersede it
+    rescore_stats_table(loaded)
+    return True
+
+def reload_model_in_background():
+    """
+    Start load_model() on a background thread. Returns False if a load is
+    already running.
+    """
+    if _reload_lock.locked():
+        return False
+    last_reload.update(status='loading', error=None)
+    threading.Thread(target=load_model, name='model-reload', daemon=True).start()
+    return True
+
+# Serializes loads of registry models
+_registry_lock = threading.Lock()
+_failed_registry_signatures = {}
+
+def load_registered_model(name):
+    """
+    Load the registry model name from its entry and swap it in, like
+    load_model() does for the default model. If loading fails, the
+    previous version stays in service. Returns True on success.
+    """
+    spec = registry.specs[name]
+    path = spec['path']
+    with _registry_lock:
         try:
-            # First attempt: Load normally
-            model = joblib.load(MODEL_PATH)
-            print(f"✅ Model loaded successfully (standard method)")
-            
-        except AttributeError as e:
-            if "'ColumnTransformer' object has no attribute" in str(e):
-                print(f"⚠️ ColumnTransformer compatibility issue detected")
-                print(f"🔧 Attempting compatibility fix...")
-                
-                # Try loading with sklearn compatibility
-                import sklearn.compose
-                from sklearn.utils import _safe_indexing
-                
-                # Patch the ColumnTransformer if needed
-                if not hasattr(sklearn.compose.ColumnTransformer, '_name_to_fitted_passthrough'):
-                    sklearn.compose.ColumnTransformer._name_to_fitted_passthrough = {}
-                
-                model = joblib.load(MODEL_PATH)
-                print(f"✅ Model loaded with compatibility patch")
-            else:
-                raise
-        
-        print(f"📋 Model type: {type(model)}")
-        
-        # Test the model with dummy data
-        test_features = {
-            'PortfolioCount': 5,
-            'AverageRatings': 4.0,
-            'TransactionCount': 10,
-            'CompletedTransactions': 9,
-            'ReviewCount': 5,
-            'StarCount': 20,
-            'PositiveReviews': 4,
-            'NeutralReviews': 1,
-            'NegativeReviews': 0,
-            'CompletionRate': 90.0,
-            'CancellationRate': 10.0,
-            'BioLength': 100,
-            'BioWordCount': 20,
-            'PositiveReviewRatio': 0.8,
-            'ReviewCoverage': 0.5,
-            'EngagementIndex': 150
-        }
-        
-        test_df = pd.DataFrame([test_features])
-        test_prediction = model.predict(test_df)[0]
-        print(f"🧪 Test prediction: {test_prediction:.2f}")
-        print(f"✅ Model is ready for predictions")
-        
+            print(f"📦 Attempting to load model {name} from {path}")
+            loaded = load_model_bundle(
+                path, spec.get('engine', INFERENCE_ENGINE), spec.get('mmap_mode', MODEL_MMAP_MODE),
+                spec.get('format', MODEL_FORMAT)
+            )
+        except Exception as e:
+            print(f"❌ Error loading model {name}: {e}")
+            _failed_registry_signatures[name] = model_signature(path)
+            metrics.MODEL_LOADS.inc(status='failed')
+            return False
+        registry.set(name, loaded)
+        if batch_pool.started():
+            start_batch_pool()
+        _failed_registry_signatures.pop(name, None)
+        metrics.MODEL_LOADS.inc(status='ok')
+        metrics.MODEL_LOAD_DURATION.observe(loaded.load_seconds)
+        print(f"✅ Model {name} {loaded.version} ({loaded.format}) is ready for predictions ({loaded.load_seconds:.2f}s)")
         return True
+
+def load_registered_models():
+    """Load every model in the registry file, one after the other"""
+    for name in registry.specs:
+        load_registered_model(name)
+
+def watch_model_file(interval):
+    """
+    Poll MODEL_PATH (and its compact .npz) and reload when their mtime or
+    size no longer matches the served model. A file that failed to load is
+    not retried until it changes again, so a half-written file is picked
+    up once the write completes. Registry models are watched the same way.
+    """
+    while True:
+        time.sleep(interval)
+        for name, spec in registry.specs.items():
+            if _registry_lock.locked():
+                break  # a load is running; look again next time
+            signature = model_signature(spec['path'])
+            current = registry.get(name)
+            if signature is None or signature == _failed_registry_signatures.get(name):
+                continue
+            if current is None or current.signature != signature:
+                print(f"👀 Model file of {name} changed, reloading")
+                load_registered_model(name)
         
-    except Exception as e:
-        print(f"❌ Error loading model: {e}")
-        import traceback
-        traceback.print_exc()
-        model = None
-        return False
+        signature = model_file_signature()
+        if signature is None or signature == _failed_signature:
+            continue
+        current = model
+        if current is not None and current.signature == signature:
+            continue
+        print(f"👀 Model file changed, reloading")
+        load_model()
+
+_watcher_pid = None
 
-def calculate_fallback_trust_score(user_data):
+def start_batch_pool():
     """
-    Fallback rule-based trust score calculation when ML model is unavailable.
-    Returns a score on 0-100 scale.
+    Start the BATCH_POOL_WORKERS processes for this process, warm for every
+    loaded model, and restart them warm after a reload. Like the watcher,
+    it must run in the process that serves requests: gunicorn.conf.py
+    calls it once each worker has loaded the app, and asgi.py on import.
     """
+    batch_pool.start([registry.get(name) for name in registry.names()])
+
+def start_model_watcher():
+    """
+    Start the MODEL_WATCH_INTERVAL watcher in this process, once. Threads
+    do not survive fork(), so gunicorn.conf.py calls this again in every
+    worker when the app is preloaded in the master.
+    """
+    global _watcher_pid
+    if MODEL_WATCH_INTERVAL <= 0 or _watcher_pid == os.getpid():
+        return
+    _watcher_pid = os.getpid()
+    threading.Thread(
+        target=watch_model_file, args=(MODEL_WATCH_INTERVAL,),
+        name='model-watch', daemon=True
+    ).start()
+
+def save_stats_snapshot():
+    """Write the stats table to STATS_SNAPSHOT_PATH if it changed since the last write"""
+    if not STATS_SNAPSHOT_PATH or not STATS_WRITABLE or not stats_table.dirty:
+        return
     try:
-        portfolio_count = user_data.get('portfolioCount', 0)
-        avg_ratings = user_data.get('averageRatings', 1.0)
-        transaction_count = user_data.get('transactionCount', 0)
-        completed_transactions = user_data.get('completedTransactions', 0)
-        review_count = user_data.get('reviewCount', 0)
-        positive_reviews = user_data.get('positiveReviews', 0)
-        negative_reviews = user_data.get('negativeReviews', 0)
-        
-        # Base score from ratings (0-30 points)
-        rating_score = ((avg_ratings - 1) / 4) * 30
-        
-        # Activity score (0-25 points)
-        activity_score = min(transaction_count / 20, 1) * 25
-        
-        # Completion rate (0-25 points)
-        completion_rate = safe_div(completed_transactions, transaction_count)
-        completion_score = completion_rate * 25
-        
-        # Review positivity (0-15 points)
-        if review_count > 0:
-            positivity = safe_div(positive_reviews, review_count)
-            review_score = positivity * 15
-        else:
-            review_score = 7.5  # Neutral score
-        
-        # Portfolio bonus (0-5 points)
-        portfolio_score = min(portfolio_count / 10, 1) * 5
-        
-        # Calculate total
-        total_score = (
-            rating_score +
-            activity_score +
-            completion_score +
-            review_score +
-            portfolio_score
-        )
-        
-        # Penalties
-        if negative_reviews > 0 and review_count > 0:
-            negative_ratio = negative_reviews / review_count
-            total_score -= (negative_ratio * 20)
-        
-        # Clamp between 0-100
-        total_score = max(0, min(100, total_score))
-        
-        return total_score
-        
+        saved = stats_table.save(STATS_SNAPSHOT_PATH)
+        print(f"📇 Saved stats for {saved:,} users to {STATS_SNAPSHOT_PATH}")
     except Exception as e:
-        print(f"⚠️ Error in fallback calculation: {e}")
-        return 50.0  # Default neutral score
-
-# Load model on startup
-model_loaded = load_model()
-
-def safe_div(a, b):
-    """Safe division to avoid divide by zero"""
-    return a / b if b != 0 else 0.0
-
-def calculate_features(user_data):
-    """
-    Calculate all features needed by the model from user data.
-    This mirrors the preprocessing in Data_Preprocessing.ipynb
-    """
-    # Extract raw data
-    portfolio_count = user_data.get('portfolioCount', 0)
-    avg_ratings = user_data.get('averageRatings', 1.0)
-    transaction_count = user_data.get('transactionCount', 0)
-    completed_transactions = user_data.get('completedTransactions', 0)
-    review_count = user_data.get('reviewCount', 0)
-    star_count = user_data.get('starCount', 0)
-    positive_reviews = user_data.get('positiveReviews', 0)
-    neutral_reviews = user_data.get('neutralReviews', 0)
-    negative_reviews = user_data.get('negativeReviews', 0)
-    bio_length = user_data.get('bioLength', 0)
-    bio_word_count = user_data.get('bioWordCount', 0)
-    
-    # Ensure non-negative values
-    portfolio_count = max(0, portfolio_count)
-    avg_ratings = max(1.0, min(5.0, avg_ratings))
-    transaction_count = max(0, transaction_count)
-    completed_transactions = max(0, completed_transactions)
-    review_count = max(0, review_count)
-    star_count = max(0, star_count)
-    positive_reviews = max(0, positive_reviews)
-    neutral_reviews = max(0, neutral_reviews)
-    negative_reviews = max(0, negative_reviews)
-    
-    # Ensure consistency
-    transaction_count = max(transaction_count, completed_transactions)
-    total_sentiment_reviews = positive_reviews + neutral_reviews + negative_reviews
-    review_count = max(review_count, total_sentiment_reviews)
-    
-    # Calculate derived features
-    completion_rate = safe_div(completed_transactions * 100.0, transaction_count)
-    completion_rate = min(100.0, max(0.0, completion_rate))
-    
-    cancelled = max(0, transaction_count - completed_transactions)
-    cancellation_rate = safe_div(cancelled * 100.0, transaction_count)
-    cancellation_rate = min(100.0, max(0.0, cancellation_rate))
-    
-    positive_review_ratio = safe_div(positive_reviews, review_count)
-    positive_review_ratio = min(1.0, max(0.0, positive_review_ratio))
-    
-    review_coverage = safe_div(review_count, transaction_count)
-    review_coverage = min(1.0, max(0.0, review_coverage))
-
-    engagement_index = (
-        transaction_count + 
-        review_count + 
-        portfolio_count + 
-        bio_length + 
-        bio_word_count
-    )
-    
-    # Create feature dictionary matching model's expected input
-    features = {
-        'PortfolioCount': portfolio_count,
-        'AverageRatings': avg_ratings,
-        'TransactionCount': transaction_count,
-        'CompletedTransactions': completed_transactions,
-        'ReviewCount': review_count,
-        'StarCount': star_count,
-        'PositiveReviews': positive_reviews,
-        'NeutralReviews': neutral_reviews,
-        'NegativeReviews': negative_reviews,
-        'CompletionRate': completion_rate,
-        'CancellationRate': cancellation_rate,
-        'BioLength': bio_length,
-        'BioWordCount': bio_word_count,
-        'PositiveReviewRatio': positive_review_ratio,
-        'ReviewCoverage': review_coverage,
-        'EngagementIndex': engagement_index,
-        'TrustRating': 0  # Placeholder, will be predicted
-    }
-    
-    return features
+        print(f"⚠️ Could not save user stats snapshot: {e}")
+
+def snapshot_stats_periodically(interval):
+    while True:
+        time.sleep(interval)
+        save_stats_snapshot()
 
-def convert_to_likert_scale(prediction_0_100):
+_snapshot_pid = None
+
+def start_stats_snapshots():
     """
-    Convert prediction from 0-100 scale to 1-5 Likert scale.
-    
-    Mapping:
-    0-100 → 1-5
-    0 → 1.0
-    25 → 2.0
-    50 → 3.0
-    75 → 4.0
-    100 → 5.0
+    Start the STATS_SNAPSHOT_INTERVAL snapshot thread in this process,
+    once; like start_model_watcher(), gunicorn.conf.py calls it again in
+    every worker of a preloaded app.
+    """
+    global _snapshot_pid
+    if (not STATS_SNAPSHOT_PATH or not STATS_WRITABLE or STATS_SNAPSHOT_INTERVAL <= 0
+            or _snapshot_pid == os.getpid()):
+        return
+    _snapshot_pid = os.getpid()
+    threading.Thread(
+        target=snapshot_stats_periodically, args=(STATS_SNAPSHOT_INTERVAL,),
+        name='stats-snapshot', daemon=True
+    ).start()
+
+atexit.register(save_stats_snapshot)
+
+# Load model on startup. In background mode requests are scored with the
+# fallback formula until the model is in service.
+if MODEL_LOAD_MODE == 'background':
+    reload_model_in_background()
+    threading.Thread(target=load_registered_models, name='registry-load', daemon=True).start()
+else:
+    load_model()
+    load_registered_models()
+start_model_watcher()
+start_stats_snapshots()
+
+def predict_rows(matrix, active, deadline=None):
+    """
+    active.predict(), with single rows coalesced across concurrent
+    requests when the request batcher is enabled. With a deadline (a
+    time.monotonic() value) the rows are scored in chunks on the batch
+    pool instead, and rows not scored in time are NaN.
+    """
+    if deadline is not None:
+        return batch_pool.predict(matrix, active, deadline)
+    if request_batcher is not None and len(matrix) == 1:
+        with metrics.stage('batch_wait'):
+            return request_batcher.predict(matrix, active)
+    return active.predict(matrix)
+
+def predict_cached(matrix, active, deadline=None):
     """
-    likert_score = 1.0 + (prediction_0_100 / 100.0) * 4.0
-    # Ensure it stays within 1-5 range
-    likert_score = max(1.0, min(5.0, likert_score))
-    return likert_score
+    predict_rows() behind the prediction cache. Only rows whose feature
+    vector has not been seen by this model version (or has expired) reach
+    the model.
+    """
+    if not prediction_cache.enabled:
+        return predict_rows(matrix, active, deadline)
+
+    with metrics.stage('cache'):
+        keys = [(active.version,) + tuple(row) for row in matrix.tolist()]
+        predictions = np.empty(len(keys), dtype=np.float64)
+        missing = []
+        for i, key in enumerate(keys):
+            cached = prediction_cache.get(key)
+            if cached is None:
+                missing.append(i)
+            else:
+                predictions[i] = cached
+
+    if missing:
+        fresh = predict_rows(matrix[missing], active, deadline)
+        predictions[missing] = fresh
+        with metrics.stage('cache'):
+            for i, value in zip(missing, fresh.tolist()):
+                if value == value:  # not NaN: scored before the deadline
+                    prediction_cache.put(keys[i], value)
+
+    return predictions
+
+def features_to_row(features):
+    """Turn a calculate_features() dict into a one-row model input matrix"""
+    return np.array([[features[c] for c in FEATURE_COLUMNS]], dtype=np.float64)
+
+def score_columns(raw, active, deadline=None):
+    """
+    Score validated raw columns (from USER_SCHEMA) with a single
+    predict_cached() call on the given LoadedModel (or None). Without a
+    model, or if the call fails, every row gets the vectorized fallback
+    formula. Rows the model scored are offered to the shadow scorer.
+
+    Returns (predictions_0_100, used_fallback) arrays. With a deadline,
+    rows the model did not score in time are NaN.
+    """
+    count = len(next(iter(raw.values())))
+    if active is not None and count:
+        try:
+            with metrics.stage('features'):
+                matrix = calculate_features_columns(raw)
+            predictions = np.minimum(100.0, np.maximum(0.0, predict_cached(matrix, active, deadline)))
+            scored = ~np.isnan(predictions)
+            if shadow_scorer is not None and scored.any():
+                shadow_scorer.offer(matrix[scored], predictions[scored], active)
+            return predictions, np.zeros(count, dtype=bool)
+        except Exception as batch_error:
+            print(f"⚠️ Batched prediction failed: {batch_error}, using fallback")
+    with metrics.stage('fallback'):
+        return calculate_fallback_trust_score_columns(raw), np.ones(count, dtype=bool)
+
+def predict_batch(users, active, deadline=None):
+    """
+    Validate a list of payloads with USER_SCHEMA and score the valid ones
+    with score_columns().
+
+    Returns (predictions_0_100, used_fallback, errors): arrays in input
+    order, and {index: message} for the rejected rows, whose entries in the
+    arrays are NaN and False. Rows not scored by the deadline are rejected
+    with DEADLINE_EXCEEDED.
+    """
+    with metrics.stage('validate'):
+        raw, errors = USER_SCHEMA.validate_batch(users)
+    scores = np.full(len(users), np.nan)
+    fallback = np.zeros(len(users), dtype=bool)
+    valid = np.ones(len(users), dtype=bool)
+    if errors:
+        valid[list(errors)] = False
+        raw = {field: values[valid] for field, values in raw.items()}
+    scores[valid], fallback[valid] = score_columns(raw, active, deadline)
+    expired = np.flatnonzero(valid & np.isnan(scores)).tolist() if deadline is not None else []
+    if expired:
+        errors = dict(sorted({**errors, **dict.fromkeys(expired, DEADLINE_EXCEEDED)}.items()))
+    return scores, fallback, errors
+
+def lanes_stats():
+    """Queue depth and rejections of the execution lanes, for /health and /metrics"""
+    return {
+        'predict': predict_lane.stats(),
+        'batch': dict(batch_lane.stats(), max_users=BATCH_MAX_USERS, deadline_ms=BATCH_DEADLINE_MS),
+        'explain': explain_lane.stats(),
+        'batch_pool': batch_pool.stats(),
+    }
+
+def busy_response(error):
+    """Body and status code for a request its lane refused"""
+    return {
+        'error': f'Server busy, retry later: {error}',
+        'success': False
+    }, 429
+
+def health_response():
+    """Body for /health; shared by the Flask app and asgi.py"""
+    active = model
+    loading = active is None and last_reload['status'] == 'loading'
+    return {
+        'status': 'loading' if loading else 'healthy',
+        'model_loaded': active is not None,
+        'model_version': active.version if active is not None else None,
+        'inference_engine': active.engine if active is not None else None,
+        'model_format': active.format if active is not None else None,
+        'model_compaction': active.compaction if active is not None else None,
+        'registry': registry.describe(),
+        'shadow': shadow_scorer.stats() if shadow_scorer is not None else None,
+        'fallback_available': True,
+        'prediction_cache': prediction_cache.stats(),
+        'request_batching': request_batcher.stats() if request_batcher is not None else None,
+        'lanes': lanes_stats(),
+        'user_stats': {'users': len(stats_table), 'writable': STATS_WRITABLE, 'last_rescore': last_rescore},
+        'last_reload': last_reload
+    }
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
+    """Health check endpoint; 503 until the first model load finishes"""
+    body = health_response()
+    return jsonify(body), 503 if body['status'] == 'loading' else 200
+
+def metrics_response():
+    """Prometheus text for /metrics; shared by the Flask app and asgi.py"""
+    for stat, value in prediction_cache.stats().items():
+        if stat in ('size', 'hits', 'misses', 'evictions', 'invalidations'):
+            metrics.CACHE_STATS.set(value, stat=stat)
+    for lane, stats in lanes_stats().items():
+        for stat, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                metrics.LANE_STATS.set(value, lane=lane, stat=stat)
+    return metrics.render()
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics for this worker process"""
+    return Response(metrics_response(), content_type=metrics.CONTENT_TYPE)
+
+def _is_admin():
+    """Whether the request carries the ADMIN_TOKEN (never, when it is unset)"""
+    return bool(ADMIN_TOKEN) and request.headers.get('X-Admin-Token') == ADMIN_TOKEN
+
+@app.route('/admin/reload-model', methods=['POST'])
+def reload_model():
+    """
+    Reload MODEL_PATH without restarting the worker.
+
+    Requires the X-Admin-Token header to match ADMIN_TOKEN. The new model
+    is loaded and validated in the background and swapped in only if it
+    passes; pass ?wait=true to block until the load finishes. With several
+    gunicorn workers this reloads the worker that received the request;
+    set MODEL_WATCH_INTERVAL to have every worker pick up a new file.
+    ?model=name reloads a model from the registry file instead.
+    """
+    if not _is_admin():
+        return jsonify({
+            'error': 'Forbidden',
+            'success': False
+        }), 403
+    
+    name = request.args.get('model', DEFAULT_MODEL_NAME)
+    if name != DEFAULT_MODEL_NAME:
+        return reload_registered_model(name)
+    
+    if request.args.get('wait', '').lower() in ('1', 'true', 'yes'):
+        success = load_model()
+        active = model
+        return jsonify({
+            'success': success,
+            'model_version': active.version if active is not None else None,
+            'last_reload': last_reload
+        }), 200 if success else 500
+    
+    if not reload_model_in_background():
+        return jsonify({
+            'error': 'A model reload is already in progress',
+            'success': False
+        }), 409
+    
+    return jsonify({
+        'success': True,
+        'message': 'Model reload started'
+    }), 202
+
+def reload_registered_model(name):
+    """/admin/reload-model for a registry model"""
+    if name not in registry.specs:
+        return jsonify({
+            'error': f"unknown model {name!r}; registered: {', '.join(registry.names())}",
+            'success': False
+        }), 404
+    
+    if request.args.get('wait', '').lower() in ('1', 'true', 'yes'):
+        success = load_registered_model(name)
+        active = registry.get(name)
+        return jsonify({
+            'success': success,
+            'model': name,
+            'model_version': active.version if active is not None else None
+        }), 200 if success else 500
+    
+    if _registry_lock.locked():
+        return jsonify({
+            'error': 'A registry model load is already in progress',
+            'success': False
+        }), 409
+    
+    threading.Thread(target=load_registered_model, args=(name,), name='registry-load', daemon=True).start()
+    return jsonify({
+        'success': True,
+        'message': f'Reload of model {name} started'
+    }), 202
+
+@app.route('/admin/stats/load', methods=['POST'])
+def load_stats_dump():
+    """
+    Load a CSV or Parquet dump of user stats from a path on this server
+    into the stats table, then rescore the whole table with the current
+    model. Body: {"path": "/data/user_stats.parquet"}. Requires
+    X-Admin-Token. Runs to completion before answering.
+    """
+    if not _is_admin():
+        return jsonify({
+            'error': 'Forbidden',
+            'success': False
+        }), 403
+    
+    if not STATS_WRITABLE:
+        body, status = stats_not_writable_response()
+        return jsonify(body), status
+    
+    path = (request.get_json(silent=True) or {}).get('path')
+    if not isinstance(path, str) or not os.path.isfile(path):
+        return jsonify({
+            'error': 'path must name a CSV or Parquet file on the server',
+            'success': False
+        }), 400
+    
+    try:
+        started = time.perf_counter()
+        stored, skipped = load_dump(stats_table, path)
+        load_seconds = time.perf_counter() - started
+    except Exception as e:
+        return jsonify({
+            'error': str(e),
+            'success': False
+        }), 400
+    rescore_stats_table(model)
     return jsonify({
-        'status': 'healthy',
-        'model_loaded': model is not None,
-        'fallback_available': True
-    })
+        'success': True,
+        'stored': stored,
+        'skipped': skipped,
+        'users': len(stats_table),
+        'load_seconds': round(load_seconds, 3),
+        'last_rescore': last_rescore
+    }), 200
+
+def _csv_field(text):
+    if any(c in text for c in ',"\r\n'):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+def _export_lines(fmt):
+    """CSV or NDJSON text for every user's latest score, a chunk at a time"""
+    if fmt == 'csv':
+        yield 'userId,trustScore,trustRating,method\n'
+    for user_ids, scores, fallback in stats_table.iter_latest():
+        ratings = convert_to_likert_scale_array(scores)
+        lines = []
+        for user_id, score, rating, used_fallback in zip(
+                user_ids, scores.tolist(), ratings.tolist(), fallback.tolist()):
+            scored = score == score  # NaN for users never scored
+            method = ('fallback' if used_fallback else 'ml_model') if scored else None
+            if fmt == 'csv':
+                lines.append(','.join([
+                    _csv_field(user_id),
+                    f'{score:.2f}' if scored else '', f'{rating:.2f}' if scored else '', method or ''
+                ]))
+            else:
+                lines.append(json.dumps({
+                    'userId': user_id,
+                    'trustScore': round(score, 2) if scored else None,
+                    'trustRating': round(rating, 2) if scored else None,
+                    'method': method
+                }))
+        yield '\n'.join(lines) + '\n'
+
+@app.route('/admin/stats/export', methods=['GET'])
+def export_stats_scores():
+    """
+    Stream the latest score of every user in the stats table, as CSV
+    (default) or NDJSON with ?format=ndjson. Users that have never been
+    scored have empty scores. Requires X-Admin-Token.
+    """
+    if not _is_admin():
+        return jsonify({
+            'error': 'Forbidden',
+            'success': False
+        }), 403
+    
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({
+            'error': 'format must be csv or ndjson',
+            'success': False
+        }), 400
+    return Response(
+        stream_with_context(_export_lines(fmt)),
+        mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    )
+
+def encoded_response(body, status):
+    """
+    A Flask Response for body, serialized by encode_response() and
+    compressed when the client accepts it
+    """
+    payload, headers = encode_response(body, request.headers.get('Accept-Encoding'))
+    if status == 429:
+        headers['Retry-After'] = '1'
+    return Response(payload, status=status, headers=headers)
+
+def predict_response(user_data):
+    """
+    Body and status code for /predict; shared by the Flask app and asgi.py.
+    Runs in the predict lane, so it gets a 429 once that is full.
+    """
+    try:
+        with predict_lane.admit():
+            return _predict_response(user_data)
+    except LaneFull as e:
+        return busy_response(e)
+
+def _predict_response(user_data):
+    """predict_response() once the predict lane has admitted it"""
+    if not user_data:
+        return {
+            'error': 'No data provided',
+            'success': False
+        }, 400
+    
+    try:
+        with metrics.stage('validate'):
+            stats = USER_SCHEMA.validate(user_data)
+            # Serve the whole request from one model, even if a reload swaps it
+            model_name, active = registry.resolve(user_data.get('model'), user_data.get('role'))
+    except (ValueError, LookupError) as e:
+        return {
+            'error': str(e),
+            'success': False
+        }, 400
+    user_data = stats
+    
+    used_fallback = False
+    
+    # Try ML model first
+    if active is not None:
+        try:
+            # Calculate all features
+            with metrics.stage('features'):
+                features = calculate_features(user_data)
+            
+            # Make prediction (model outputs 0-100); the row is built in
+            # FEATURE_COLUMNS order, which leaves out the TrustRating target
+            row = features_to_row(features)
+            prediction_0_100 = predict_cached(row, active)[0]
+            
+            # Ensure prediction is within 0-100 range first
+            prediction_0_100 = float(max(0.0, min(100.0, prediction_0_100)))
+            if shadow_scorer is not None:
+                shadow_scorer.offer(row, [prediction_0_100], active)
+            
+        except Exception as model_error:
+            print(f"⚠️ ML prediction failed: {model_error}, using fallback")
+            with metrics.stage('fallback'):
+                prediction_0_100 = calculate_fallback_trust_score(user_data)
+            used_fallback = True
+    else:
+        # Use fallback if model not loaded
+        print(f"⚠️ Model not available, using fallback calculation")
+        with metrics.stage('fallback'):
+            prediction_0_100 = calculate_fallback_trust_score(user_data)
+        used_fallback = True
+    
+    metrics.count_predictions(ml_model=0 if used_fallback else 1, fallback=1 if used_fallback else 0)
+    
+    # Convert to Likert scale (1-5)
+    trust_rating_likert = convert_to_likert_scale(prediction_0_100)
+    
+    return {
+        'success': True,
+        'trustRating': round(trust_rating_likert, 2),
+        'trustScore': round(prediction_0_100, 2),
+        'method': 'fallback' if used_fallback else 'ml_model',
+        'model': None if used_fallback else model_name,
+        'modelVersion': None if used_fallback else active.version,
+        'message': 'Trust rating calculated successfully'
+    }, 200
 
 @app.route('/predict', methods=['POST'])
 def predict_trust_rating():
@@ -287,58 +923,23 @@ def predict_trust_rating():
         "bioWordCount": 25
     }
     
+    Missing or null fields take their defaults and numeric strings are
+    parsed (see schema.py); any other value is rejected with a 400 naming
+    the field.
+    
+    Optional "role" (e.g. "resolver") picks the model the registry routes
+    that role to, and "model" ("name" or "name@version") picks one
+    explicitly; the default is the MODEL_PATH model.
+    
     Returns trust rating on Likert scale (1-5)
     """
     try:
-        user_data = request.json
-        
-        if not user_data:
-            return jsonify({
-                'error': 'No data provided',
-                'success': False
-            }), 400
-        
-        used_fallback = False
-        
-        # Try ML model first
-        if model is not None:
-            try:
-                # Calculate all features
-                features = calculate_features(user_data)
-                
-                # Create DataFrame with correct column order
-                feature_df = pd.DataFrame([features])
-                
-                # Remove TrustRating from features (it's the target)
-                if 'TrustRating' in feature_df.columns:
-                    feature_df = feature_df.drop(columns=['TrustRating'])
-                
-                # Make prediction (model outputs 0-100)
-                prediction_0_100 = model.predict(feature_df)[0]
-                
-                # Ensure prediction is within 0-100 range first
-                prediction_0_100 = float(max(0.0, min(100.0, prediction_0_100)))
-                
-            except Exception as model_error:
-                print(f"⚠️ ML prediction failed: {model_error}, using fallback")
-                prediction_0_100 = calculate_fallback_trust_score(user_data)
-                used_fallback = True
-        else:
-            # Use fallback if model not loaded
-            print(f"⚠️ Model not available, using fallback calculation")
-            prediction_0_100 = calculate_fallback_trust_score(user_data)
-            used_fallback = True
-        
-        # Convert to Likert scale (1-5)
-        trust_rating_likert = convert_to_likert_scale(prediction_0_100)
-        
-        return jsonify({
-            'success': True,
-            'trustRating': round(trust_rating_likert, 2),
-            'trustScore': round(prediction_0_100, 2),
-            'method': 'fallback' if used_fallback else 'ml_model',
-            'message': 'Trust rating calculated successfully'
-        })
+        with metrics.track_request('predict'):
+            with metrics.stage('parse'):
+                user_data = request.json
+            body, status = predict_response(user_data)
+            with metrics.stage('serialize'):
+                return encoded_response(body, status)
         
     except Exception as e:
         import traceback
@@ -349,6 +950,155 @@ def predict_trust_rating():
             'success': False
         }), 500
 
+def too_many_users(users):
+    """Body and status code for a batch over BATCH_MAX_USERS, else None"""
+    if len(users) <= BATCH_MAX_USERS:
+        return None
+    return {
+        'error': f'Too many users: {len(users)} (at most {BATCH_MAX_USERS} per request; '
+                 f'use /batch-predict/stream for more)',
+        'success': False
+    }, 413
+
+def too_large_response(length):
+    """Body and status code for a request body of length bytes over MAX_REQUEST_BYTES"""
+    return {
+        'error': f'Request body too large: {length} bytes (at most {MAX_REQUEST_BYTES}; '
+                 f'use /batch-predict/stream for more)',
+        'success': False
+    }, 413
+
+@app.before_request
+def reject_oversized_body():
+    """413 for a body over MAX_REQUEST_BYTES before a request thread reads or parses it"""
+    limit = request.max_content_length
+    if limit is not None and request.content_length is not None and request.content_length > limit:
+        body, status = too_large_response(request.content_length)
+        return jsonify(body), status
+
+def batch_predict_response(data):
+    """
+    Body and status code for /batch-predict; shared by the Flask app and
+    asgi.py. Runs in the batch lane and scores with the batch pool, within
+    the request's deadline.
+    """
+    users = data.get('users', [])
+    
+    if not users:
+        return {
+            'error': 'No users provided',
+            'success': False
+        }, 400
+    
+    if not isinstance(users, list):
+        return {
+            'error': 'users must be a list',
+            'success': False
+        }, 400
+    
+    method = data.get('method', 'auto')
+    if method not in SCORING_METHODS:
+        return {
+            'error': f"method must be one of {', '.join(SCORING_METHODS)}",
+            'success': False
+        }, 400
+    
+    shape = data.get('shape', 'rows')
+    if shape not in RESPONSE_SHAPES:
+        return {
+            'error': f"shape must be one of {', '.join(RESPONSE_SHAPES)}",
+            'success': False
+        }, 400
+    
+    too_many = too_many_users(users)
+    if too_many is not None:
+        return too_many
+    
+    deadline_ms = data.get('deadlineMs', BATCH_DEADLINE_MS)
+    if isinstance(deadline_ms, bool) or not isinstance(deadline_ms, (int, float)) or not deadline_ms > 0:
+        return {
+            'error': 'deadlineMs must be a positive number',
+            'success': False
+        }, 400
+    deadline = time.monotonic() + min(deadline_ms, BATCH_DEADLINE_MS) / 1000.0
+    
+    try:
+        model_name, active = registry.resolve(data.get('model'), data.get('role'))
+    except LookupError as e:
+        return {
+            'error': str(e),
+            'success': False
+        }, 400
+    
+    metrics.observe_batch_size(len(users))
+    results = []
+    # 'fallback' skips the model: a cheap approximate ranking
+    if method != 'auto':
+        model_name, active = None, None
+    try:
+        with batch_lane.admit(timeout=deadline - time.monotonic()):
+            scores, fallback, errors = predict_batch(users, active, deadline)
+    except LaneFull as e:
+        return busy_response(e)
+    timed_out = sum(1 for error in errors.values() if error == DEADLINE_EXCEEDED)
+    fallbacks = int(fallback.sum())
+    metrics.count_predictions(ml_model=len(users) - len(errors) - fallbacks, fallback=fallbacks)
+    # Convert to Likert scale (1-5)
+    ratings = convert_to_likert_scale_array(scores)
+    user_ids = [user_data.get('userId') if isinstance(user_data, dict) else None for user_data in users]
+    model_version = active.version if active is not None else None
+    if active is None:
+        model_name = None
+    
+    if shape == 'columns':
+        trust_ratings = [round(rating, 2) for rating in ratings.tolist()]
+        methods = np.where(fallback, 'fallback', 'ml_model').tolist()
+        for index in errors:
+            trust_ratings[index] = methods[index] = None
+        return {
+            'success': True,
+            'columns': {
+                'userId': user_ids,
+                'trustRating': trust_ratings,
+                'method': methods
+            },
+            'rejected': [{'index': index, 'error': error} for index, error in errors.items()],
+            'count': len(users),
+            'errors': len(errors),
+            'timedOut': timed_out,
+            'partial': timed_out > 0,
+            'model': model_name,
+            'modelVersion': model_version
+        }, 200
+    
+    for index, (user_id, trust_rating_likert, used_fallback) in enumerate(
+            zip(user_ids, ratings.tolist(), fallback.tolist())):
+        if index in errors:
+            results.append({
+                'index': index,
+                'userId': user_id,
+                'error': errors[index],
+                'success': False
+            })
+            continue
+        
+        results.append({
+            'userId': user_id,
+            'trustRating': round(trust_rating_likert, 2),
+            'method': 'fallback' if used_fallback else 'ml_model'
+        })
+    
+    return {
+        'success': True,
+        'predictions': results,
+        'count': len(results),
+        'errors': len(errors),
+        'timedOut': timed_out,
+        'partial': timed_out > 0,
+        'model': model_name,
+        'modelVersion': model_version
+    }, 200
+
 @app.route('/batch-predict', methods=['POST'])
 def batch_predict():
     """
@@ -360,70 +1110,405 @@ def batch_predict():
             { user_data_1 },
             { user_data_2 },
             ...
-        ]
+        ],
+        "method": "auto",
+        "shape": "rows",
+        "role": "resolver"
     }
     
+    "role" and "model" choose the model for the whole batch, as for
+    /predict.
+    
+    "method": "fallback" scores every user with the rule-based formula
+    only, skipping the model, for cheap approximate ranking.
+    
+    Users are validated as for /predict; a rejected user gets
+    {"index", "userId", "error", "success": false} in its place in
+    predictions, and "errors" counts them.
+    
+    "shape": "columns" returns parallel arrays instead of one object per
+    user, which is about half the size and encodes faster:
+    {"columns": {"userId": [...], "trustRating": [...], "method": [...]},
+     "rejected": [{"index", "error"}], "count", "errors", "modelVersion"}
+    Rejected users have null trustRating and method.
+    
+    At most BATCH_MAX_USERS users per call (413 beyond that). Scoring runs
+    in chunks, on the request thread and any BATCH_POOL_WORKERS processes,
+    and stops at the deadline: BATCH_DEADLINE_MS,
+    or "deadlineMs" if that is sooner. Users not scored by then are
+    rejected with "Not scored before the request deadline", counted in
+    "timedOut", and "partial" is true; resend just those. A 429 with
+    Retry-After means the batch lane stayed full until the deadline.
+    
     Returns trust ratings on Likert scale (1-5)
     """
     try:
-        data = request.json
-        users = data.get('users', [])
-        
-        if not users:
-            return jsonify({
-                'error': 'No users provided',
-                'success': False
-            }), 400
+        with metrics.track_request('batch_predict'):
+            with metrics.stage('parse'):
+                data = request.json
+            body, status = batch_predict_response(data)
+            with metrics.stage('serialize'):
+                return encoded_response(body, status)
         
-        results = []
-        for user_data in users:
-            used_fallback = False
-            
-            if model is not None:
-                try:
-                    features = calculate_features(user_data)
-                    feature_df = pd.DataFrame([features])
-                    
-                    if 'TrustRating' in feature_df.columns:
-                        feature_df = feature_df.drop(columns=['TrustRating'])
-                    
-                    # Make prediction (model outputs 0-100)
-                    prediction_0_100 = model.predict(feature_df)[0]
-                    prediction_0_100 = float(max(0.0, min(100.0, prediction_0_100)))
-                    
-                except Exception:
-                    prediction_0_100 = calculate_fallback_trust_score(user_data)
-                    used_fallback = True
-            else:
-                prediction_0_100 = calculate_fallback_trust_score(user_data)
-                used_fallback = True
-            
-            # Convert to Likert scale (1-5)
-            trust_rating_likert = convert_to_likert_scale(prediction_0_100)
-            
+    except Exception as e:
+        import traceback
+        print(f"❌ Error during batch prediction: {e}")
+        traceback.print_exc()
+        return jsonify({
+            'error': str(e),
+            'success': False
+        }), 500
+
+def explain_response(data):
+    """
+    Body and status code for /explain; shared by the Flask app and asgi.py.
+    Runs in the explain lane, on the request thread.
+    """
+    users = data.get('users') if isinstance(data, dict) else None
+    if not users or not isinstance(users, list):
+        return {
+            'error': 'No users provided',
+            'success': False
+        }, 400
+    
+    try:
+        model_name, active = registry.resolve(data.get('model'), data.get('role'))
+    except LookupError as e:
+        return {
+            'error': str(e),
+            'success': False
+        }, 400
+    if active is None:
+        # The fallback formula has nothing to decompose
+        return {
+            'error': 'Model not loaded',
+            'success': False
+        }, 503
+    too_many = too_many_users(users)
+    if too_many is not None:
+        return too_many
+    
+    try:
+        with explain_lane.admit():
+            return _explain_response(users, model_name, active)
+    except LaneFull as e:
+        return busy_response(e)
+
+def _explain_response(users, model_name, active):
+    """explain_response() once the explain lane has admitted it"""
+    metrics.observe_batch_size(len(users))
+    with metrics.stage('validate'):
+        raw, errors = USER_SCHEMA.validate_batch(users)
+    valid = np.ones(len(users), dtype=bool)
+    if errors:
+        valid[list(errors)] = False
+        raw = {field: values[valid] for field, values in raw.items()}
+    with metrics.stage('features'):
+        matrix = calculate_features_columns(raw)
+    try:
+        bias, contributions, predictions = active.explain(matrix)
+    except ValueError as e:
+        return {
+            'error': str(e),
+            'success': False
+        }, 503
+    
+    base_score = round(bias, 4)
+    scores = np.minimum(100.0, np.maximum(0.0, predictions))
+    ratings = convert_to_likert_scale_array(scores)
+    # Largest effect first
+    order = np.argsort(-np.abs(contributions), axis=1, kind='stable')
+    explained = zip(np.round(matrix, 4).tolist(), np.round(contributions, 4).tolist(),
+                    order.tolist(), predictions.tolist(), scores.tolist(), ratings.tolist())
+    results = []
+    for index, user_data in enumerate(users):
+        if index in errors:
             results.append({
-                'userId': user_data.get('userId'),
-                'trustRating': round(trust_rating_likert, 2),
-                'method': 'fallback' if used_fallback else 'ml_model'
+                'index': index,
+                'userId': user_data.get('userId') if isinstance(user_data, dict) else None,
+                'error': errors[index],
+                'success': False
             })
+            continue
+        values, contribution, ranked, prediction, score, rating = next(explained)
+        results.append({
+            'userId': user_data.get('userId'),
+            'trustRating': round(rating, 2),
+            'trustScore': round(score, 2),
+            'modelScore': round(prediction, 4),
+            'baseScore': base_score,
+            'contributions': [
+                {'feature': FEATURE_COLUMNS[j], 'value': values[j], 'contribution': contribution[j]}
+                for j in ranked
+            ]
+        })
+    
+    return {
+        'success': True,
+        'explanations': results,
+        'count': len(results),
+        'errors': len(errors),
+        'model': model_name,
+        'modelVersion': active.version
+    }, 200
+
+@app.route('/explain', methods=['POST'])
+def explain():
+    """
+    Per-feature contributions to the model's score for one or more users.
+    
+    Expected JSON body, as for /batch-predict:
+    {
+        "users": [{ user_data_1 }, ...],
+        "role": "resolver"
+    }
+    
+    The decomposition is exact, not sampled: every split on a user's path
+    through every tree credits its change in score to the split's feature,
+    so baseScore (the forest's average) plus the contributions adds up to
+    modelScore, the model's 0-100 output before clamping to trustScore.
+    Contributions are in score points, largest effect first.
+    
+    Returns 503 when no model is loaded; the fallback formula is not
+    explained. Takes at most BATCH_MAX_USERS users (413 beyond that) and
+    runs in its own lane (429 when it stays full).
+    """
+    try:
+        with metrics.track_request('explain'):
+            with metrics.stage('parse'):
+                data = request.json
+            body, status = explain_response(data)
+            with metrics.stage('serialize'):
+                return encoded_response(body, status)
         
+    except Exception as e:
+        import traceback
+        print(f"❌ Error during explanation: {e}")
+        traceback.print_exc()
         return jsonify({
-            'success': True,
-            'predictions': results,
-            'count': len(results)
+            'error': str(e),
+            'success': False
+        }), 500
+
+def stats_not_writable_response():
+    """Body and status code for a stats table write refused under several workers"""
+    return {
+        'error': f'The stats table is read-only: {SERVICE_WORKERS} worker processes would each '
+                 f'keep their own copy. Run a single worker for /stats/events',
+        'success': False
+    }, 503
+
+def stats_events_response(data):
+    """
+    Body and status code for /stats/events; shared by the Flask app and
+    asgi.py
+    """
+    if not STATS_WRITABLE:
+        return stats_not_writable_response()
+    events = data.get('events') if isinstance(data, dict) else None
+    if not events or not isinstance(events, list):
+        return {
+            'error': 'No events provided',
+            'success': False
+        }, 400
+    threshold = data.get('threshold', STATS_EMIT_THRESHOLD)
+    if isinstance(threshold, bool) or not isinstance(threshold, (int, float)) or not threshold >= 0:
+        return {
+            'error': 'threshold must be a number >= 0',
+            'success': False
+        }, 400
+    
+    rows, errors = stats_table.apply(events)
+    active = model
+    metrics.observe_batch_size(len(rows))
+    scores, fallback = score_stats_rows(rows, active)
+    metrics.count_predictions(ml_model=int((~fallback).sum()), fallback=int(fallback.sum()))
+    stats_table.set_latest(rows, scores, fallback)
+    changed, previous = stats_table.take_changed(rows, scores, threshold)
+    
+    results = []
+    for i, user_id in zip(np.flatnonzero(changed), stats_table.user_ids(rows[changed])):
+        prediction_0_100 = float(scores[i])
+        results.append({
+            'userId': user_id,
+            'trustRating': round(convert_to_likert_scale(prediction_0_100), 2),
+            'trustScore': round(prediction_0_100, 2),
+            'previousScore': None if np.isnan(previous[i]) else round(float(previous[i]), 2),
+            'method': 'fallback' if fallback[i] else 'ml_model'
         })
+    
+    return {
+        'success': True,
+        'changed': results,
+        'updated': len(rows),
+        'unchanged': len(rows) - len(results),
+        'errors': [{'index': index, 'error': message} for index, message in errors],
+        'modelVersion': active.version if active is not None else None
+    }, 200
+
+@app.route('/stats/events', methods=['POST'])
+def stats_events():
+    """
+    Apply per-user stat deltas and rescore only the users they touch.
+    
+    Expected JSON body:
+    {
+        "events": [
+            {"userId": "u1", "set": {"transactionCount": 12, ...}},
+            {"userId": "u1", "delta": {"completedTransactions": 1}},
+            {"userId": "u1", "review": 2}
+        ],
+        "threshold": 1.0
+    }
+    
+    "set" stores absolute values (required the first time a user is seen),
+    "delta" adds to them and "review" records one new review of that star
+    rating. Returns the users whose trustScore moved at least threshold
+    points (STATS_EMIT_THRESHOLD by default) since it was last reported,
+    plus the index and reason of every rejected event.
+    """
+    try:
+        with metrics.track_request('stats_events'):
+            with metrics.stage('parse'):
+                data = request.json
+            body, status = stats_events_response(data)
+            with metrics.stage('serialize'):
+                return encoded_response(body, status)
         
     except Exception as e:
         import traceback
-        print(f"❌ Error during batch prediction: {e}")
+        print(f"❌ Error during stats update: {e}")
         traceback.print_exc()
         return jsonify({
             'error': str(e),
             'success': False
         }), 500
 
+def _error_line(index, message):
+    return json.dumps({'index': index, 'error': message, 'success': False})
+
+def _score_stream_chunk(chunk, active):
+    """
+    NDJSON text for a chunk of (index, user_data, error) entries, plus the
+    number of entries USER_SCHEMA rejected; entries with an error are
+    reported as such, in their original position.
+    """
+    valid = [(index, user_data) for index, user_data, error in chunk if error is None]
+    try:
+        with metrics.track_request('batch_predict_stream'):
+            metrics.observe_batch_size(len(valid))
+            scores, fallback, rejected = predict_batch([user_data for _, user_data in valid], active)
+            fallbacks = int(fallback.sum())
+            metrics.count_predictions(ml_model=len(valid) - len(rejected) - fallbacks, fallback=fallbacks)
+    except Exception as e:
+        return '\n'.join(_error_line(index, error or str(e)) for index, _, error in chunk) + '\n', len(valid)
+    
+    results = {}
+    ratings = convert_to_likert_scale_array(scores).tolist()
+    for i, (index, user_data) in enumerate(valid):
+        if i in rejected:
+            results[index] = _error_line(index, rejected[i])
+            continue
+        results[index] = json.dumps({
+            'index': index,
+            'userId': user_data.get('userId'),
+            'trustRating': round(ratings[i], 2),
+            'method': 'fallback' if fallback[i] else 'ml_model'
+        })
+    
+    return '\n'.join(
+        results[index] if error is None else _error_line(index, error)
+        for index, _, error in chunk
+    ) + '\n', len(rejected)
+
+def stream_predictions(lines, active, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Score an iterable of NDJSON lines (one user object per line) in chunks
+    of chunk_size rows, yielding NDJSON result text as each chunk finishes.
+
+    A line that is not a JSON object, or that USER_SCHEMA rejects, produces
+    an error line carrying its index and the stream carries on. The last
+    line is a summary with the row and error counts and the model version
+    used for the whole stream.
+    """
+    chunk = []
+    count = 0
+    errors = 0
+    for index, raw in enumerate(lines):
+        if not raw.strip():
+            continue
+        count += 1
+        try:
+            user_data = json.loads(raw)
+            if not isinstance(user_data, dict):
+                raise ValueError('each line must be a JSON object')
+            chunk.append((index, user_data, None))
+        except ValueError as e:
+            errors += 1
+            chunk.append((index, None, str(e)))
+        
+        if len(chunk) >= chunk_size:
+            text, rejected = _score_stream_chunk(chunk, active)
+            errors += rejected
+            yield text
+            chunk = []
+    
+    if chunk:
+        text, rejected = _score_stream_chunk(chunk, active)
+        errors += rejected
+        yield text
+    
+    yield json.dumps({
+        'done': True,
+        'count': count,
+        'errors': errors,
+        'modelVersion': active.version if active is not None else None
+    }) + '\n'
+
+@app.route('/batch-predict/stream', methods=['POST'])
+def batch_predict_stream():
+    """
+    Bulk scoring over newline-delimited JSON.
+    
+    Request body: one user object per line, same fields as /predict plus
+    userId. Response (application/x-ndjson): one line per input line, in
+    order, then a summary line:
+    
+        {"index": 0, "userId": 1, "trustRating": 3.42, "method": "ml_model"}
+        {"index": 1, "error": "Expecting value: ...", "success": false}
+        {"done": true, "count": 2, "errors": 1, "modelVersion": "..."}
+    
+    The body is read and scored STREAM_CHUNK_SIZE rows at a time, so memory
+    use does not grow with the number of users. ?method=fallback scores
+    with the rule-based formula only, as for /batch-predict; ?model= and
+    ?role= pick the model as the "model" and "role" fields do there.
+    """
+    method = request.args.get('method', 'auto')
+    if method not in SCORING_METHODS:
+        return jsonify({
+            'error': f"method must be one of {', '.join(SCORING_METHODS)}",
+            'success': False
+        }), 400
+    try:
+        _, active = registry.resolve(request.args.get('model'), request.args.get('role'))
+    except LookupError as e:
+        return jsonify({
+            'error': str(e),
+            'success': False
+        }), 400
+    if method != 'auto':
+        active = None
+    lines = (raw.decode('utf-8', errors='replace') for raw in request.stream)
+    return Response(
+        stream_with_context(stream_predictions(lines, active)),
+        mimetype='application/x-ndjson'
+    )
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5001))
+    # Pool workers would import this file again as their main module, and
+    # load every model with it; the dev server scores batches in-thread
+    batch_pool.workers = 0
     print(f"\n{'='*60}")
     print(f"🚀 Starting Flask ML Service on port {port}")
     print(f"📊 Model Status: {'✅ Loaded' if model is not None else '⚠️ Using Fallback'}")
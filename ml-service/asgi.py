@@ -0,0 +1,209 @@
+# asgi.py - Async entry point for the ML service
+#
+# Serves the same /health, /predict, /batch-predict, /stats/events and /explain
+# contracts as app.py, but on an event loop: scoring runs on a bounded thread
+# pool and requests beyond its queue are rejected with 429 instead of
+# waiting indefinitely.
+#
+#   WEB_CONCURRENCY=2 uvicorn asgi:app --host 0.0.0.0 --port 5000
+#
+# WEB_CONCURRENCY rather than --workers, so app.py knows how many processes
+# there are (its stats table only takes writes with one).
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+import app as service
+import metrics
+from serialization import encode_response
+
+# Threads running model.predict; sklearn and NumPy release the GIL for most of it
+ASGI_POOL_WORKERS = int(os.getenv('ASGI_POOL_WORKERS', os.cpu_count() or 2))
+# Scoring jobs allowed to run or wait for a thread before new ones get a 429
+ASGI_MAX_PENDING = int(os.getenv('ASGI_MAX_PENDING', ASGI_POOL_WORKERS * 4))
+# Threads for /batch-predict and /explain, kept apart from the pool above so
+# bulk work waiting for or holding a lane never takes a /predict thread. By
+# default one per slot and queue place of the batch and explain lanes
+ASGI_BULK_WORKERS = int(os.getenv('ASGI_BULK_WORKERS', (
+    service.BATCH_LANE_CONCURRENCY + service.BATCH_LANE_QUEUE
+    + service.EXPLAIN_LANE_CONCURRENCY + service.EXPLAIN_LANE_QUEUE
+)))
+# Seconds a request may wait for its result before giving up with a 503
+ASGI_REQUEST_TIMEOUT = float(os.getenv('ASGI_REQUEST_TIMEOUT', 30))
+
+
+class QueueFull(Exception):
+    pass
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+class BoundedExecutor:
+    """
+    Thread pool that refuses work instead of queueing without limit.
+
+    pending is only touched from the event loop thread (done callbacks run
+    there too), so it needs no lock.
+    """
+
+    def __init__(self, workers, max_pending):
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='score')
+
+    def _release(self, future):
+        self.pending -= 1
+
+    async def run(self, fn, *args, timeout=None):
+        """
+        Run fn(*args) on the pool. Raises QueueFull when max_pending jobs
+        are already running or queued, and asyncio.TimeoutError after
+        timeout seconds. A timed-out job keeps its slot until its thread
+        actually finishes, so abandoned work still counts as load.
+        """
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise QueueFull()
+        self.pending += 1
+        # Carry contextvars (the metrics endpoint label) into the pool thread
+        call = functools.partial(contextvars.copy_context().run, fn, *args)
+        future = asyncio.get_running_loop().run_in_executor(self._pool, call)
+        future.add_done_callback(self._release)
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+
+    def stats(self):
+        return {
+            'pending': self.pending,
+            'max_pending': self.max_pending,
+            'rejected': self.rejected,
+        }
+
+
+executor = BoundedExecutor(ASGI_POOL_WORKERS, ASGI_MAX_PENDING)
+# No queue of its own: a bulk request the lanes would refuse gets its 429
+# here, without waiting for a thread
+bulk_executor = BoundedExecutor(ASGI_BULK_WORKERS, ASGI_BULK_WORKERS)
+# uvicorn imports this module in the worker process that serves requests
+service.start_batch_pool()
+
+
+def _handle_and_encode(handler, data, accept_encoding):
+    """
+    handler(data), serialized (and compressed) on the pool thread so large
+    bodies do not hold up the event loop. Returns (payload, headers, status).
+    """
+    body, status = handler(data)
+    with metrics.stage('serialize'):
+        payload, headers = encode_response(body, accept_encoding)
+    if status == 429:
+        # A full execution lane (see lanes.py)
+        headers['Retry-After'] = '1'
+    return payload, headers, status
+
+
+async def _read_body(request):
+    """
+    The request body. Raises BodyTooLarge(bytes) once it is known to be
+    over service.MAX_REQUEST_BYTES, from Content-Length before reading
+    anything or while reading a body sent without one.
+    """
+    limit = service.MAX_REQUEST_BYTES
+    length = request.headers.get('content-length', '')
+    if limit and length.isdigit() and int(length) > limit:
+        raise BodyTooLarge(int(length))
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if limit and len(body) > limit:
+            raise BodyTooLarge(len(body))
+    return bytes(body)
+
+
+async def _score(request, handler, label, endpoint, pool=executor):
+    """Parse the JSON body and run handler(body) on pool"""
+    with metrics.track_request(endpoint):
+        try:
+            with metrics.stage('parse'):
+                data = json.loads(await _read_body(request))
+        except BodyTooLarge as e:
+            body, status = service.too_large_response(e.args[0])
+            return JSONResponse(body, status_code=status)
+        except Exception as e:
+            return JSONResponse({'error': f'Invalid JSON body: {e}', 'success': False}, status_code=400)
+
+        try:
+            payload, headers, status = await pool.run(
+                _handle_and_encode, handler, data, request.headers.get('accept-encoding'),
+                timeout=ASGI_REQUEST_TIMEOUT
+            )
+            return Response(payload, status_code=status, headers=headers)
+
+        except QueueFull:
+            return JSONResponse(
+                {'error': 'Server busy, retry later', 'success': False},
+                status_code=429, headers={'Retry-After': '1'}
+            )
+        except asyncio.TimeoutError:
+            return JSONResponse(
+                {'error': f'{label} timed out after {ASGI_REQUEST_TIMEOUT:g}s', 'success': False},
+                status_code=503
+            )
+        except Exception as e:
+            print(f"❌ Error during {label}: {e}")
+            traceback.print_exc()
+            return JSONResponse({'error': str(e), 'success': False}, status_code=500)
+
+
+async def health_check(request):
+    """Health check endpoint; answered on the event loop, never queued"""
+    body = service.health_response()
+    body['executor'] = executor.stats()
+    body['bulk_executor'] = bulk_executor.stats()
+    return JSONResponse(body, status_code=503 if body['status'] == 'loading' else 200)
+
+
+async def metrics_endpoint(request):
+    """Prometheus metrics for this worker process"""
+    return Response(service.metrics_response(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+async def predict_trust_rating(request):
+    return await _score(request, service.predict_response, 'prediction', 'predict')
+
+
+async def batch_predict(request):
+    return await _score(request, service.batch_predict_response, 'batch prediction', 'batch_predict', bulk_executor)
+
+
+async def stats_events(request):
+    return await _score(request, service.stats_events_response, 'stats update', 'stats_events')
+
+
+async def explain(request):
+    return await _score(request, service.explain_response, 'explanation', 'explain', bulk_executor)
+
+
+app = Starlette(
+    routes=[
+        Route('/health', health_check, methods=['GET']),
+        Route('/metrics', metrics_endpoint, methods=['GET']),
+        Route('/predict', predict_trust_rating, methods=['POST']),
+        Route('/batch-predict', batch_predict, methods=['POST']),
+        Route('/stats/events', stats_events, methods=['POST']),
+        Route('/explain', explain, methods=['POST']),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+)
@@ -0,0 +1,316 @@
+# batch_score.py - Offline bulk scoring of CSV and Parquet files
+#
+# Scores historical stat snapshots for backtesting without going through the
+# HTTP service. Uses the same feature engineering and model loading as app.py:
+#
+#   python batch_score.py snapshots.parquet scores.parquet --workers 4
+#
+# Input columns use the /predict field names (portfolioCount, averageRatings,
+# ...). Cells are validated by the API's schema (schema.py): missing columns
+# and empty cells take its defaults, and rows it would reject are written
+# with method "rejected" and the API's error message.
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from features import (
+    RAW_FIELD_DEFAULTS, calculate_fallback_trust_score,
+    calculate_fallback_trust_score_columns, calculate_features,
+    calculate_features_columns,
+    convert_to_likert_scale, convert_to_likert_scale_array
+)
+from model_loader import FEATURE_COLUMNS, load_model_bundle
+from schema import USER_SCHEMA
+
+# Model used by score_chunk(); set by load() in the main process and in
+# every worker (inherited on fork, loaded again on spawn)
+_model = None
+_model_error = None
+
+
+def file_format(path):
+    """'csv' or 'parquet', from the file extension"""
+    name = path.lower()
+    if name.endswith(('.parquet', '.pq')):
+        return 'parquet'
+    if name.endswith(('.csv', '.csv.gz', '.csv.bz2', '.csv.zip', '.csv.xz')):
+        return 'csv'
+    raise ValueError(f"Unsupported file type: {path} (expected .csv or .parquet)")
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise SystemExit("❌ Parquet support needs pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+def read_chunks(path, chunk_size, dtype=None):
+    """
+    Yield the rows of a CSV or Parquet file as DataFrames of up to
+    chunk_size rows. dtype maps CSV columns to types (Parquet files carry
+    their own).
+    """
+    if file_format(path) == 'csv':
+        # round_trip parses floats exactly as they were written
+        yield from pd.read_csv(path, chunksize=chunk_size, float_precision='round_trip', dtype=dtype)
+        return
+
+    pa = _import_pyarrow()
+    for batch in pa.parquet.ParquetFile(path).iter_batches(batch_size=chunk_size):
+        yield batch.to_pandas()
+
+
+class ChunkWriter:
+    """Append scored chunks to a CSV or Parquet file, opened on the first write"""
+
+    def __init__(self, path):
+        self.path = path
+        self.format = file_format(path)
+        self.rows = 0
+        self._parquet = None
+
+    def write(self, frame):
+        if self.format == 'csv':
+            frame.to_csv(self.path, mode='w' if self.rows == 0 else 'a',
+                         header=self.rows == 0, index=False)
+        else:
+            pa = _import_pyarrow()
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._parquet is None:
+                self._parquet = pa.parquet.ParquetWriter(self.path, table.schema)
+            self._parquet.write_table(table.cast(self._parquet.schema))
+        self.rows += len(frame)
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+        elif self.rows == 0 and self.format == 'csv':
+            # Empty input still produces a file with a header
+            pd.DataFrame(columns=['trustScore', 'trustRating', 'method', 'error']).to_csv(self.path, index=False)
+
+
+def load(model_path, inference_engine, mmap_mode, model_format='auto'):
+    """Load the model into this process. Failures leave every row on the fallback formula."""
+    global _model, _model_error
+    if _model is not None or _model_error is not None:
+        return _model
+    try:
+        _model = load_model_bundle(model_path, inference_engine, mmap_mode, model_format)
+    except Exception as e:
+        _model_error = str(e)
+        print(f"⚠️ Could not load model ({e}), scoring with the fallback formula")
+    return _model
+
+
+def raw_columns(frame):
+    """
+    Raw model inputs of a chunk, validated and coerced by USER_SCHEMA
+    exactly as the API does its payloads. Returns (raw, errors): float64
+    columns for every field, and the message for the index of every row
+    the schema rejects.
+
+    Missing columns and empty cells take RAW_FIELD_DEFAULTS, like missing
+    or null fields. Numbers and numeric text are used as numbers; booleans,
+    other text and values beyond MAX_VECTOR_VALUE reject the row.
+    """
+    columns = {
+        field: frame[field].astype(object).where(frame[field].notna(), None).tolist()
+        for field in RAW_FIELD_DEFAULTS if field in frame.columns
+    }
+    return USER_SCHEMA.validate_columns(columns, len(frame))
+
+
+def _score_row(user_data, active):
+    """Per-row scoring: the model, or the fallback formula when it is missing or fails"""
+    if active is None:
+        return calculate_fallback_trust_score(user_data), True
+    try:
+        features = calculate_features(user_data)
+        row = np.array([[features[c] for c in FEATURE_COLUMNS]], dtype=np.float64)
+        return float(max(0.0, min(100.0, active.predict(row)[0]))), False
+    except Exception:
+        return calculate_fallback_trust_score(user_data), True
+
+
+def score_chunk(frame, keep_columns=()):
+    """
+    Score one chunk with the process's model. Returns a DataFrame with the
+    keep_columns, trustScore (0-100), trustRating (1-5), method
+    ('ml_model', 'fallback' or 'rejected') and error (the schema's message
+    for a rejected row, else empty). Scores are not rounded; rejected rows
+    have none.
+
+    Without a model, valid rows get the fallback formula on whole columns
+    (same scores as the per-row formula).
+    """
+    active = _model
+    raw, errors = raw_columns(frame)
+    rejected = np.zeros(len(frame), dtype=bool)
+    rejected[list(errors)] = True
+    vectorizable = ~rejected
+    scores = np.full(len(frame), np.nan)
+    ratings = np.full(len(frame), np.nan)
+    fallback = np.zeros(len(frame), dtype=bool)
+    pending = np.zeros(len(frame), dtype=bool)
+
+    if active is None:
+        predictions = calculate_fallback_trust_score_columns({f: v[vectorizable] for f, v in raw.items()})
+        scores[vectorizable] = predictions
+        ratings[vectorizable] = convert_to_likert_scale_array(predictions)
+        fallback[vectorizable] = True
+    elif vectorizable.any():
+        try:
+            matrix = calculate_features_columns({f: v[vectorizable] for f, v in raw.items()})
+            predictions = np.minimum(100.0, np.maximum(0.0, active.predict(matrix)))
+            scores[vectorizable] = predictions
+            ratings[vectorizable] = convert_to_likert_scale_array(predictions)
+        except Exception as e:
+            print(f"⚠️ Batched prediction failed: {e}, scoring rows individually")
+            pending = vectorizable
+
+    for i in np.flatnonzero(pending):
+        scores[i], fallback[i] = _score_row({f: v[i].item() for f, v in raw.items()}, active)
+        ratings[i] = convert_to_likert_scale(scores[i])
+
+    out = frame[list(keep_columns)].reset_index(drop=True)
+    out['trustScore'] = scores
+    out['trustRating'] = ratings
+    out['method'] = np.where(rejected, 'rejected', np.where(fallback, 'fallback', 'ml_model'))
+    messages = np.full(len(frame), '', dtype=object)
+    for i, message in errors.items():
+        messages[i] = message
+    out['error'] = messages
+    return out
+
+
+def peak_memory_mb():
+    """Peak RSS of this process and of its largest finished child, in MB"""
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    scale = 1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0
+    main = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return main, children
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Score a CSV or Parquet file of user stats with the trust model.'
+    )
+    parser.add_argument('input', help='Input .csv or .parquet file')
+    parser.add_argument('output', help='Output .csv or .parquet file')
+    parser.add_argument('--model', default=os.getenv('MODEL_PATH', './models/trust_pipeline_best.joblib'),
+                        help='Model file (default: $MODEL_PATH or ./models/trust_pipeline_best.joblib)')
+    parser.add_argument('--engine', choices=['sklearn', 'compiled'],
+                        default=os.getenv('INFERENCE_ENGINE', 'sklearn'),
+                        help='Inference engine (default: $INFERENCE_ENGINE or sklearn)')
+    parser.add_argument('--mmap-mode', default=os.getenv('MODEL_MMAP_MODE') or None,
+                        help="joblib mmap_mode for the model file, e.g. 'r'")
+    parser.add_argument('--format', dest='model_format', choices=['auto', 'joblib', 'npz'],
+                        default=os.getenv('MODEL_FORMAT', 'auto'),
+                        help='Model file format (default: $MODEL_FORMAT or auto)')
+    parser.add_argument('--fallback-only', action='store_true',
+                        help='Skip the model and score with the fallback formula only (cheap approximate ranking)')
+    parser.add_argument('--chunk-size', type=int, default=50000,
+                        help='Rows read and scored at a time (default: 50000)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Scoring processes; 0 means one per CPU (default: 1)')
+    parser.add_argument('--keep', default=None,
+                        help='Comma-separated input columns copied to the output (default: userId, if present)')
+    args = parser.parse_args(argv)
+    if args.chunk_size <= 0:
+        parser.error('--chunk-size must be positive')
+    if args.workers < 0:
+        parser.error('--workers must be 0 or more')
+    return args
+
+
+def _keep_columns(requested, frame):
+    if requested is None:
+        return ['userId'] if 'userId' in frame.columns else []
+    columns = [c.strip() for c in requested.split(',') if c.strip()]
+    missing = [c for c in columns if c not in frame.columns]
+    if missing:
+        raise SystemExit(f"❌ Columns not in input: {', '.join(missing)}")
+    return columns
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workers = args.workers or os.cpu_count() or 1
+    started = time.perf_counter()
+
+    active = None if args.fallback_only else load(args.model, args.engine, args.mmap_mode, args.model_format)
+    if args.fallback_only:
+        print("📐 --fallback-only: scoring with the fallback formula")
+    elif active is not None:
+        print(f"📦 Model {active.version} ({active.engine}) loaded in {active.load_seconds:.2f}s")
+
+    writer = ChunkWriter(args.output)
+    rows = fallback_rows = rejected_rows = 0
+    keep = None
+
+    def write(scored):
+        nonlocal rows, fallback_rows, rejected_rows
+        writer.write(scored)
+        rows += len(scored)
+        fallback_rows += int((scored['method'] == 'fallback').sum())
+        rejected_rows += int((scored['method'] == 'rejected').sum())
+        print(f"📊 {rows:,} rows scored ({rows / (time.perf_counter() - started):,.0f} rows/sec)")
+
+    pool = None
+    try:
+        if workers > 1:
+            # Workers forked from here inherit the loaded model
+            pool = multiprocessing.Pool(workers) if args.fallback_only else multiprocessing.Pool(
+                workers, initializer=load, initargs=(args.model, args.engine, args.mmap_mode, args.model_format)
+            )
+        # Bound the chunks in flight so memory stays flat however big the input is
+        in_flight = deque()
+        for chunk in read_chunks(args.input, args.chunk_size):
+            if keep is None:
+                keep = _keep_columns(args.keep, chunk)
+            if pool is None:
+                write(score_chunk(chunk, keep))
+                continue
+            in_flight.append(pool.apply_async(score_chunk, (chunk, keep)))
+            if len(in_flight) >= workers * 2:
+                write(in_flight.popleft().get())
+        while in_flight:
+            write(in_flight.popleft().get())
+    finally:
+        if pool is not None:
+            # Every result has been collected (or we are bailing out)
+            pool.terminate()
+            pool.join()
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    main_mb, worker_mb = peak_memory_mb()
+    print(f"✅ Scored {rows:,} rows into {args.output} in {elapsed:.2f}s "
+          f"({rows / elapsed if elapsed else 0:,.0f} rows/sec)")
+    print(f"   ml_model: {rows - fallback_rows - rejected_rows:,}  fallback: {fallback_rows:,}  "
+          f"rejected: {rejected_rows:,}  "
+          f"model: {active.version if active is not None else 'none'}  workers: {workers}")
+    if main_mb is not None:
+        memory = f"   peak RSS: {main_mb:.0f} MB"
+        if pool is not None:
+            memory += f" (largest worker {worker_mb:.0f} MB)"
+        print(memory)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
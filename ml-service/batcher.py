@@ -0,0 +1,135 @@
+# batcher.py - Coalesce concurrent single-row predictions into one model call
+#
+# Request threads hand their feature row to a MicroBatcher and block. A
+# collector thread gathers rows until max_batch_size is reached or
+# max_wait_seconds has passed since the first one arrived, runs a single
+# predict() for all of them and wakes every caller with its own result.
+import os
+import threading
+import time
+
+import numpy as np
+
+import metrics
+
+
+class _Pending:
+    __slots__ = ('matrix', 'active', 'done', 'result', 'error')
+
+    def __init__(self, matrix, active):
+        self.matrix = matrix
+        self.active = active
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Dynamic batching for model.predict().
+
+    Only helps when several requests are in flight in the same process
+    (threaded gunicorn workers, the ASGI pool, Flask's threaded dev server).
+    Rows scored by different model objects (e.g. across a hot reload) are
+    never mixed in one predict() call.
+    """
+
+    # Upper bounds of the batch size histogram buckets
+    SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+    def __init__(self, max_batch_size=32, max_wait_seconds=0.002):
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self._cond = threading.Condition()
+        self._queue = []
+        self._queued_rows = 0
+        self._thread_pid = None
+        self.batches = 0
+        self.rows = 0
+        self.max_seen = 0
+        self.size_histogram = {bucket: 0 for bucket in self.SIZE_BUCKETS}
+        self.size_histogram['+Inf'] = 0
+
+    def _ensure_collector(self):
+        """Start the collector thread in this process (again after a fork). Caller holds the lock."""
+        if self._thread_pid == os.getpid():
+            return
+        self._thread_pid = os.getpid()
+        threading.Thread(target=self._collect, name='predict-batcher', daemon=True).start()
+
+    def predict(self, matrix, active):
+        """Score matrix with active.predict() as part of a shared batch"""
+        item = _Pending(matrix, active)
+        with self._cond:
+            self._ensure_collector()
+            self._queue.append(item)
+            self._queued_rows += len(matrix)
+            self._cond.notify()
+        item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _collect(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.max_wait_seconds
+                while self._queued_rows < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                batch, rows = [], 0
+                while self._queue and (not batch or rows + len(self._queue[0].matrix) <= self.max_batch_size):
+                    item = self._queue.pop(0)
+                    batch.append(item)
+                    rows += len(item.matrix)
+                self._queued_rows -= rows
+
+            self._record(rows)
+            with metrics.endpoint('predict_coalesced'):
+                self._flush(batch)
+
+    def _flush(self, batch):
+        groups = {}
+        for item in batch:
+            groups.setdefault(id(item.active), []).append(item)
+
+        for items in groups.values():
+            try:
+                predictions = items[0].active.predict(np.vstack([item.matrix for item in items]))
+                offset = 0
+                for item in items:
+                    item.result = predictions[offset:offset + len(item.matrix)]
+                    offset += len(item.matrix)
+            except Exception as e:
+                for item in items:
+                    item.error = e
+            finally:
+                for item in items:
+                    item.done.set()
+
+    def _record(self, rows):
+        self.batches += 1
+        self.rows += rows
+        self.max_seen = max(self.max_seen, rows)
+        for bucket in self.SIZE_BUCKETS:
+            if rows <= bucket:
+                self.size_histogram[bucket] += 1
+                break
+        else:
+            self.size_histogram['+Inf'] += 1
+
+    def stats(self):
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait_seconds * 1000.0,
+            'batches': self.batches,
+            'rows': self.rows,
+            'mean_batch_size': round(self.rows / self.batches, 2) if self.batches else 0.0,
+            'max_batch_size_seen': self.max_seen,
+            'batch_size_histogram': {str(k): v for k, v in self.size_histogram.items()},
+        }
@@ -0,0 +1,403 @@
+# benchmark.py - Reproducible latency, throughput and memory benchmarks
+#
+# Trains a fresh model with retrain_model.py in a scratch directory, serves
+# it with gunicorn on a local port and measures the service end to end:
+#
+#   python benchmark.py --output results.json
+#   python benchmark.py --compare before.json after.json
+#
+# Payloads come from a seeded generator, so two runs on the same machine
+# send exactly the same requests. Results are written as JSON; --compare
+# prints the change of every metric between two result files.
+import argparse
+import http.client
+import importlib.metadata
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+BATCH_SIZES = (1, 10, 100, 1000, 10000)
+# Cap on /batch-predict calls per size, so small sizes don't dominate the run
+MAX_BATCH_CALLS = 500
+
+
+def generate_users(n, seed=0):
+    """n /predict payloads with plausible, varied stats"""
+    rng = random.Random(seed)
+    users = []
+    for i in range(n):
+        transactions = rng.randint(0, 150)
+        completed = int(transactions * rng.uniform(0.6, 1.0))
+        reviews = int(completed * rng.uniform(0.2, 0.8))
+        positive = int(reviews * rng.uniform(0.5, 0.9))
+        neutral = int((reviews - positive) * rng.uniform(0.0, 1.0))
+        bio_length = rng.randint(0, 500)
+        users.append({
+            'userId': i,
+            'portfolioCount': rng.randint(0, 25),
+            'averageRatings': round(rng.uniform(1.5, 5.0), 3),
+            'transactionCount': transactions,
+            'completedTransactions': completed,
+            'reviewCount': reviews,
+            'starCount': int(reviews * rng.uniform(3, 5)),
+            'positiveReviews': positive,
+            'neutralReviews': neutral,
+            'negativeReviews': reviews - positive - neutral,
+            'bioLength': bio_length,
+            'bioWordCount': int(bio_length / rng.uniform(4, 8)),
+        })
+    return users
+
+
+def percentiles(samples_ms):
+    """p50/p95/p99/mean/max of a list of latencies in milliseconds"""
+    ordered = sorted(samples_ms)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+
+    return {
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+        'mean_ms': round(statistics.fmean(ordered), 3),
+        'max_ms': round(ordered[-1], 3),
+        'samples': len(ordered),
+    }
+
+
+def train_model(workdir):
+    """Run retrain_model.py in workdir; returns (model path, seconds)"""
+    print(f"🎯 Training a fresh model in {workdir}")
+    started = time.perf_counter()
+    with open(os.path.join(workdir, 'retrain.log'), 'w') as log:
+        subprocess.run(
+            [sys.executable, os.path.join(SERVICE_DIR, 'retrain_model.py')],
+            cwd=workdir, stdout=log, stderr=subprocess.STDOUT, check=True
+        )
+    return os.path.join(workdir, 'models', 'trust_pipeline_best.joblib'), time.perf_counter() - started
+
+
+def bench_cold_start(model_path, repeats):
+    """
+    Import app.py in fresh interpreters. import_seconds covers Flask,
+    pandas and sklearn imports plus load_model(); load_model_seconds is
+    the model load and smoke test alone.
+    """
+    probe = (
+        "import json, time\n"
+        "started = time.perf_counter()\n"
+        "import app\n"
+        "print(json.dumps({'import_seconds': time.perf_counter() - started,"
+        " 'load_model_seconds': app.model.load_seconds if app.model else None}))\n"
+    )
+    env = dict(os.environ, MODEL_PATH=model_path, MODEL_WATCH_INTERVAL='0', MODEL_LOAD_MODE='sync')
+    runs = []
+    for _ in range(repeats):
+        out = subprocess.run(
+            [sys.executable, '-c', probe], cwd=SERVICE_DIR, env=env,
+            capture_output=True, text=True, check=True
+        ).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+    return {
+        key: {
+            'median_s': round(statistics.median(r[key] for r in runs), 4),
+            'min_s': round(min(r[key] for r in runs), 4),
+        }
+        for key in ('import_seconds', 'load_model_seconds')
+    }
+
+
+def bench_features(users, repeats):
+    """Per-call cost of calculate_features() and the fallback formula, in microseconds"""
+    sys.path.insert(0, SERVICE_DIR)
+    from features import (
+        calculate_fallback_trust_score, calculate_fallback_trust_score_columns,
+        calculate_features, calculate_features_columns
+    )
+    from schema import USER_SCHEMA
+
+    def per_call_us(fn, loops):
+        best = min(timeit.repeat(fn, number=1, repeat=repeats))
+        return round(best / loops * 1e6, 3)
+
+    sample = users[:1000]
+    raw, _ = USER_SCHEMA.validate_batch(sample)
+    return {
+        'calculate_features_us': per_call_us(
+            lambda: [calculate_features(u) for u in sample], len(sample)),
+        'calculate_fallback_trust_score_us': per_call_us(
+            lambda: [calculate_fallback_trust_score(u) for u in sample], len(sample)),
+        'validate_batch_us_per_row': per_call_us(
+            lambda: USER_SCHEMA.validate_batch(sample), len(sample)),
+        'calculate_features_columns_us_per_row': per_call_us(
+            lambda: calculate_features_columns(raw), len(sample)),
+        'calculate_fallback_trust_score_columns_us_per_row': per_call_us(
+            lambda: calculate_fallback_trust_score_columns(raw), len(sample)),
+    }
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Server:
+    """The service under gunicorn.conf.py on a local port"""
+
+    def __init__(self, model_path, workers, workdir, startup_timeout=180):
+        self.port = _free_port()
+        env = dict(os.environ)
+        env.update(
+            MODEL_PATH=model_path,
+            GUNICORN_BIND=f'127.0.0.1:{self.port}',
+            GUNICORN_WORKERS=str(workers),
+            MODEL_WATCH_INTERVAL='0',
+        )
+        # Measure the model, not the cache, unless the caller asks for it
+        env.setdefault('PREDICTION_CACHE_SIZE', '0')
+        self.cache_size = env['PREDICTION_CACHE_SIZE']
+        self._log = open(os.path.join(workdir, 'gunicorn.log'), 'w')
+        started = time.perf_counter()
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+            cwd=SERVICE_DIR, env=env, stdout=self._log, stderr=subprocess.STDOUT
+        )
+        self.startup_seconds = self._wait_ready(startup_timeout, started)
+
+    def _wait_ready(self, timeout, started):
+        while time.perf_counter() - started < timeout:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with {self.process.returncode}, see {self._log.name}")
+            try:
+                status, body = self.request('GET', '/health')
+                if status == 200 and body.get('model_loaded'):
+                    return time.perf_counter() - started
+            except OSError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"Service not ready after {timeout}s, see {self._log.name}")
+
+    def request(self, method, path, payload=None):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=300)
+        try:
+            body = json.dumps(payload) if payload is not None else None
+            conn.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            conn.close()
+
+    def worker_pids(self):
+        pids = []
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    # ppid is the 2nd field after the parenthesised command name
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            if ppid == self.process.pid:
+                pids.append(int(entry))
+        return pids
+
+    def stop(self):
+        self.process.send_signal(signal.SIGTERM)
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self._log.close()
+
+
+def process_memory_mb(pid):
+    """RSS, PSS and USS of a process from /proc/<pid>/smaps_rollup (Linux only)"""
+    fields = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1]) / 1024.0
+    except OSError:
+        return None
+    return {
+        'rss_mb': round(fields.get('Rss', 0.0), 1),
+        'pss_mb': round(fields.get('Pss', 0.0), 1),
+        'uss_mb': round(fields.get('Private_Clean', 0.0) + fields.get('Private_Dirty', 0.0), 1),
+    }
+
+
+def bench_predict(server, users, requests, warmup):
+    for user in users[:warmup]:
+        server.request('POST', '/predict', user)
+    samples = []
+    for user in users[warmup:warmup + requests]:
+        started = time.perf_counter()
+        status, body = server.request('POST', '/predict', user)
+        samples.append((time.perf_counter() - started) * 1000.0)
+        if status != 200 or body.get('method') != 'ml_model':
+            raise RuntimeError(f"/predict returned {status}: {body}")
+    return percentiles(samples)
+
+
+def bench_batch(server, users, rows_per_size):
+    results = {}
+    for size in BATCH_SIZES:
+        calls = max(5, min(MAX_BATCH_CALLS, rows_per_size // size))
+        server.request('POST', '/batch-predict', {'users': users[:size]})  # warm-up
+        samples = []
+        for call in range(calls):
+            offset = (call * size) % max(1, len(users) - size)
+            payload = {'users': users[offset:offset + size]}
+            started = time.perf_counter()
+            status, body = server.request('POST', '/batch-predict', payload)
+            samples.append((time.perf_counter() - started) * 1000.0)
+            if status != 200 or body.get('count') != size:
+                raise RuntimeError(f"/batch-predict returned {status} for {size} users")
+        result = percentiles(samples)
+        result['rows_per_sec'] = round(size * calls / (sum(samples) / 1000.0), 1)
+        results[str(size)] = result
+        print(f"   batch {size:>5}: {result['rows_per_sec']:>10,.0f} rows/sec, p50 {result['p50_ms']} ms")
+    return results
+
+
+def environment_info():
+    info = {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+    for package in ('numpy', 'pandas', 'scikit-learn', 'flask', 'gunicorn'):
+        try:
+            info[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            info[package] = None
+    try:
+        info['git_commit'] = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=SERVICE_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        info['git_commit'] = None
+    return info
+
+
+def run(args):
+    results = {
+        'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': environment_info(),
+        'settings': {
+            'seed': args.seed, 'requests': args.requests, 'warmup': args.warmup,
+            'batch_rows': args.batch_rows, 'workers': args.workers,
+            'inference_engine': os.getenv('INFERENCE_ENGINE', 'sklearn'),
+        },
+    }
+    users = generate_users(max(args.requests + args.warmup, max(BATCH_SIZES) * 2), args.seed)
+
+    with tempfile.TemporaryDirectory(prefix='ml-bench-') as workdir:
+        model_path = args.model
+        if model_path is None:
+            model_path, train_seconds = train_model(workdir)
+            results['train_seconds'] = round(train_seconds, 2)
+        results['model_size_kb'] = round(os.path.getsize(model_path) / 1024.0, 1)
+
+        print("🧊 Cold start")
+        results['cold_start'] = bench_cold_start(model_path, args.cold_starts)
+
+        print("🔬 Feature microbenchmarks")
+        results['microbenchmarks'] = bench_features(users, repeats=5)
+
+        print(f"🚀 Starting gunicorn with {args.workers} workers")
+        server = Server(model_path, args.workers, workdir)
+        try:
+            results['settings']['prediction_cache_size'] = server.cache_size
+            results['server_startup_seconds'] = round(server.startup_seconds, 2)
+
+            print(f"⏱️ /predict latency over {args.requests} requests")
+            results['predict'] = bench_predict(server, users, args.requests, args.warmup)
+
+            print("📦 /batch-predict throughput")
+            results['batch_predict'] = bench_batch(server, users, args.batch_rows)
+
+            results['worker_memory'] = [
+                memory for memory in map(process_memory_mb, server.worker_pids()) if memory
+            ]
+        finally:
+            server.stop()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    predict = results['predict']
+    print(f"✅ /predict p50 {predict['p50_ms']} ms, p95 {predict['p95_ms']} ms, p99 {predict['p99_ms']} ms")
+    print(f"💾 Results written to {args.output}")
+
+
+def flatten(results, prefix=''):
+    """Numeric leaves of a results dict as {'a.b.c': value}"""
+    flat = {}
+    for key, value in results.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        elif isinstance(value, list):
+            flat.update(flatten({str(i): v for i, v in enumerate(value)}, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = flatten(json.load(f))
+    with open(after_path) as f:
+        after = flatten(json.load(f))
+    skip = ('settings.', 'environment.')
+    width = max((len(k) for k in before), default=10)
+    print(f"{'metric':<{width}}  {'before':>12}  {'after':>12}  {'change':>8}")
+    for key in sorted(set(before) & set(after)):
+        if key.startswith(skip):
+            continue
+        old, new = before[key], after[key]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else 'n/a'
+        print(f"{key:<{width}}  {old:>12g}  {new:>12g}  {change:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the trust rating ML service.')
+    parser.add_argument('--output', default='benchmark_results.json', help='Results file (JSON)')
+    parser.add_argument('--model', default=None,
+                        help='Benchmark this model file instead of training a fresh one')
+    parser.add_argument('--seed', type=int, default=0, help='Payload generator seed')
+    parser.add_argument('--requests', type=int, default=1000, help='Timed /predict requests')
+    parser.add_argument('--warmup', type=int, default=50, help='Untimed /predict requests first')
+    parser.add_argument('--batch-rows', type=int, default=20000,
+                        help='Rows sent per /batch-predict batch size')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--cold-starts', type=int, default=3, help='Fresh imports of app.py to time')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='Compare two results files instead of running')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
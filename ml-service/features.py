@@ -0,0 +1,296 @@
+# features.py - Feature engineering and rule-based scoring for trust ratings
+#
+# Shared by the Flask service and the offline scorer (batch_score.py), so
+# neither has to import the other to turn raw user stats into model input.
+import numpy as np
+
+def safe_div(a, b):
+    """Safe division to avoid divide by zero"""
+    return a / b if b != 0 else 0.0
+
+def calculate_features(user_data):
+    """
+    Calculate all features needed by the model from user data.
+    This mirrors the preprocessing in Data_Preprocessing.ipynb
+    """
+    # Extract raw data
+    portfolio_count = user_data.get('portfolioCount', 0)
+    avg_ratings = user_data.get('averageRatings', 1.0)
+    transaction_count = user_data.get('transactionCount', 0)
+    completed_transactions = user_data.get('completedTransactions', 0)
+    review_count = user_data.get('reviewCount', 0)
+    star_count = user_data.get('starCount', 0)
+    positive_reviews = user_data.get('positiveReviews', 0)
+    neutral_reviews = user_data.get('neutralReviews', 0)
+    negative_reviews = user_data.get('negativeReviews', 0)
+    bio_length = user_data.get('bioLength', 0)
+    bio_word_count = user_data.get('bioWordCount', 0)
+    
+    # Ensure non-negative values
+    portfolio_count = max(0, portfolio_count)
+    avg_ratings = max(1.0, min(5.0, avg_ratings))
+    transaction_count = max(0, transaction_count)
+    completed_transactions = max(0, completed_transactions)
+    review_count = max(0, review_count)
+    star_count = max(0, star_count)
+    positive_reviews = max(0, positive_reviews)
+    neutral_reviews = max(0, neutral_reviews)
+    negative_reviews = max(0, negative_reviews)
+    
+    # Ensure consistency
+    transaction_count = max(transaction_count, completed_transactions)
+    total_sentiment_reviews = positive_reviews + neutral_reviews + negative_reviews
+    review_count = max(review_count, total_sentiment_reviews)
+    
+    # Calculate derived features
+    completion_rate = safe_div(completed_transactions * 100.0, transaction_count)
+    completion_rate = min(100.0, max(0.0, completion_rate))
+    
+    cancelled = max(0, transaction_count - completed_transactions)
+    cancellation_rate = safe_div(cancelled * 100.0, transaction_count)
+    cancellation_rate = min(100.0, max(0.0, cancellation_rate))
+    
+    positive_review_ratio = safe_div(positive_reviews, review_count)
+    positive_review_ratio = min(1.0, max(0.0, positive_review_ratio))
+    
+    review_coverage = safe_div(review_count, transaction_count)
+    review_coverage = min(1.0, max(0.0, review_coverage))
+
+    engagement_index = (
+        transaction_count + 
+        review_count + 
+        portfolio_count + 
+        bio_length + 
+        bio_word_count
+    )
+    
+    # Create feature dictionary matching model's expected input
+    features = {
+        'PortfolioCount': portfolio_count,
+        'AverageRatings': avg_ratings,
+        'TransactionCount': transaction_count,
+        'CompletedTransactions': completed_transactions,
+        'ReviewCount': review_count,
+        'StarCount': star_count,
+        'PositiveReviews': positive_reviews,
+        'NeutralReviews': neutral_reviews,
+        'NegativeReviews': negative_reviews,
+        'CompletionRate': completion_rate,
+        'CancellationRate': cancellation_rate,
+        'BioLength': bio_length,
+        'BioWordCount': bio_word_count,
+        'PositiveReviewRatio': positive_review_ratio,
+        'ReviewCoverage': review_coverage,
+        'EngagementIndex': engagement_index,
+        'TrustRating': 0  # Placeholder, will be predicted
+    }
+    
+    return features
+
+# Raw payload fields read by calculate_features(), with their defaults
+RAW_FIELD_DEFAULTS = {
+    'portfolioCount': 0,
+    'averageRatings': 1.0,
+    'transactionCount': 0,
+    'completedTransactions': 0,
+    'reviewCount': 0,
+    'starCount': 0,
+    'positiveReviews': 0,
+    'neutralReviews': 0,
+    'negativeReviews': 0,
+    'bioLength': 0,
+    'bioWordCount': 0,
+}
+
+# Largest magnitude we vectorize; keeps every integer sum exact in float64
+MAX_VECTOR_VALUE = 2 ** 50
+
+def _safe_div_array(a, b):
+    """Vectorized safe_div(): a / b where b != 0, else 0.0"""
+    return np.divide(a, b, out=np.zeros(len(a)), where=(b != 0))
+
+def calculate_features_columns(raw):
+    """
+    calculate_features() on whole columns: raw maps every RAW_FIELD_DEFAULTS
+    field to a float64 array of finite values within MAX_VECTOR_VALUE, as
+    schema.USER_SCHEMA.validate_batch() produces.
+
+    Returns a float64 matrix with one row per element in FEATURE_COLUMNS order.
+    """
+    # Ensure non-negative values
+    portfolio_count = np.maximum(0, raw['portfolioCount'])
+    avg_ratings = np.maximum(1.0, np.minimum(5.0, raw['averageRatings']))
+    transaction_count = np.maximum(0, raw['transactionCount'])
+    completed_transactions = np.maximum(0, raw['completedTransactions'])
+    review_count = np.maximum(0, raw['reviewCount'])
+    star_count = np.maximum(0, raw['starCount'])
+    positive_reviews = np.maximum(0, raw['positiveReviews'])
+    neutral_reviews = np.maximum(0, raw['neutralReviews'])
+    negative_reviews = np.maximum(0, raw['negativeReviews'])
+    bio_length = raw['bioLength']
+    bio_word_count = raw['bioWordCount']
+
+    # Ensure consistency
+    transaction_count = np.maximum(transaction_count, completed_transactions)
+    total_sentiment_reviews = positive_reviews + neutral_reviews + negative_reviews
+    review_count = np.maximum(review_count, total_sentiment_reviews)
+
+    # Calculate derived features
+    completion_rate = _safe_div_array(completed_transactions * 100.0, transaction_count)
+    completion_rate = np.minimum(100.0, np.maximum(0.0, completion_rate))
+
+    cancelled = np.maximum(0, transaction_count - completed_transactions)
+    cancellation_rate = _safe_div_array(cancelled * 100.0, transaction_count)
+    cancellation_rate = np.minimum(100.0, np.maximum(0.0, cancellation_rate))
+
+    positive_review_ratio = _safe_div_array(positive_reviews, review_count)
+    positive_review_ratio = np.minimum(1.0, np.maximum(0.0, positive_review_ratio))
+
+    review_coverage = _safe_div_array(review_count, transaction_count)
+    review_coverage = np.minimum(1.0, np.maximum(0.0, review_coverage))
+
+    engagement_index = (
+        transaction_count +
+        review_count +
+        portfolio_count +
+        bio_length +
+        bio_word_count
+    )
+
+    return np.column_stack([
+        portfolio_count,
+        avg_ratings,
+        transaction_count,
+        completed_transactions,
+        review_count,
+        star_count,
+        positive_reviews,
+        neutral_reviews,
+        negative_reviews,
+        completion_rate,
+        cancellation_rate,
+        bio_length,
+        bio_word_count,
+        positive_review_ratio,
+        review_coverage,
+        engagement_index,
+    ])
+
+def calculate_fallback_trust_score(user_data):
+    """
+    Fallback rule-based trust score calculation when ML model is unavailable.
+    Returns a score on 0-100 scale.
+    """
+    try:
+        portfolio_count = user_data.get('portfolioCount', 0)
+        avg_ratings = user_data.get('averageRatings', 1.0)
+        transaction_count = user_data.get('transactionCount', 0)
+        completed_transactions = user_data.get('completedTransactions', 0)
+        review_count = user_data.get('reviewCount', 0)
+        positive_reviews = user_data.get('positiveReviews', 0)
+        negative_reviews = user_data.get('negativeReviews', 0)
+        
+        # Base score from ratings (0-30 points)
+        rating_score = ((avg_ratings - 1) / 4) * 30
+        
+        # Activity score (0-25 points)
+        activity_score = min(transaction_count / 20, 1) * 25
+        
+        # Completion rate (0-25 points)
+        completion_rate = safe_div(completed_transactions, transaction_count)
+        completion_score = completion_rate * 25
+        
+        # Review positivity (0-15 points)
+        if review_count > 0:
+            positivity = safe_div(positive_reviews, review_count)
+            review_score = positivity * 15
+        else:
+            review_score = 7.5  # Neutral score
+        
+        # Portfolio bonus (0-5 points)
+        portfolio_score = min(portfolio_count / 10, 1) * 5
+        
+        # Calculate total
+        total_score = (
+            rating_score +
+            activity_score +
+            completion_score +
+            review_score +
+            portfolio_score
+        )
+        
+        # Penalties
+        if negative_reviews > 0 and review_count > 0:
+            negative_ratio = negative_reviews / review_count
+            total_score -= (negative_ratio * 20)
+        
+        # Clamp between 0-100
+        total_score = max(0, min(100, total_score))
+        
+        return total_score
+        
+    except Exception as e:
+        print(f"⚠️ Error in fallback calculation: {e}")
+        return 50.0  # Default neutral score
+
+def calculate_fallback_trust_score_columns(raw):
+    """
+    calculate_fallback_trust_score() on whole columns: raw maps the fields
+    it reads (others are ignored) to float64 arrays of finite values within
+    MAX_VECTOR_VALUE, as schema.USER_SCHEMA.validate_batch() produces.
+
+    Every operation happens in the same order as in the scalar version, and
+    integers below MAX_VECTOR_VALUE are exact in float64, so each score is
+    bit-identical to calculate_fallback_trust_score() for the same user.
+    """
+    portfolio_count = raw['portfolioCount']
+    avg_ratings = raw['averageRatings']
+    transaction_count = raw['transactionCount']
+    completed_transactions = raw['completedTransactions']
+    review_count = raw['reviewCount']
+    positive_reviews = raw['positiveReviews']
+    negative_reviews = raw['negativeReviews']
+
+    rating_score = ((avg_ratings - 1) / 4) * 30
+    activity_score = np.minimum(transaction_count / 20, 1) * 25
+    completion_score = _safe_div_array(completed_transactions, transaction_count) * 25
+    has_reviews = review_count > 0
+    review_score = np.where(has_reviews, _safe_div_array(positive_reviews, review_count) * 15, 7.5)
+    portfolio_score = np.minimum(portfolio_count / 10, 1) * 5
+
+    total_score = (
+        rating_score +
+        activity_score +
+        completion_score +
+        review_score +
+        portfolio_score
+    )
+
+    # Penalties
+    penalized = (negative_reviews > 0) & has_reviews
+    negative_ratio = _safe_div_array(negative_reviews, review_count)
+    total_score = np.where(penalized, total_score - negative_ratio * 20, total_score)
+
+    return np.maximum(0, np.minimum(100, total_score))
+
+def convert_to_likert_scale(prediction_0_100):
+    """
+    Convert prediction from 0-100 scale to 1-5 Likert scale.
+    
+    Mapping:
+    0-100 → 1-5
+    0 → 1.0
+    25 → 2.0
+    50 → 3.0
+    75 → 4.0
+    100 → 5.0
+    """
+    likert_score = 1.0 + (prediction_0_100 / 100.0) * 4.0
+    # Ensure it stays within 1-5 range
+    likert_score = max(1.0, min(5.0, likert_score))
+    return likert_score
+
+def convert_to_likert_scale_array(predictions_0_100):
+    """Vectorized convert_to_likert_scale(); same operations, same results"""
+    likert_scores = 1.0 + (predictions_0_100 / 100.0) * 4.0
+    return np.minimum(5.0, np.maximum(1.0, likert_scores))
@@ -0,0 +1,374 @@
+# forest_compaction.py - Smaller, approximate versions of a CompiledForest
+#
+# The exact compiled forest keeps every node of every tree (about 87,000 for
+# the default 100 trees of depth 15), with float64 thresholds and values, in
+# every worker. compact_forest() gives up a bounded amount of accuracy for
+# memory and speed, in three steps:
+#
+# 1. A subtree whose leaves all lie within prune_tolerance of its root's
+#    value becomes a leaf with that value. No tree's output moves by more
+#    than prune_tolerance, so neither does the forest's, for any input.
+# 2. Thresholds become float32, which can only change the branch an input
+#    takes when it lies within one float32 step of a threshold. Integer
+#    features never do, but ratios like 7/12 often sit right at one, so
+#    each threshold is rounded to whichever neighbouring float32 splits the
+#    calibration sample the way the exact one does. Node values become
+#    float32, or uint16/uint8 codes on a linear scale, moving each by at
+#    most half a step.
+# 3. Trees are dropped one at a time, each time the one whose removal keeps
+#    the forest closest to the original on a calibration sample, for as long
+#    as the largest deviation on that sample stays within max_error.
+#
+# The result is saved as a regular compact artifact, with the settings and
+# the measured error in its header, so the service serves it like any other
+# .npz (MODEL_FORMAT=auto or npz):
+#
+#   python forest_compaction.py models/trust_pipeline_best.joblib
+#   python forest_compaction.py models/trust_pipeline_best.joblib --max-error 1 --values uint8
+#
+# Both print the accuracy change on held-out rows, the memory and artifact
+# size saved and the prediction speed-up.
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from forest_engine import PREDICT_CHUNK_ROWS, CompiledForest
+
+THRESHOLD_TYPES = ('float64', 'float32')
+VALUE_TYPES = ('float64', 'float32', 'uint16', 'uint8')
+
+
+def _levels(engine, is_leaf):
+    """Node ids by depth from the roots, descending only below nodes that are not in is_leaf"""
+    levels = []
+    frontier = engine.roots
+    while len(frontier):
+        levels.append(frontier)
+        internal = frontier[~is_leaf[frontier]]
+        frontier = np.concatenate([engine.left[internal], engine.right[internal]])
+    return levels
+
+
+def _rebuild(engine, keep, leaf):
+    """
+    A CompiledForest of the nodes in keep, renumbered in their current
+    order; kept nodes in leaf become leaves.
+    """
+    old = np.flatnonzero(keep)
+    new_id = np.cumsum(keep) - 1
+    own = np.arange(len(old))
+    is_leaf = leaf[old]
+    rebuilt = CompiledForest(
+        feature=np.where(is_leaf, 0, engine.feature[old]).astype(engine.feature.dtype),
+        threshold=np.where(is_leaf, 0, engine.threshold[old]).astype(engine.threshold.dtype),
+        left=np.where(is_leaf, own, new_id[engine.left[old]]),
+        right=np.where(is_leaf, own, new_id[engine.right[old]]),
+        value=engine.value[old],
+        roots=new_id[engine.roots[keep[engine.roots]]],
+        max_depth=engine.max_depth,
+        n_features=engine.n_features,
+        missing_left=engine.missing_left[old] & ~is_leaf,
+        allow_missing=engine.allow_missing,
+        value_scale=engine.value_scale,
+        value_offset=engine.value_offset,
+    )
+    rebuilt.max_depth = len(_levels(rebuilt, rebuilt.left == own)) - 1
+    return rebuilt
+
+
+def prune_subtrees(engine, tolerance):
+    """
+    Collapse every subtree whose leaf values all lie within tolerance of
+    its root's value into a leaf. Moves any prediction by at most tolerance.
+    """
+    n = engine.n_nodes
+    is_leaf = engine.left == np.arange(n)
+    values = engine._values(np.arange(n))
+    # Lowest and highest leaf value below each node, filled in bottom-up
+    low = values.copy()
+    high = values.copy()
+    for level in reversed(_levels(engine, is_leaf)):
+        internal = level[~is_leaf[level]]
+        low[internal] = np.minimum(low[engine.left[internal]], low[engine.right[internal]])
+        high[internal] = np.maximum(high[engine.left[internal]], high[engine.right[internal]])
+    collapse = np.maximum(high - values, values - low) <= tolerance
+    keep = np.zeros(n, dtype=bool)
+    keep[np.concatenate(_levels(engine, collapse))] = True
+    return _rebuild(engine, keep, collapse)
+
+
+def _float32_thresholds(engine, X):
+    """
+    float32 thresholds for engine: each exact threshold rounded down, or up
+    where fewer values of its feature in X lie between it and the rounded-up
+    one (those are the values that would take the other branch)
+    """
+    exact = engine.threshold.astype(np.float64)
+    down = exact.astype(np.float32)
+    above = down > exact
+    down[above] = np.nextafter(down[above], np.float32(-np.inf))
+    if X is None:
+        return down
+    up = np.nextafter(down, np.float32(np.inf))
+    threshold = down.copy()
+    inexact = down != exact
+    for column in range(engine.n_features):
+        nodes = np.flatnonzero(inexact & (engine.feature == column))
+        if len(nodes) == 0:
+            continue
+        ordered = np.sort(X[:, column])
+        at_exact = np.searchsorted(ordered, exact[nodes], 'right')
+        flips_down = at_exact - np.searchsorted(ordered, down[nodes].astype(np.float64), 'right')
+        flips_up = np.searchsorted(ordered, up[nodes].astype(np.float64), 'right') - at_exact
+        use_up = nodes[flips_up < flips_down]
+        threshold[use_up] = up[use_up]
+    return threshold
+
+
+def quantize(engine, thresholds='float32', values='uint16', X_calibration=None):
+    """
+    Store thresholds as float32 (rounded to suit X_calibration when given,
+    see the top of this file) and values as float32 or integer codes.
+    Returns (engine, value_error): the most any node value moved.
+    """
+    if thresholds not in THRESHOLD_TYPES:
+        raise ValueError(f"thresholds must be one of {THRESHOLD_TYPES}")
+    if values not in VALUE_TYPES:
+        raise ValueError(f"values must be one of {VALUE_TYPES}")
+    n = engine.n_nodes
+    if thresholds == 'float32':
+        threshold = _float32_thresholds(engine, X_calibration)
+    else:
+        threshold = engine.threshold
+
+    node_values = engine._values(np.arange(n))
+    scale, offset = None, 0.0
+    if values in ('float64', 'float32'):
+        value = node_values.astype(values)
+    else:
+        offset = float(node_values.min())
+        span = float(node_values.max()) - offset
+        scale = span / np.iinfo(values).max if span > 0 else 1.0
+        value = np.rint((node_values - offset) / scale).astype(values)
+    quantized = CompiledForest(
+        feature=engine.feature, threshold=threshold, left=engine.left, right=engine.right,
+        value=value, roots=engine.roots, max_depth=engine.max_depth, n_features=engine.n_features,
+        missing_left=engine.missing_left, allow_missing=engine.allow_missing,
+        value_scale=scale, value_offset=offset,
+    )
+    value_error = float(np.abs(quantized._values(np.arange(n)) - node_values).max()) if n else 0.0
+    return quantized, value_error
+
+
+def tree_predictions(engine, X):
+    """Every tree's output for every row, shape (n_trees, n_rows)"""
+    X = np.asarray(X, dtype=np.float64)
+    out = np.empty((engine.n_trees, len(X)), dtype=np.float64)
+    for start in range(0, len(X), PREDICT_CHUNK_ROWS):
+        chunk = X[start:start + PREDICT_CHUNK_ROWS]
+        out[:, start:start + len(chunk)] = engine._values(engine.apply(chunk))
+    return out
+
+
+def select_trees(engine, X, reference, max_error):
+    """
+    Indices of the trees to keep: drop trees greedily, always the one whose
+    removal keeps the forest's mean closest (in the worst row) to reference
+    on X, while that worst deviation stays within max_error.
+    """
+    per_tree = tree_predictions(engine, X)
+    total = per_tree.sum(axis=0)
+    alive = np.arange(engine.n_trees)
+    while len(alive) > 1:
+        candidates = (total - per_tree[alive]) / (len(alive) - 1)
+        errors = np.abs(candidates - reference).max(axis=1)
+        best = int(errors.argmin())
+        if errors[best] > max_error:
+            break
+        total -= per_tree[alive[best]]
+        alive = np.delete(alive, best)
+    return alive
+
+
+def take_trees(engine, trees):
+    """The forest made of the given trees only, in their original order"""
+    n = engine.n_nodes
+    sizes = np.diff(np.append(engine.roots, n))
+    keep = np.isin(np.repeat(np.arange(engine.n_trees), sizes), trees)
+    return _rebuild(engine, keep, engine.left == np.arange(n))
+
+
+def compact_forest(engine, X_calibration, prune_tolerance=0.25, thresholds='float32',
+                   values='uint16', max_error=0.5):
+    """
+    Run the three steps at the top of this file on an exact engine. X_calibration
+    is a feature matrix like the traffic the model will see; tree dropping
+    keeps the forest within max_error of engine on it (0 keeps every tree).
+
+    Returns (compacted, bound): bound is what steps 1 and 2 guarantee for
+    any input (prune_tolerance plus the value rounding), before thresholds
+    and dropped trees, which are only measured.
+    """
+    reference = engine.predict(X_calibration)
+    compacted, value_error = quantize(prune_subtrees(engine, prune_tolerance), thresholds, values, X_calibration)
+    if max_error > 0:
+        compacted = take_trees(compacted, select_trees(compacted, X_calibration, reference, max_error))
+    return compacted, prune_tolerance + value_error
+
+
+def _best_ms(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000.0
+
+
+def accuracy_report(original, compacted, X, y=None):
+    """
+    How far compacted strays from original on the held-out rows X, and
+    each one's error against the targets y when known ([original,
+    compacted] pairs).
+    """
+    from features import convert_to_likert_scale_array
+
+    before = original.predict(X)
+    after = compacted.predict(X)
+    deviation = np.abs(after - before)
+
+    def ratings(scores):
+        return np.round(convert_to_likert_scale_array(np.clip(scores, 0, 100)), 2)
+
+    report = {
+        'rows': len(X),
+        'max_abs_error': round(float(deviation.max()), 4),
+        'mean_abs_error': round(float(deviation.mean()), 4),
+        'changed_ratings': int(np.count_nonzero(ratings(before) != ratings(after))),
+    }
+    if y is not None:
+        def r2(pred):
+            return 1 - float(((y - pred) ** 2).sum() / ((y - y.mean()) ** 2).sum())
+        report['mae'] = [round(float(np.abs(before - y).mean()), 4), round(float(np.abs(after - y).mean()), 4)]
+        report['r2'] = [round(r2(before), 5), round(r2(after), 5)]
+    return report
+
+
+def cost_report(original, compacted, X, repeats=7):
+    """Size and predict() time of both forests, as [original, compacted] pairs"""
+    report = {
+        'trees': [original.n_trees, compacted.n_trees],
+        'nodes': [original.n_nodes, compacted.n_nodes],
+        'max_depth': [original.max_depth, compacted.max_depth],
+        'memory_kb': [round(original.nbytes / 1024, 1), round(compacted.nbytes / 1024, 1)],
+    }
+    for rows in (1, 1000):
+        sample = X[:rows]
+        timings = [_best_ms(lambda: forest.predict(sample), repeats) for forest in (original, compacted)]
+        report[f'predict_{rows}_ms'] = [round(t, 3) for t in timings]
+    report['speedup_1000'] = round(report['predict_1000_ms'][0] / report['predict_1000_ms'][1], 2)
+    return report
+
+
+def sample_features(n_rows, seed):
+    """(features, targets) of n_rows synthetic users from retrain_model.py's distributions"""
+    from model_loader import FEATURE_COLUMNS
+    from retrain_model import generate_training_data, make_rng
+
+    data = generate_training_data(n_rows, make_rng(seed, 'pcg64'))
+    return data[FEATURE_COLUMNS].to_numpy(dtype=np.float64), data['TrustRating'].to_numpy()
+
+
+def compact_model(pipeline, path, source_version, prune_tolerance=0.25, thresholds='float32',
+                  values='uint16', max_error=0.5, calibration_rows=20000, holdout_rows=20000, seed=1):
+    """
+    Compile pipeline, compact it, and save the result to path as a compact
+    artifact. Returns accuracy_report() and cost_report() merged, with the
+    artifact sizes. Raises ValueError if the pipeline cannot be compiled
+    exactly.
+    """
+    from model_loader import FEATURE_COLUMNS, export_compact_model
+
+    X_calibration, _ = sample_features(calibration_rows, seed)
+    X_holdout, y_holdout = sample_features(holdout_rows, seed + 1)
+    with tempfile.TemporaryDirectory() as scratch:
+        exact_path = os.path.join(scratch, 'exact.npz')
+        engine = export_compact_model(pipeline, exact_path, source_version)
+        compacted, bound = compact_forest(engine, X_calibration, prune_tolerance, thresholds, values, max_error)
+        report = accuracy_report(engine, compacted, X_holdout, y_holdout)
+        report['guaranteed_error_bound'] = round(bound, 6)
+        settings = {
+            'prune_tolerance': prune_tolerance, 'thresholds': thresholds, 'values': values,
+            'max_error': max_error, 'calibration_rows': calibration_rows, 'seed': seed,
+        }
+        compacted.save(path, FEATURE_COLUMNS, source_version=source_version, compaction=dict(
+            settings, trees=compacted.n_trees, nodes=compacted.n_nodes,
+            **{k: report[k] for k in ('max_abs_error', 'mean_abs_error', 'guaranteed_error_bound')}
+        ))
+        # Sizes and speed as the service loads them
+        exact, _ = CompiledForest.load(exact_path)
+        served, _ = CompiledForest.load(path)
+        report.update(cost_report(exact, served, X_holdout))
+        report['artifact_kb'] = [round(os.path.getsize(exact_path) / 1024, 1), round(os.path.getsize(path) / 1024, 1)]
+    return report
+
+
+def print_report(report):
+    def change(pair, unit=''):
+        return f"{pair[0]:,} -> {pair[1]:,}{unit} ({(pair[1] - pair[0]) / pair[0]:+.1%})"
+
+    print(f"🌲 Trees {change(report['trees'])}, nodes {change(report['nodes'])}, "
+          f"depth {report['max_depth'][0]} -> {report['max_depth'][1]}")
+    print(f"💾 Node arrays {change(report['memory_kb'], ' KB')}, artifact {change(report['artifact_kb'], ' KB')}")
+    print(f"🎯 On {report['rows']:,} held-out rows: max |error| {report['max_abs_error']}, "
+          f"mean |error| {report['mean_abs_error']} score points, "
+          f"{report['changed_ratings']} ratings changed at 2 decimals")
+    if 'mae' in report:
+        print(f"   MAE vs target {report['mae'][0]} -> {report['mae'][1]}, "
+              f"R² {report['r2'][0]} -> {report['r2'][1]}")
+    print(f"   Guaranteed for any input before dropped trees and float32 thresholds: "
+          f"{report['guaranteed_error_bound']} points")
+    print(f"⚡ predict 1 row {report['predict_1_ms'][0]} -> {report['predict_1_ms'][1]} ms, "
+          f"1000 rows {report['predict_1000_ms'][0]} -> {report['predict_1000_ms'][1]} ms "
+          f"({report['speedup_1000']}x)")
+
+
+def main(argv=None):
+    from model_loader import compact_path, file_version, load_pipeline
+
+    parser = argparse.ArgumentParser(description='Write a compacted compiled forest for a joblib model.')
+    parser.add_argument('model', help='joblib model file')
+    parser.add_argument('--output', default=None, help='Artifact path (default: the .npz next to the model)')
+    parser.add_argument('--prune-tolerance', type=float, default=0.25,
+                        help='Collapse subtrees whose leaves are this close to their root, in score points (default: 0.25)')
+    parser.add_argument('--thresholds', choices=THRESHOLD_TYPES, default='float32', help='Threshold storage (default: float32)')
+    parser.add_argument('--values', choices=VALUE_TYPES, default='uint16', help='Node value storage (default: uint16)')
+    parser.add_argument('--max-error', type=float, default=0.5,
+                        help='Drop trees while calibration rows stay this close to the original, in score points; 0 keeps all (default: 0.5)')
+    parser.add_argument('--calibration-rows', type=int, default=20000, help='Synthetic rows for tree selection (default: 20000)')
+    parser.add_argument('--holdout-rows', type=int, default=20000, help='Synthetic rows for the report (default: 20000)')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the synthetic rows (default: 1)')
+    args = parser.parse_args(argv)
+
+    output = args.output or compact_path(args.model)
+    try:
+        report = compact_model(
+            load_pipeline(args.model), output, file_version(args.model),
+            prune_tolerance=args.prune_tolerance, thresholds=args.thresholds, values=args.values,
+            max_error=args.max_error, calibration_rows=args.calibration_rows,
+            holdout_rows=args.holdout_rows, seed=args.seed,
+        )
+    except ValueError as e:
+        print(f"❌ Could not compact {args.model}: {e}")
+        return 1
+    print_report(report)
+    print(f"📦 Wrote {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,473 @@
+# forest_engine.py - Pandas-free inference for the trust RandomForest pipeline
+#
+# Reads the fitted Pipeline(ColumnTransformer[StandardScaler], RandomForestRegressor)
+# once, folds the scaler into the split thresholds and flattens every tree into
+# contiguous NumPy node arrays. Predictions then take a plain float64 matrix of
+# raw features and never touch pandas or sklearn.
+#
+# CompiledForest.save()/load() store those arrays as a compact .npz artifact,
+# so a server can start from it with NumPy alone. forest_compaction.py can
+# shrink a forest further (float32 thresholds, integer-coded values, fewer
+# nodes and trees) at a bounded cost in accuracy.
+import json
+import os
+
+import numpy as np
+
+_SIGN_BIT = np.int64(-0x8000000000000000)
+_MAGNITUDE_BITS = np.int64(0x7FFFFFFFFFFFFFFF)
+
+# Rows traversed per step; bounds the (n_trees, rows) index arrays
+PREDICT_CHUNK_ROWS = 8192
+
+# Compact artifact identity, stored in its JSON header. Bump the version
+# whenever the array layout or their meaning changes. Version 2 added
+# integer-coded values (value_scale/value_offset in the header).
+ARTIFACT_FORMAT = 'trust-compiled-forest'
+ARTIFACT_VERSION = 2
+SUPPORTED_ARTIFACT_VERSIONS = (1, 2)
+
+
+def _float_to_key(values):
+    """Map float64 values to int64 keys with the same ordering"""
+    bits = np.ascontiguousarray(values, dtype=np.float64).view(np.int64)
+    return np.where(bits >= 0, bits, -(bits & _MAGNITUDE_BITS))
+
+
+def _key_to_float(keys):
+    """Inverse of _float_to_key()"""
+    bits = np.where(keys >= 0, keys, (-keys) | _SIGN_BIT)
+    return bits.view(np.float64)
+
+
+def fold_thresholds(thresholds, mean, scale):
+    """
+    Translate tree thresholds on scaled features back to raw feature space.
+
+    sklearn scales a raw value x as (x - mean) / scale in float64, casts the
+    result to float32 and sends it left when it is <= threshold. That test is
+    monotone in x, so it is equivalent to x <= T for a single float64 T per
+    node. T is found by binary search over the float64 ordering, which makes
+    the folded comparison agree with sklearn for every finite input, not just
+    approximately.
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    mean = np.asarray(mean, dtype=np.float64)
+    scale = np.asarray(scale, dtype=np.float64)
+
+    def goes_left(keys):
+        x = _key_to_float(keys)
+        scaled = ((x - mean) / scale).astype(np.float32)
+        return scaled <= thresholds
+
+    # Invariant: goes_left(lo) is True, goes_left(hi) is False
+    lo = np.full(thresholds.shape, _float_to_key(np.array([-np.inf]))[0])
+    hi = np.full(thresholds.shape, _float_to_key(np.array([np.inf]))[0])
+    with np.errstate(over='ignore', invalid='ignore'):
+        for _ in range(64):
+            mid = (lo & hi) + ((lo ^ hi) >> 1)  # overflow-free floor average
+            left = goes_left(mid)
+            lo = np.where(left, mid, lo)
+            hi = np.where(left, hi, mid)
+
+    return _key_to_float(lo)
+
+
+def _scaler_columns(preprocessor, feature_columns):
+    """
+    Return (raw_column_index, mean, scale) for every column the
+    ColumnTransformer outputs, in output order.
+    """
+    from sklearn.preprocessing import StandardScaler
+
+    raw_index, means, scales = [], [], []
+    for name, transformer, columns in preprocessor.transformers_:
+        columns = list(columns)
+        if (isinstance(transformer, str) and transformer == 'drop') or not columns:
+            continue
+        if name == 'remainder':
+            raise ValueError(f"Unsupported remainder: {transformer!r}")
+        if isinstance(transformer, str) and transformer == 'passthrough':
+            mean = np.zeros(len(columns))
+            scale = np.ones(len(columns))
+        elif isinstance(transformer, StandardScaler):
+            mean = transformer.mean_ if transformer.with_mean else np.zeros(len(columns))
+            scale = transformer.scale_ if transformer.with_std else np.ones(len(columns))
+        else:
+            raise ValueError(f"Unsupported transformer: {type(transformer).__name__}")
+        for column in columns:
+            if column not in feature_columns:
+                raise ValueError(f"Transformer column {column!r} is not a model feature")
+            raw_index.append(feature_columns.index(column))
+        means.extend(mean)
+        scales.extend(scale)
+    return (
+        np.array(raw_index, dtype=np.intp),
+        np.array(means, dtype=np.float64),
+        np.array(scales, dtype=np.float64),
+    )
+
+
+def _accepts_missing(pipeline, feature_columns):
+    """Whether the installed sklearn predicts (rather than raises) on NaN input"""
+    import pandas as pd
+
+    row = pd.DataFrame([[np.nan] * len(feature_columns)], columns=list(feature_columns))
+    try:
+        pipeline.predict(row)
+        return True
+    except ValueError:
+        return False
+
+
+class CompiledForest:
+    """
+    A RandomForestRegressor flattened into contiguous node arrays.
+
+    Node i splits on raw column feature[i] and goes to left[i] when
+    x <= threshold[i], else right[i]. Leaves point to themselves, so every
+    row can be stepped max_depth times without branching on leaf status.
+
+    NaN inputs are only accepted when the source sklearn version accepted
+    them (allow_missing); they are then routed by missing_left[i].
+
+    value holds node values as floats, or as integer codes standing for
+    value_offset + code * value_scale when value_scale is set. Thresholds
+    and values may be float32; traversal compares and sums in float64.
+
+    bias, the mean root value over trees, is the starting point of every
+    explain() decomposition.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, roots, max_depth,
+                 n_features, missing_left=None, allow_missing=False, value_scale=None,
+                 value_offset=0.0):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.max_depth = max_depth
+        self.n_features = n_features
+        if missing_left is None:
+            missing_left = np.zeros(len(feature), dtype=bool)
+        self.missing_left = missing_left
+        self.allow_missing = allow_missing
+        self.value_scale = value_scale
+        self.value_offset = value_offset
+        self.bias = float(np.add.accumulate(self._values(roots))[-1] / len(roots))
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    @property
+    def nbytes(self):
+        """Memory held by the node arrays"""
+        return sum(array.nbytes for array in (
+            self.feature, self.threshold, self.left, self.right, self.value, self.roots, self.missing_left
+        ))
+
+    def _values(self, node):
+        """Values of the given nodes as float64"""
+        values = self.value[node]
+        if self.value_scale is None:
+            return values.astype(np.float64, copy=False)
+        return values * self.value_scale + self.value_offset
+
+    @classmethod
+    def from_pipeline(cls, pipeline, feature_columns):
+        """
+        Build the engine from a fitted sklearn Pipeline whose last two steps
+        are a ColumnTransformer of StandardScaler/passthrough columns and a
+        RandomForestRegressor. Raises ValueError for anything else.
+        """
+        steps = getattr(pipeline, 'steps', None)
+        if not steps or len(steps) != 2:
+            raise ValueError("Expected a two-step Pipeline (preprocessor, regressor)")
+        preprocessor = steps[0][1]
+        forest = steps[1][1]
+        if type(forest).__name__ != 'RandomForestRegressor':
+            raise ValueError(f"Unsupported regressor: {type(forest).__name__}")
+        if getattr(forest, 'n_outputs_', 1) != 1:
+            raise ValueError("Only single-output forests are supported")
+
+        feature_columns = list(feature_columns)
+        raw_index, mean, scale = _scaler_columns(preprocessor, feature_columns)
+
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        missing_lefts = []
+        max_depth = 0
+        offset = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            n = tree.node_count
+            children_left = tree.children_left
+            children_right = tree.children_right
+            is_leaf = children_left == -1
+            node_ids = np.arange(n)
+
+            # Scaled-space column j is raw column raw_index[j]
+            scaled_feature = np.where(is_leaf, 0, tree.feature)
+            raw_threshold = fold_thresholds(
+                tree.threshold, mean[scaled_feature], scale[scaled_feature]
+            )
+
+            features.append(np.where(is_leaf, 0, raw_index[scaled_feature]))
+            thresholds.append(np.where(is_leaf, 0.0, raw_threshold))
+            lefts.append(np.where(is_leaf, node_ids, children_left) + offset)
+            rights.append(np.where(is_leaf, node_ids, children_right) + offset)
+            values.append(tree.value[:, 0, 0])
+            # Only present (and only used) on sklearn versions with NaN support
+            missing_lefts.append(np.asarray(
+                getattr(tree, 'missing_go_to_left', np.zeros(n)), dtype=bool
+            ))
+            roots.append(offset)
+            max_depth = max(max_depth, tree.max_depth)
+            offset += n
+
+        return cls(
+            feature=np.ascontiguousarray(np.concatenate(features), dtype=np.intp),
+            threshold=np.ascontiguousarray(np.concatenate(thresholds), dtype=np.float64),
+            left=np.ascontiguousarray(np.concatenate(lefts), dtype=np.intp),
+            right=np.ascontiguousarray(np.concatenate(rights), dtype=np.intp),
+            value=np.ascontiguousarray(np.concatenate(values), dtype=np.float64),
+            roots=np.array(roots, dtype=np.intp),
+            max_depth=int(max_depth),
+            n_features=len(feature_columns),
+            missing_left=np.concatenate(missing_lefts),
+            allow_missing=_accepts_missing(pipeline, feature_columns),
+        )
+
+    def save(self, path, feature_columns, **metadata):
+        """
+        Write the engine to an uncompressed .npz at path: the node arrays in
+        compact dtypes (thresholds and values keep their own) plus a JSON header with the artifact format, schema
+        version and feature order. Extra keyword arguments go into the
+        header. The file is written next to path and renamed into place, so
+        readers never see a partial artifact.
+        """
+        header = dict(
+            metadata,
+            format=ARTIFACT_FORMAT,
+            version=ARTIFACT_VERSION,
+            feature_columns=list(feature_columns),
+            n_features=self.n_features,
+            n_trees=self.n_trees,
+            n_nodes=self.n_nodes,
+            max_depth=self.max_depth,
+            allow_missing=self.allow_missing,
+        )
+        if self.value_scale is not None:
+            header.update(value_scale=self.value_scale, value_offset=self.value_offset)
+        if len(header['feature_columns']) != self.n_features:
+            raise ValueError("feature_columns does not match the engine's feature count")
+        index_dtype = np.int32 if self.n_nodes < 2 ** 31 else np.int64
+        feature_dtype = (np.uint8 if self.n_features < 2 ** 8 else
+                         np.uint16 if self.n_features < 2 ** 16 else np.int64)
+
+        tmp_path = f'{path}.tmp{os.getpid()}'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                header=np.array(json.dumps(header)),
+                feature=self.feature.astype(feature_dtype),
+                threshold=self.threshold,
+                left=self.left.astype(index_dtype),
+                right=self.right.astype(index_dtype),
+                value=self.value,
+                roots=self.roots.astype(index_dtype),
+                missing_left=self.missing_left,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, feature_columns=None):
+        """
+        Read an artifact written by save(). Returns (engine, header).
+        Feature indices, thresholds and values keep their stored dtypes;
+        child indices are widened to intp, which indexes fastest.
+
+        Raises ValueError for another format or schema version, a feature
+        order different from feature_columns, or node arrays that do not
+        form valid trees.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            header = json.loads(str(data['header']))
+            if header.get('format') != ARTIFACT_FORMAT:
+                raise ValueError(f"Not a compiled forest artifact: {header.get('format')!r}")
+            if header.get('version') not in SUPPORTED_ARTIFACT_VERSIONS:
+                raise ValueError(
+                    f"Artifact schema version {header.get('version')} is not supported "
+                    f"(expected one of {SUPPORTED_ARTIFACT_VERSIONS})"
+                )
+            if feature_columns is not None and header['feature_columns'] != list(feature_columns):
+                raise ValueError("Artifact feature order does not match the service's features")
+            value_scale = header.get('value_scale')
+            if value_scale is None and data['value'].dtype.kind not in 'f':
+                raise ValueError("Artifact values are integer codes but the header has no value_scale")
+            engine = cls(
+                feature=data['feature'],
+                threshold=data['threshold'],
+                left=data['left'].astype(np.intp),
+                right=data['right'].astype(np.intp),
+                value=data['value'],
+                roots=data['roots'].astype(np.intp),
+                max_depth=int(header['max_depth']),
+                n_features=int(header['n_features']),
+                missing_left=data['missing_left'].astype(bool),
+                allow_missing=bool(header['allow_missing']),
+                value_scale=float(value_scale) if value_scale is not None else None,
+                value_offset=float(header.get('value_offset', 0.0)),
+            )
+
+        n = engine.n_nodes
+        if not (len(engine.threshold) == len(engine.left) == len(engine.right)
+                == len(engine.value) == len(engine.missing_left) == n):
+            raise ValueError("Artifact node arrays have different lengths")
+        for name in ('left', 'right', 'roots'):
+            indices = getattr(engine, name)
+            if len(indices) and (indices.min() < 0 or indices.max() >= n):
+                raise ValueError(f"Artifact {name} points outside the node arrays")
+        if n and engine.feature.max() >= engine.n_features:
+            raise ValueError("Artifact splits on a feature beyond n_features")
+        return engine, header
+
+    def _goes_left(self, X_flat, row_offset, node):
+        """Split feature and branch taken at every (tree, row) current node"""
+        feature = self.feature[node]
+        x = X_flat[row_offset + feature]
+        go_left = x <= self.threshold[node]
+        if self.allow_missing:
+            go_left = np.where(np.isnan(x), self.missing_left[node], go_left)
+        return feature, go_left
+
+    def apply(self, X):
+        """Return the leaf node reached by every (tree, row), shape (n_trees, n_rows)"""
+        n_rows = X.shape[0]
+        X_flat = np.ascontiguousarray(X).ravel()
+        row_offset = np.arange(n_rows) * self.n_features
+        node = np.repeat(self.roots[:, None], n_rows, axis=1)
+        for _ in range(self.max_depth):
+            _, go_left = self._goes_left(X_flat, row_offset, node)
+            node = np.where(go_left, self.left[node], self.right[node])
+        return node
+
+    def _checked(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"Expected shape (n, {self.n_features}), got {X.shape}")
+        if np.isinf(X).any() or (not self.allow_missing and np.isnan(X).any()):
+            raise ValueError("Input contains NaN or infinity")
+        return X
+
+    def _leaf_mean(self, node):
+        # accumulate() adds strictly in tree order, unlike sum()
+        return np.add.accumulate(self._values(node), axis=0)[-1] / self.n_trees
+
+    def predict(self, X):
+        """
+        Predict from a float64 matrix of raw features in feature_columns order.
+
+        Tree outputs are summed in estimator order and divided by the tree
+        count, the same arithmetic RandomForestRegressor.predict performs.
+        """
+        X = self._checked(X)
+        out = np.empty(X.shape[0], dtype=np.float64)
+        for start in range(0, X.shape[0], PREDICT_CHUNK_ROWS):
+            chunk = X[start:start + PREDICT_CHUNK_ROWS]
+            out[start:start + PREDICT_CHUNK_ROWS] = self._leaf_mean(self.apply(chunk))
+        return out
+
+    def explain(self, X):
+        """
+        Exact per-feature contributions by path decomposition: along each
+        row's path through each tree, the change in node value at every
+        split is credited to the split's feature, then averaged over trees.
+
+        Returns (bias, contributions, predictions): the forest's mean root
+        value, an (n_rows, n_features) matrix and predict(X), bit for bit.
+        bias + contributions.sum(axis=1) equals predictions up to float
+        rounding. Costs one traversal, like predict(), plus the per-feature sums.
+        """
+        X = self._checked(X)
+        n_rows = X.shape[0]
+        contributions = np.empty((n_rows, self.n_features), dtype=np.float64)
+        predictions = np.empty(n_rows, dtype=np.float64)
+        for start in range(0, n_rows, PREDICT_CHUNK_ROWS):
+            chunk = X[start:start + PREDICT_CHUNK_ROWS]
+            size = len(chunk)
+            X_flat = np.ascontiguousarray(chunk).ravel()
+            row_offset = np.arange(size) * self.n_features
+            node = np.repeat(self.roots[:, None], size, axis=1)
+            totals = np.zeros(size * self.n_features, dtype=np.float64)
+            current = self._values(node)
+            for _ in range(self.max_depth):
+                feature, go_left = self._goes_left(X_flat, row_offset, node)
+                node = np.where(go_left, self.left[node], self.right[node])
+                # Leaves point to themselves, so a finished path adds 0
+                reached = self._values(node)
+                # One weighted count per (row, feature) cell sums the gains of every tree
+                totals += np.bincount((row_offset + feature).ravel(), weights=(reached - current).ravel(),
+                                      minlength=len(totals))
+                current = reached
+            contributions[start:start + size] = totals.reshape(size, self.n_features) / self.n_trees
+            predictions[start:start + size] = self._leaf_mean(node)
+        return self.bias, contributions, predictions
+
+
+def sklearn_reference_predict(pipeline, X, feature_columns):
+    """
+    Reference prediction through sklearn, accumulating trees in estimator
+    order (what pipeline.predict computes with n_jobs=1). Used to verify
+    the compiled engine at load time.
+    """
+    import pandas as pd
+
+    preprocessor = pipeline.steps[0][1]
+    forest = pipeline.steps[-1][1]
+    transformed = preprocessor.transform(pd.DataFrame(X, columns=list(feature_columns)))
+    total = np.zeros(X.shape[0], dtype=np.float64)
+    for estimator in forest.estimators_:
+        total += estimator.predict(transformed)
+    total /= len(forest.estimators_)
+    return total
+
+
+def probe_matrix(engine, n_rows=512, seed=0):
+    """
+    Rows built from folded thresholds and their float64 neighbours, so a
+    verification run exercises both sides of as many splits as possible.
+    """
+    rng = np.random.default_rng(seed)
+    X = np.zeros((n_rows, engine.n_features), dtype=np.float64)
+    internal = engine.left != np.arange(engine.n_nodes)
+    for column in range(engine.n_features):
+        cuts = engine.threshold[internal & (engine.feature == column)]
+        if len(cuts) == 0:
+            continue
+        candidates = np.concatenate([cuts, np.nextafter(cuts, np.inf)])
+        X[:, column] = rng.choice(candidates, size=n_rows)
+    return X
+
+
+def verify_engine(engine, pipeline, feature_columns, extra_rows=None):
+    """
+    Check the compiled engine is bit-identical to the sklearn reference
+    on probe rows. Returns the number of mismatching rows.
+    """
+    X = probe_matrix(engine)
+    if engine.allow_missing:
+        with_missing = X[:64].copy()
+        with_missing[np.random.default_rng(1).random(with_missing.shape) < 0.2] = np.nan
+        X = np.vstack([X, with_missing])
+    if extra_rows is not None:
+        X = np.vstack([X, np.asarray(extra_rows, dtype=np.float64)])
+    expected = sklearn_reference_predict(pipeline, X, feature_columns)
+    actual = engine.predict(X)
+    return int(np.count_nonzero(expected != actual))
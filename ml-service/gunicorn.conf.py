@@ -0,0 +1,49 @@
+# gunicorn.conf.py - Production server settings for the ML service
+#
+# GUNICORN_PRELOAD=1 imports app.py (and loads the model) once in the master
+# before forking, so workers start instantly and share the model's memory
+# pages copy-on-write instead of each unpickling a private copy.
+import gc
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', 2))
+# Tell app.py how many processes serve it; its stats table takes writes only
+# when there is one
+os.environ['SERVICE_WORKERS'] = str(workers)
+# More than one thread switches to gthread workers, which lets concurrent
+# /predict calls share a model call (PREDICT_BATCH_MAX_WAIT_MS) and keeps
+# /predict answering while a /batch-predict waits on the batch pool
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+preload_app = os.getenv('GUNICORN_PRELOAD', '0').lower() in ('1', 'true', 'yes')
+
+# MODEL_LOAD_MODE=background loads the model on a thread after the import,
+# and threads don't survive fork(): each worker has to load its own copy,
+# so there is nothing for a preloaded master to share.
+if preload_app and os.getenv('MODEL_LOAD_MODE') == 'background':
+    print("⚠️ MODEL_LOAD_MODE=background: ignoring GUNICORN_PRELOAD, workers load the model themselves")
+    preload_app = False
+
+
+def pre_fork(server, worker):
+    # Move everything allocated so far (the model included) out of the
+    # collector's reach, so GC passes in the workers don't write to those
+    # object headers and un-share their pages.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Background threads don't survive fork(); restart the model watcher
+    # and stats snapshots in each worker when the app was imported by the master.
+    if preload_app:
+        import app
+        app.start_model_watcher()
+        app.start_stats_snapshots()
+
+
+def post_worker_init(worker):
+    # The worker has imported the app (itself, or through the preloaded
+    # master); start its BATCH_POOL_WORKERS processes warm, never in the master
+    import app
+    app.start_batch_pool()
@@ -0,0 +1,405 @@
+# lanes.py - Separate execution lanes for interactive and bulk scoring
+#
+# /predict runs in a small latency lane on the request thread, /explain in a
+# lane of its own. /batch-predict runs in a batch lane: its feature rows are
+# cut into chunks that the request thread scores, helped by an optional pool
+# of worker processes on hosts with cores to spare, and it returns whatever
+# was scored by its deadline. Each lane admits a bounded number of requests,
+# queues a bounded number more and refuses the rest, so bulk jobs cannot
+# take every request thread.
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+import metrics
+from model_loader import load_model_bundle
+
+
+class LaneFull(Exception):
+    pass
+
+
+class _Admission:
+    """Context manager returned by Lane.admit(); a class, like metrics.stage"""
+
+    __slots__ = ('lane', 'timeout')
+
+    def __init__(self, lane, timeout):
+        self.lane = lane
+        self.timeout = timeout
+
+    def __enter__(self):
+        self.lane._acquire(self.timeout)
+
+    def __exit__(self, *exc_info):
+        self.lane._release()
+
+
+class Lane:
+    """
+    Admission control for one class of requests.
+
+    Up to concurrency requests run at once and up to max_queued more wait,
+    each for at most max_wait_seconds. Anything beyond that raises LaneFull
+    straight away, so a burst turns into quick 429s instead of a backlog of
+    blocked request threads.
+    """
+
+    def __init__(self, name, concurrency, max_queued, max_wait_seconds):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.max_queued = max(0, max_queued)
+        self.max_wait_seconds = max_wait_seconds
+        self._cond = threading.Condition()
+        self.running = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.max_queued_seen = 0
+
+    def admit(self, timeout=None):
+        """
+        with lane.admit(): ... runs the block in the lane. timeout caps the
+        wait below max_wait_seconds (e.g. a request deadline).
+        """
+        return _Admission(self, timeout)
+
+    def _acquire(self, timeout):
+        wait_seconds = self.max_wait_seconds if timeout is None else min(timeout, self.max_wait_seconds)
+        with self._cond:
+            if self.running >= self.concurrency:
+                if self.queued >= self.max_queued:
+                    self.rejected += 1
+                    raise LaneFull(f'{self.name} lane is full ({self.running} running, {self.queued} queued)')
+                self.queued += 1
+                self.max_queued_seen = max(self.max_queued_seen, self.queued)
+                deadline = time.monotonic() + wait_seconds
+                try:
+                    with metrics.stage('lane_wait'):
+                        while self.running >= self.concurrency:
+                            remaining = deadline - time.monotonic()
+                            if remaining <= 0:
+                                self.rejected += 1
+                                raise LaneFull(f'{self.name} lane is busy, no slot within {wait_seconds * 1000.0:.0f} ms')
+                            self._cond.wait(remaining)
+                finally:
+                    self.queued -= 1
+            self.running += 1
+            self.admitted += 1
+
+    def _release(self):
+        with self._cond:
+            self.running -= 1
+            self._cond.notify()
+
+    def stats(self):
+        return {
+            'concurrency': self.concurrency,
+            'max_queued': self.max_queued,
+            'max_wait_ms': self.max_wait_seconds * 1000.0,
+            'running': self.running,
+            'queued': self.queued,
+            'max_queued_seen': self.max_queued_seen,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+        }
+
+
+# Models loaded by a pool worker process, by (path, engine, format)
+_worker_models = {}
+
+
+def _model_spec(active):
+    """What a pool worker needs to load active itself"""
+    return (active.path, active.engine, active.format, active.version)
+
+
+def _load_worker_model(spec):
+    """The worker's copy of the model spec describes, loaded on first use"""
+    path, engine, model_format, version = spec
+    key = (path, engine, model_format)
+    loaded = _worker_models.get(key)
+    if loaded is None or loaded.version != version:
+        loaded = load_model_bundle(path, engine, None, model_format)
+        _worker_models[key] = loaded
+    return loaded
+
+
+def _warm_worker(specs):
+    """Pool initializer: load the served models before the first chunk arrives"""
+    for spec in specs:
+        try:
+            _load_worker_model(spec)
+        except Exception as e:
+            print(f"⚠️ Batch pool worker could not preload {spec[0]}: {e}")
+
+
+def _worker_started():
+    """No-op task; submitting one per worker makes the executor start them all"""
+    return os.getpid()
+
+
+def _score_chunk(spec, matrix):
+    """
+    Runs in a pool worker: predict matrix with the model spec describes.
+    Raises ValueError if the file on disk is no longer that version, so
+    the caller scores the chunk itself.
+    """
+    loaded = _load_worker_model(spec)
+    if loaded.version != spec[3]:
+        raise ValueError(f'{spec[0]} is now model {loaded.version}, not {spec[3]}')
+    return loaded.predict(matrix)
+
+
+class BatchPool:
+    """
+    Scores large feature matrices in chunks, on worker processes and on
+    the calling thread at once.
+
+    The pool takes chunks from the front while the calling thread scores
+    them from the back, taking back any the pool has not started. Once
+    it runs out, the thread also scores the chunks the pool is still
+    working on (a cold or overloaded worker) rather than wait for them,
+    so no row misses its deadline waiting on the pool.
+
+    The pool only gets batches while it is measured to win: the time per
+    row of pooled and calling-thread batches is tracked as a moving
+    average, batches go the faster way, and every PROBE_EVERY-th one goes
+    the other way to keep both numbers current. On a host without spare
+    cores the workers only compete with the calling thread, and the
+    calling thread wins.
+
+    Workers load the models themselves from the LoadedModels' files, when
+    they start (see start()), so nothing large is pickled per request. A
+    chunk whose worker cannot produce the requested version (the file
+    changed, the pool broke) is scored in the calling process instead.
+    workers=0 scores every chunk on the calling thread.
+    """
+
+    # Every this many batches, one goes the way currently measured slower
+    PROBE_EVERY = 20
+    # Weight of the newest batch in the per-row time averages
+    SMOOTHING = 0.3
+
+    def __init__(self, workers, chunk_rows, min_rows, start_method='forkserver'):
+        self.workers = max(0, workers)
+        self.chunk_rows = max(1, chunk_rows)
+        self.min_rows = min_rows
+        self.start_method = start_method
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self._specs = []
+        self.pending_chunks = 0
+        self.pending_rows = 0
+        self.chunks = 0
+        self.rows = 0
+        self.expired_rows = 0
+        self.pool_chunks = 0
+        self.local_chunks = 0
+        self.taken_over = 0
+        self.restarts = 0
+        # Moving average seconds per row of complete batches, by route
+        self.row_seconds = {'pool': None, 'local': None}
+        self.batches = {'pool': 0, 'local': 0}
+
+    def start(self, models):
+        """
+        Start the worker processes for this process, each loading models
+        (LoadedModels; None entries are skipped) before it takes work.
+        Called again after a reload, it replaces the workers with ones
+        warm for the new models; the old ones finish their chunks and
+        exit. Does nothing when workers=0.
+        """
+        self._start([_model_spec(active) for active in models if active is not None])
+
+    def _start(self, specs):
+        if self.workers == 0:
+            return
+        context = multiprocessing.get_context(self.start_method)
+        if self.start_method == 'forkserver':
+            # Keep app.py (and its model) out of the fork server
+            context.set_forkserver_preload(['lanes'])
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=context,
+            initializer=_warm_worker, initargs=(specs,)
+        )
+        for _ in range(self.workers):
+            executor.submit(_worker_started)
+        with self._lock:
+            # An executor inherited through fork() belongs to the parent
+            previous = self._executor if self._executor_pid == os.getpid() else None
+            self._executor = executor
+            self._executor_pid = os.getpid()
+            self._specs = specs
+        if previous is not None:
+            previous.shutdown(wait=False)
+
+    def started(self):
+        """True once this process has its worker processes"""
+        return self._executor is not None and self._executor_pid == os.getpid()
+
+    def _ensure_executor(self, active):
+        """
+        This process's executor. On first use, or after the pool broke, it
+        is started warm for the models it last had plus active.
+        """
+        if not self.started():
+            specs = self._specs if self._executor_pid == os.getpid() else []
+            spec = _model_spec(active)
+            self._start(specs if spec in specs else specs + [spec])
+        return self._executor
+
+    def _discard_executor(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self.restarts += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _finished(self, rows):
+        def callback(future):
+            with self._lock:
+                self.pending_chunks -= 1
+                self.pending_rows -= rows
+        return callback
+
+    def predict(self, matrix, active, deadline):
+        """
+        active's predictions for matrix, with NaN for every row that was not
+        scored by deadline (a time.monotonic() value).
+        """
+        started = time.perf_counter()
+        predictions = np.full(len(matrix), np.nan)
+        bounds = [(start, min(start + self.chunk_rows, len(matrix)))
+                  for start in range(0, len(matrix), self.chunk_rows)]
+        route = self._route(len(matrix))
+        executor = None
+        if route == 'pool':
+            executor, chunks = self._submit(matrix, active, bounds)
+        else:
+            chunks = [(None, bound) for bound in bounds]
+
+        # From the back, every chunk the pool has not picked up yet
+        for future, bound in reversed(chunks):
+            if future is None or future.cancel():
+                self._score_local(matrix, active, bound, predictions, deadline)
+
+        # Then the pool's chunks: its result if it has one, else score it here
+        for future, (start, stop) in chunks:
+            if future is None or future.cancelled():
+                continue
+            if not future.done():
+                if self._score_local(matrix, active, (start, stop), predictions, deadline):
+                    with self._lock:
+                        self.taken_over += 1
+                continue
+            try:
+                predictions[start:stop] = future.result()
+                with self._lock:
+                    self.pool_chunks += 1
+            except Exception as e:
+                print(f"⚠️ Batch pool chunk failed: {e}, scoring it in-process")
+                if isinstance(e, BrokenProcessPool):
+                    # The executor these chunks went to; by now self._executor
+                    # may be a healthy replacement
+                    self._discard_executor(executor)
+                self._score_local(matrix, active, (start, stop), predictions, deadline)
+
+        scored = int(np.count_nonzero(~np.isnan(predictions)))
+        with self._lock:
+            self.chunks += len(bounds)
+            self.rows += scored
+            self.expired_rows += len(matrix) - scored
+            if route is not None and scored == len(matrix):
+                elapsed = (time.perf_counter() - started) / len(matrix)
+                previous = self.row_seconds[route]
+                self.row_seconds[route] = elapsed if previous is None else (
+                    previous + self.SMOOTHING * (elapsed - previous))
+        return predictions
+
+    def _route(self, rows):
+        """
+        'pool' or 'local' for a batch of rows, by measured time per row;
+        None for a batch too small to send to (or measure for) the pool
+        """
+        if self.workers == 0 or rows < self.min_rows:
+            return None
+        with self._lock:
+            pool, local = self.row_seconds['pool'], self.row_seconds['local']
+            if local is None:
+                route = 'local'
+            elif pool is None:
+                route = 'pool'
+            else:
+                route = 'pool' if pool < local else 'local'
+                if sum(self.batches.values()) % self.PROBE_EVERY == self.PROBE_EVERY - 1:
+                    route = 'local' if route == 'pool' else 'pool'
+            self.batches[route] += 1
+        return route
+
+    def _submit(self, matrix, active, bounds):
+        """
+        (executor, [(future or None, bound)]) for bounds: the executor the
+        chunks went to, and None where the pool would not take a chunk
+        """
+        spec = _model_spec(active)
+        executor = self._ensure_executor(active)
+        accepting = executor is not None
+        chunks = []
+        for start, stop in bounds:
+            future = None
+            if accepting:
+                try:
+                    future = executor.submit(_score_chunk, spec, matrix[start:stop])
+                except (BrokenProcessPool, RuntimeError) as e:
+                    # RuntimeError: a reload replaced this executor meanwhile
+                    if isinstance(e, BrokenProcessPool):
+                        print(f"⚠️ Batch pool is broken ({e}), restarting it")
+                        self._discard_executor(executor)
+                    accepting = False
+                else:
+                    with self._lock:
+                        self.pending_chunks += 1
+                        self.pending_rows += stop - start
+                    future.add_done_callback(self._finished(stop - start))
+            chunks.append((future, (start, stop)))
+        return executor, chunks
+
+    def _score_local(self, matrix, active, bound, predictions, deadline):
+        """Score one chunk on this thread if time remains; True if it did"""
+        if time.monotonic() >= deadline:
+            return False
+        start, stop = bound
+        predictions[start:stop] = active.predict(matrix[start:stop])
+        with self._lock:
+            self.local_chunks += 1
+        return True
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'started': self.started(),
+            'chunk_rows': self.chunk_rows,
+            'min_rows': self.min_rows,
+            'start_method': self.start_method,
+            'pending_chunks': self.pending_chunks,
+            'pending_rows': self.pending_rows,
+            'chunks': self.chunks,
+            'rows': self.rows,
+            'expired_rows': self.expired_rows,
+            'pool_chunks': self.pool_chunks,
+            'local_chunks': self.local_chunks,
+            'taken_over': self.taken_over,
+            'restarts': self.restarts,
+            'batches': dict(self.batches),
+            'ms_per_1000_rows': {
+                route: round(seconds * 1e6, 2) if seconds is not None else None
+                for route, seconds in self.row_seconds.items()
+            },
+        }
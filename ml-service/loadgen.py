@@ -0,0 +1,428 @@
+# loadgen.py - Replay realistic /predict and /batch-predict load
+#
+# The Next.js app scores one user per call: callMLService() in
+# app/api/trust-rating/calculate/route.js posts the user's stats plus their
+# role to /predict. This tool replays that traffic, optionally mixed with
+# /batch-predict calls, against the service without a live deployment:
+#
+#   python loadgen.py --model models/trust_pipeline_best.joblib --concurrency 4
+#   python loadgen.py --target gunicorn --workers 2 --rate 300 --duration 60
+#   python loadgen.py --target http://127.0.0.1:5000 --rate 50 --batch-fraction 0.1
+#   python loadgen.py --compare before.json after.json
+#
+# --target inprocess imports app.py and calls it through Flask's test client
+# (no sockets, one client per thread); gunicorn starts gunicorn.conf.py on a
+# free local port, as benchmark.py does; a URL drives a service that is
+# already running.
+#
+# Payloads are drawn with retrain_model.generate_training_data(), so the
+# stats follow the training distributions, and are shaped like
+# getUserStats() output. A seed fixes the payloads, the endpoint mix and the
+# arrival times, so two runs send the same requests in the same order.
+#
+# Without --rate the load is closed loop: --concurrency clients each send
+# their next request as soon as the previous one is answered, which finds
+# the throughput the service can sustain. With --rate it is open loop:
+# requests arrive on a Poisson schedule whatever the service does, like
+# independent users. Latency then counts from the scheduled arrival, so
+# requests queued behind a saturated service show up in the tail instead of
+# quietly lowering the offered rate; --concurrency caps requests in flight.
+import argparse
+import gzip
+import http.client
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmark import Server, compare, environment_info, percentiles
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+# What Node's fetch() (undici) sends; the service answers gzip
+DEFAULT_ACCEPT_ENCODING = 'br, gzip, deflate'
+# Distinct payloads the request plan cycles through
+DEFAULT_USERS = 10000
+ROLES = ('client', 'resolver')
+
+
+def generate_payloads(n, seed=0):
+    """
+    n /predict payloads as route.js builds them: getUserStats() fields
+    (averageRatings to 2 decimals) plus userId and role, with stats drawn
+    from the retrain_model.py training distributions.
+    """
+    from retrain_model import generate_training_data, make_rng
+
+    data = generate_training_data(n, make_rng(seed))
+    roles = np.random.default_rng(seed).choice(len(ROLES), n)
+    columns = {
+        'portfolioCount': data['PortfolioCount'].tolist(),
+        'averageRatings': data['AverageRatings'].round(2).tolist(),
+        'transactionCount': data['TransactionCount'].tolist(),
+        'completedTransactions': data['CompletedTransactions'].tolist(),
+        'reviewCount': data['ReviewCount'].tolist(),
+        'starCount': data['StarCount'].tolist(),
+        'positiveReviews': data['PositiveReviews'].tolist(),
+        'neutralReviews': data['NeutralReviews'].tolist(),
+        'negativeReviews': data['NegativeReviews'].tolist(),
+        'bioLength': data['BioLength'].tolist(),
+        'bioWordCount': data['BioWordCount'].tolist(),
+    }
+    payloads = []
+    for i in range(n):
+        payload = {'userId': f'user-{seed}-{i}'}
+        payload.update((field, values[i]) for field, values in columns.items())
+        payload['role'] = ROLES[roles[i]]
+        payloads.append(payload)
+    return payloads
+
+
+def build_plan(users, batch_fraction, batch_size, seed=0):
+    """
+    The request sequence: (path, encoded body, rows) tuples. Each request
+    is a /batch-predict of batch_size consecutive users with probability
+    batch_fraction, else a /predict of the next user.
+    """
+    rng = np.random.default_rng(seed + 1)
+    plan = []
+    position = 0
+    while position < len(users):
+        if batch_fraction and rng.random() < batch_fraction:
+            batch = users[position:position + batch_size]
+            position += batch_size
+            plan.append(('/batch-predict', json.dumps({'users': batch}).encode(), len(batch)))
+        else:
+            plan.append(('/predict', json.dumps(users[position]).encode(), 1))
+            position += 1
+    return plan
+
+
+def arrival_times(count, rate, seed=0):
+    """Seconds from the start at which each of count open-loop requests arrives"""
+    gaps = np.random.default_rng(seed + 2).exponential(1.0 / rate, count)
+    return np.cumsum(gaps) - gaps[0]
+
+
+def _decode(body, coding):
+    if coding == 'gzip':
+        body = gzip.decompress(body)
+    elif coding:
+        raise ValueError(f"unexpected Content-Encoding {coding}")
+    return json.loads(body)
+
+
+class InProcessTarget:
+    """app.py in this process, called through Flask's test client"""
+
+    def __init__(self, model_path, accept_encoding):
+        os.environ['MODEL_PATH'] = model_path
+        os.environ.setdefault('MODEL_WATCH_INTERVAL', '0')
+        os.environ.setdefault('MODEL_LOAD_MODE', 'sync')
+        sys.path.insert(0, SERVICE_DIR)
+        import app
+
+        if app.model is None:
+            raise RuntimeError(f"app.py could not load {model_path}")
+        self.app = app.app
+        self.headers = {'Accept-Encoding': accept_encoding} if accept_encoding else {}
+        self.name = 'inprocess'
+        self._local = threading.local()
+
+    def post(self, path, body):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.post(path, data=body, content_type='application/json', headers=self.headers)
+        return response.status_code, _decode(response.get_data(), response.headers.get('Content-Encoding'))
+
+    def close(self):
+        pass
+
+
+class HttpTarget:
+    """A running service, with one keep-alive connection per thread"""
+
+    def __init__(self, url, accept_encoding, timeout):
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme != 'http' or not parsed.hostname:
+            raise ValueError(f"expected an http:// URL, got {url!r}")
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.prefix = parsed.path.rstrip('/')
+        self.headers = {'Content-Type': 'application/json'}
+        if accept_encoding:
+            self.headers['Accept-Encoding'] = accept_encoding
+        self.timeout = timeout
+        self.name = url
+        self._local = threading.local()
+
+    def post(self, path, body):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            conn.request('POST', self.prefix + path, body=body, headers=self.headers)
+            response = conn.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException):
+            # The next request from this thread reconnects
+            conn.close()
+            self._local.conn = None
+            raise
+        return response.status, _decode(payload, response.getheader('Content-Encoding'))
+
+    def close(self):
+        pass
+
+
+class GunicornTarget(HttpTarget):
+    """The service under gunicorn.conf.py on a free local port"""
+
+    def __init__(self, model_path, workers, accept_encoding, timeout):
+        self._workdir = tempfile.TemporaryDirectory(prefix='ml-load-')
+        print(f"🚀 Starting gunicorn with {workers} workers")
+        self.server = Server(model_path, workers, self._workdir.name)
+        super().__init__(f'http://127.0.0.1:{self.server.port}', accept_encoding, timeout)
+        self.name = f'gunicorn ({workers} workers)'
+
+    def close(self):
+        self.server.stop()
+        self._workdir.cleanup()
+
+
+class Recorder:
+    """Outcome of every timed request, plus the first few error messages"""
+
+    def __init__(self):
+        self.samples = []
+        self.error_messages = {}
+        self._lock = threading.Lock()
+
+    def send(self, target, request, scheduled=None):
+        """
+        Send one planned request and record it. Latency counts from
+        scheduled (a perf_counter() time) when given, else from the send.
+        """
+        path, body, rows = request
+        started = time.perf_counter()
+        fallback = rejected = 0
+        try:
+            status, answer = target.post(path, body)
+            ok = status == 200 and answer.get('success') is True
+            if ok and path == '/predict':
+                fallback = answer.get('method') == 'fallback'
+            elif ok:
+                for result in answer.get('predictions', ()):
+                    if result.get('success') is False:
+                        rejected += 1
+                    elif result.get('method') == 'fallback':
+                        fallback += 1
+            error = None if ok else f"HTTP {status}: {answer.get('error')}"
+        except Exception as e:
+            ok, error = False, f"{type(e).__name__}: {e}"
+        finished = time.perf_counter()
+        sample = (path, (finished - (started if scheduled is None else scheduled)) * 1000.0,
+                  ok, rows, int(fallback), rejected,
+                  (started - scheduled) * 1000.0 if scheduled is not None else 0.0, finished)
+        with self._lock:
+            self.samples.append(sample)
+            if error is not None and (error in self.error_messages or len(self.error_messages) < 10):
+                self.error_messages[error] = self.error_messages.get(error, 0) + 1
+
+
+def run_closed_loop(target, plan, concurrency, duration, max_requests):
+    """concurrency clients sending back to back until duration or max_requests"""
+    recorder = Recorder()
+    next_index = iter(range(max_requests or sys.maxsize))
+    index_lock = threading.Lock()
+    deadline = time.perf_counter() + duration if duration else None
+
+    def client():
+        while deadline is None or time.perf_counter() < deadline:
+            with index_lock:
+                i = next(next_index, None)
+            if i is None:
+                return
+            recorder.send(target, plan[i % len(plan)])
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, started
+
+
+def run_open_loop(target, plan, concurrency, rate, duration, max_requests, seed):
+    """Requests at Poisson arrivals of rate per second, at most concurrency in flight"""
+    count = max_requests or max(1, int(rate * duration))
+    arrivals = arrival_times(count, rate, seed)
+    recorder = Recorder()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        started = time.perf_counter()
+        for i, offset in enumerate(arrivals.tolist()):
+            scheduled = started + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(recorder.send, target, plan[i % len(plan)], scheduled)
+    return recorder, started
+
+
+def summarize(samples, elapsed):
+    """Throughput, latency percentiles, error and fallback rates of samples"""
+    requests = len(samples)
+    errors = sum(1 for sample in samples if not sample[2])
+    rows = sum(sample[3] for sample in samples if sample[2])
+    rejected = sum(sample[5] for sample in samples)
+    fallback = sum(sample[4] for sample in samples)
+    scored = rows - rejected
+    summary = {
+        'requests': requests,
+        'errors': errors,
+        'error_rate': round(errors / requests, 5) if requests else 0.0,
+        'throughput_rps': round(requests / elapsed, 2) if elapsed else 0.0,
+        'rows_per_sec': round(rows / elapsed, 1) if elapsed else 0.0,
+        'rejected_rows': rejected,
+        'fallback_rows': fallback,
+        'fallback_rate': round(fallback / scored, 5) if scored else 0.0,
+    }
+    if samples:
+        summary['latency'] = percentiles([sample[1] for sample in samples])
+    return summary
+
+
+def report(recorder, started, settings, target_name):
+    samples = recorder.samples
+    elapsed = (max(sample[7] for sample in samples) - started) if samples else 0.0
+    results = {
+        'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': environment_info(),
+        'settings': dict(settings, target=target_name),
+        'elapsed_seconds': round(elapsed, 3),
+        'total': summarize(samples, elapsed),
+        'endpoints': {
+            path: summarize([sample for sample in samples if sample[0] == path], elapsed)
+            for path in sorted({sample[0] for sample in samples})
+        },
+        'error_messages': recorder.error_messages,
+    }
+    if settings['rate']:
+        results['open_loop'] = {
+            'offered_rps': settings['rate'],
+            'achieved_rps': results['total']['throughput_rps'],
+            # Time requests waited for a free client; large values mean
+            # --concurrency, not the service, limited the offered load
+            'send_lag': percentiles([sample[6] for sample in samples]) if samples else None,
+        }
+    return results
+
+
+def print_report(results):
+    total = results['total']
+    print(f"✅ {total['requests']} requests in {results['elapsed_seconds']}s: "
+          f"{total['throughput_rps']} req/s, {total['rows_per_sec']} rows/s")
+    for path, summary in results['endpoints'].items():
+        latency = summary.get('latency', {})
+        print(f"   {path:<15} {summary['requests']:>7} req  p50 {latency.get('p50_ms')} ms  "
+              f"p95 {latency.get('p95_ms')} ms  p99 {latency.get('p99_ms')} ms  "
+              f"errors {summary['error_rate']:.2%}  fallback {summary['fallback_rate']:.2%}")
+    if 'open_loop' in results and results['open_loop']['send_lag']:
+        lag = results['open_loop']['send_lag']
+        print(f"   offered {results['open_loop']['offered_rps']} req/s, send lag p99 {lag['p99_ms']} ms")
+    for message, count in results['error_messages'].items():
+        print(f"⚠️ {count}x {message}")
+
+
+def make_target(args):
+    if args.target == 'inprocess':
+        os.environ.setdefault('PREDICTION_CACHE_SIZE', '0')
+        return InProcessTarget(args.model, args.accept_encoding)
+    if args.target == 'gunicorn':
+        return GunicornTarget(args.model, args.workers, args.accept_encoding, args.timeout)
+    return HttpTarget(args.target, args.accept_encoding, args.timeout)
+
+
+def run(args):
+    print(f"🎲 Generating {args.users} payloads (seed {args.seed})")
+    users = generate_payloads(args.users, args.seed)
+    plan = build_plan(users, args.batch_fraction, args.batch_size, args.seed)
+
+    target = make_target(args)
+    try:
+        for request in plan[:args.warmup]:
+            target.post(request[0], request[1])
+        mode = f"open loop at {args.rate} req/s" if args.rate else "closed loop"
+        print(f"⏱️ {target.name}: {mode}, concurrency {args.concurrency}")
+        if args.rate:
+            recorder, started = run_open_loop(target, plan, args.concurrency, args.rate,
+                                              args.duration, args.requests, args.seed)
+        else:
+            recorder, started = run_closed_loop(target, plan, args.concurrency,
+                                                None if args.requests else args.duration, args.requests)
+    finally:
+        target.close()
+
+    settings = {
+        key: getattr(args, key) for key in (
+            'seed', 'users', 'concurrency', 'rate', 'duration', 'requests',
+            'batch_fraction', 'batch_size', 'warmup', 'accept_encoding'
+        )
+    }
+    settings['prediction_cache_size'] = os.getenv('PREDICTION_CACHE_SIZE')
+    results = report(recorder, started, settings, target.name)
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Results written to {args.output}")
+    return 1 if results['total']['errors'] else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate /predict and /batch-predict load.')
+    parser.add_argument('--target', default='inprocess',
+                        help="'inprocess', 'gunicorn' or the service's http:// URL (default: inprocess)")
+    parser.add_argument('--model', default=os.path.abspath(os.getenv('MODEL_PATH', 'models/trust_pipeline_best.joblib')),
+                        help='Model file for inprocess and gunicorn targets (default: MODEL_PATH)')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers (default: 2)')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='Clients (closed loop) or requests in flight (open loop) (default: 8)')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='Open-loop arrivals per second; unset runs closed loop')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds of load (default: 30)')
+    parser.add_argument('--requests', type=int, default=None, help='Send this many requests instead of --duration')
+    parser.add_argument('--batch-fraction', type=float, default=0.0,
+                        help='Share of requests that are /batch-predict (default: 0)')
+    parser.add_argument('--batch-size', type=int, default=100, help='Users per /batch-predict (default: 100)')
+    parser.add_argument('--users', type=int, default=DEFAULT_USERS,
+                        help=f'Distinct payloads to cycle through (default: {DEFAULT_USERS})')
+    parser.add_argument('--seed', type=int, default=0, help='Payload, mix and arrival seed (default: 0)')
+    parser.add_argument('--warmup', type=int, default=20, help='Untimed requests first (default: 20)')
+    parser.add_argument('--timeout', type=float, default=30.0, help='HTTP timeout in seconds (default: 30)')
+    parser.add_argument('--accept-encoding', default=DEFAULT_ACCEPT_ENCODING,
+                        help=f"Accept-Encoding to send, '' for none (default: {DEFAULT_ACCEPT_ENCODING!r})")
+    parser.add_argument('--output', default=None, help='Write the results as JSON')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='Compare two results files instead of running')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+    if args.rate is not None and args.rate <= 0:
+        parser.error('--rate must be positive')
+    if not 0 <= args.batch_fraction <= 1:
+        parser.error('--batch-fraction must be between 0 and 1')
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
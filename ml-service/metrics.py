@@ -0,0 +1,235 @@
+# metrics.py - Prometheus-style metrics for the ML service
+#
+# A small, dependency-free registry of counters, gauges and histograms that
+# renders the Prometheus text exposition format for /metrics, plus timers
+# for the stages of a request (parse, validate, lane_wait, features, cache,
+# batch_wait, frame, model, explain, fallback, serialize).
+#
+# Metrics are per process: with several gunicorn workers each scrape is
+# answered by whichever worker picks it up, so aggregate with sum() over
+# instances or scrape the workers individually.
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds: 50µs .. 10s
+DURATION_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+# Rows per request
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+
+REGISTRY = []
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Endpoint label for stage timers; set by endpoint() and track_request()
+_endpoint = contextvars.ContextVar('metrics_endpoint', default='background')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(f'{n}="{_escape(v)}"' for n, v in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple([labels[n] for n in self.labelnames])
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items(), key=lambda item: tuple(map(str, item[0])))
+            lines.extend(self._render_samples(items))
+        return lines
+
+    def _render_samples(self, items):
+        return [
+            f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+            for key, value in items
+        ]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [per-bucket counts (last one is +Inf), sum, count]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _render_samples(self, items):
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    'trust_request_duration_seconds', 'Time to answer a scoring request (each chunk, for streams)', ['endpoint']
+)
+STAGE_DURATION = Histogram(
+    'trust_stage_duration_seconds', 'Time spent in each stage of scoring', ['endpoint', 'stage']
+)
+PREDICTIONS = Counter(
+    'trust_predictions_total', 'Scored users by method (ml_model or fallback)', ['endpoint', 'method']
+)
+BATCH_SIZE = Histogram(
+    'trust_batch_size_rows', 'Users per batch request or stream chunk', ['endpoint'], buckets=SIZE_BUCKETS
+)
+MODEL_LOADS = Counter('trust_model_loads_total', 'Model load attempts by outcome', ['status'])
+MODEL_LOAD_DURATION = Histogram(
+    'trust_model_load_duration_seconds', 'Time to load and validate a model file',
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+MODEL_INFO = Gauge('trust_model_info', 'Model currently in service (value is always 1)', ['version', 'engine'])
+ROUTE_MISSES = Counter(
+    'trust_route_misses_total', 'Requests a role route sent to the default model because its own was not loaded',
+    ['role', 'model']
+)
+SHADOW_ROWS = Counter(
+    'trust_shadow_rows_total', 'Rows sampled for the shadow model by outcome (scored, dropped, failed, skipped)',
+    ['model', 'outcome']
+)
+SHADOW_LATENCY = Histogram('trust_shadow_predict_seconds', 'Shadow model time per predict() call', ['model'])
+SHADOW_DELTA = Histogram(
+    'trust_shadow_score_delta', 'Absolute difference between shadow and primary scores (0-100 points)',
+    ['model'], buckets=(0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0)
+)
+CACHE_STATS = Gauge(
+    'trust_prediction_cache', 'Prediction cache counters (hits, misses, size, evictions, invalidations)', ['stat']
+)
+LANE_STATS = Gauge(
+    'trust_lane', 'Execution lane state (running, queued, rejected, pending_chunks, expired_rows, ...)',
+    ['lane', 'stat']
+)
+
+
+@contextmanager
+def endpoint(name):
+    """Label the stages timed inside this block with endpoint name"""
+    token = _endpoint.set(name)
+    try:
+        yield
+    finally:
+        _endpoint.reset(token)
+
+
+@contextmanager
+def track_request(name):
+    """Time a request and label the stages timed inside it with endpoint name"""
+    started = time.perf_counter()
+    try:
+        with endpoint(name):
+            yield
+    finally:
+        REQUEST_DURATION.observe(time.perf_counter() - started, endpoint=name)
+
+
+class stage:
+    """Time one stage of the current request (a class: cheaper than @contextmanager)"""
+
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        STAGE_DURATION.observe(time.perf_counter() - self.started, endpoint=_endpoint.get(), stage=self.name)
+
+
+def count_predictions(ml_model, fallback):
+    """Count scored users for the current request"""
+    name = _endpoint.get()
+    if ml_model:
+        PREDICTIONS.inc(ml_model, endpoint=name, method='ml_model')
+    if fallback:
+        PREDICTIONS.inc(fallback, endpoint=name, method='fallback')
+
+
+def observe_batch_size(rows):
+    """Record the size of a batch scored by the current request"""
+    BATCH_SIZE.observe(rows, endpoint=_endpoint.get())
+
+
+def set_model(version, engine):
+    """Point trust_model_info at the model now in service"""
+    MODEL_INFO.clear()
+    MODEL_INFO.set(1, version=version, engine=engine)
+
+
+def render():
+    """All metrics in the Prometheus text format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
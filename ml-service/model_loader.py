@@ -0,0 +1,352 @@
+# model_loader.py - Load, validate and package the trust model
+#
+# Everything needed to turn a model file into something the service can
+# predict with lives here, so app.py can build a new model off the request
+# path and swap it in with a single assignment.
+#
+# A model can ship in two formats: the sklearn Pipeline pickled with joblib
+# (the training output) and an optional compact .npz exported from it (see
+# export_compact_model()), which loads with NumPy alone. joblib, pandas and
+# sklearn are only imported when a joblib model is loaded, so serving a
+# compact model never pays for them.
+import hashlib
+import os
+import threading
+import time
+import warnings
+
+import numpy as np
+
+from forest_engine import CompiledForest, verify_engine
+import metrics
+
+# Model input columns, in the order calculate_features() produces them
+FEATURE_COLUMNS = [
+    'PortfolioCount', 'AverageRatings', 'TransactionCount',
+    'CompletedTransactions', 'ReviewCount', 'StarCount',
+    'PositiveReviews', 'NeutralReviews', 'NegativeReviews',
+    'CompletionRate', 'CancellationRate', 'BioLength',
+    'BioWordCount', 'PositiveReviewRatio', 'ReviewCoverage',
+    'EngagementIndex'
+]
+
+# Dummy row every freshly loaded model must be able to score
+SMOKE_TEST_FEATURES = {
+    'PortfolioCount': 5,
+    'AverageRatings': 4.0,
+    'TransactionCount': 10,
+    'CompletedTransactions': 9,
+    'ReviewCount': 5,
+    'StarCount': 20,
+    'PositiveReviews': 4,
+    'NeutralReviews': 1,
+    'NegativeReviews': 0,
+    'CompletionRate': 90.0,
+    'CancellationRate': 10.0,
+    'BioLength': 100,
+    'BioWordCount': 20,
+    'PositiveReviewRatio': 0.8,
+    'ReviewCoverage': 0.5,
+    'EngagementIndex': 150
+}
+
+
+# MODEL_FORMAT values accepted by load_model_bundle()
+MODEL_FORMATS = ('auto', 'joblib', 'npz')
+
+
+def compact_path(path):
+    """Path of the compact .npz artifact that goes with the joblib model at path"""
+    return os.path.splitext(path)[0] + '.npz'
+
+
+def file_signature(path):
+    """(mtime, size) of a file, or None if it is missing"""
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+
+def model_signature(path):
+    """
+    Signatures of the joblib model at path and of its compact artifact, or
+    None if neither exists. Changes whenever either file is replaced.
+    """
+    signatures = (file_signature(path), file_signature(compact_path(path)))
+    return None if signatures == (None, None) else signatures
+
+
+def file_version(path):
+    """Short content hash identifying a model file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def load_pipeline(path, mmap_mode=None):
+    """
+    joblib.load() the sklearn Pipeline at path, retrying with the
+    ColumnTransformer compatibility patch for pickles from other sklearn
+    versions. Raises on failure.
+
+    mmap_mode='r' maps the NumPy arrays stored in an uncompressed joblib
+    file instead of copying them, so processes loading the same file share
+    those pages through the OS page cache.
+    """
+    import joblib
+    import pandas as pd
+    import sklearn
+
+    print(f"📊 Pandas version: {pd.__version__}")
+    print(f"🔧 Scikit-learn version: {sklearn.__version__}")
+
+    # Suppress sklearn warnings during loading
+    warnings.filterwarnings('ignore', category=UserWarning)
+
+    try:
+        # First attempt: Load normally
+        pipeline = joblib.load(path, mmap_mode=mmap_mode)
+        print(f"✅ Model loaded successfully (standard method)")
+
+    except AttributeError as e:
+        if "'ColumnTransformer' object has no attribute" not in str(e):
+            raise
+        print(f"⚠️ ColumnTransformer compatibility issue detected")
+        print(f"🔧 Attempting compatibility fix...")
+
+        # Try loading with sklearn compatibility
+        import sklearn.compose
+
+        # Patch the ColumnTransformer if needed
+        if not hasattr(sklearn.compose.ColumnTransformer, '_name_to_fitted_passthrough'):
+            sklearn.compose.ColumnTransformer._name_to_fitted_passthrough = {}
+
+        pipeline = joblib.load(path, mmap_mode=mmap_mode)
+        print(f"✅ Model loaded with compatibility patch")
+
+    return pipeline
+
+
+def build_compiled_model(pipeline, probe_rows):
+    """
+    Build the pandas-free engine for a loaded pipeline and check it is
+    bit-identical to sklearn. Returns None (keep serving through sklearn)
+    if the pipeline shape is unsupported or verification fails.
+    """
+    try:
+        engine = CompiledForest.from_pipeline(pipeline, FEATURE_COLUMNS)
+        extra_rows = [[row[c] for c in FEATURE_COLUMNS] for row in probe_rows]
+        mismatches = verify_engine(engine, pipeline, FEATURE_COLUMNS, extra_rows)
+        if mismatches:
+            print(f"⚠️ Compiled engine disagrees with sklearn on {mismatches} probe rows, using sklearn")
+            return None
+        print(f"⚡ Compiled engine ready: {engine.n_trees} trees, {engine.n_nodes} nodes, depth {engine.max_depth}")
+        return engine
+    except Exception as e:
+        print(f"⚠️ Could not build compiled engine: {e}, using sklearn")
+        return None
+
+
+def export_compact_model(pipeline, path, source_version):
+    """
+    Write the compact artifact for pipeline to path. source_version is the
+    file_version() of the joblib file it came from, so a loader can tell
+    when the artifact is stale. Raises ValueError if the pipeline cannot be
+    compiled or the compiled forest disagrees with sklearn.
+    """
+    engine = CompiledForest.from_pipeline(pipeline, FEATURE_COLUMNS)
+    extra_rows = [[SMOKE_TEST_FEATURES[c] for c in FEATURE_COLUMNS]]
+    mismatches = verify_engine(engine, pipeline, FEATURE_COLUMNS, extra_rows)
+    if mismatches:
+        raise ValueError(f"Compiled forest disagrees with sklearn on {mismatches} probe rows")
+    engine.save(path, FEATURE_COLUMNS, source_version=source_version)
+    return engine
+
+
+def load_compact_model(path):
+    """
+    Load and smoke-test a compact artifact. Returns (engine, header); raises
+    if the file is invalid or cannot score the dummy row.
+    """
+    engine, header = CompiledForest.load(path, FEATURE_COLUMNS)
+    row = np.array([[SMOKE_TEST_FEATURES[c] for c in FEATURE_COLUMNS]], dtype=np.float64)
+    test_prediction = engine.predict(row)[0]
+    if not np.isfinite(test_prediction):
+        raise ValueError(f"Smoke test prediction is not finite: {test_prediction}")
+    print(f"🧪 Test prediction: {test_prediction:.2f}")
+    return engine, header
+
+
+class LoadedModel:
+    """
+    A validated pipeline plus everything derived from it.
+
+    Instances are never mutated after construction (apart from the
+    explainer cache, which only explain() uses), so the service can
+    replace the one it serves from with a single reference assignment and
+    every request sees either the old model or the new one, never a mix.
+    """
+
+    def __init__(self, pipeline, compiled, version, path, signature, load_seconds,
+                 model_format='joblib', compaction=None):
+        self.pipeline = pipeline
+        self.compiled = compiled
+        self.version = version
+        self.path = path
+        self.signature = signature
+        self.load_seconds = load_seconds
+        self.format = model_format
+        # forest_compaction.py settings and measured error, for a compacted artifact
+        self.compaction = compaction
+        self.loaded_at = time.time()
+        self._explainer = compiled
+        self._explainer_lock = threading.Lock()
+
+    @property
+    def engine(self):
+        return 'compiled' if self.compiled is not None else 'sklearn'
+
+    def predict(self, matrix):
+        """Predict from a float64 matrix in FEATURE_COLUMNS order"""
+        if self.compiled is not None:
+            with metrics.stage('model'):
+                return self.compiled.predict(matrix)
+        import pandas as pd  # already loaded with the pipeline
+
+        with metrics.stage('frame'):
+            frame = pd.DataFrame(matrix, columns=FEATURE_COLUMNS)
+        with metrics.stage('model'):
+            return self.pipeline.predict(frame)
+
+    def explainer(self):
+        """
+        The CompiledForest explain() runs on: the serving engine, or for a
+        model served through sklearn one built and verified on first use
+        (about 0.4 s for 100 trees) and kept with the model. Raises
+        ValueError if the pipeline cannot be compiled.
+        """
+        if self._explainer is None:
+            with self._explainer_lock:
+                if self._explainer is None:
+                    engine = build_compiled_model(self.pipeline, [SMOKE_TEST_FEATURES])
+                    if engine is None:
+                        raise ValueError('this model cannot be explained: its forest could not be compiled')
+                    self._explainer = engine
+        return self._explainer
+
+    def explain(self, matrix):
+        """
+        Per-feature contributions for a float64 matrix in FEATURE_COLUMNS
+        order: (bias, contributions, predictions), see CompiledForest.explain()
+        """
+        explainer = self.explainer()
+        with metrics.stage('explain'):
+            return explainer.explain(matrix)
+
+
+def _load_compact_bundle(path, model_format, started):
+    """
+    The compact-artifact half of load_model_bundle(). Returns None when the
+    joblib file should be loaded instead: in 'auto' mode when there is no
+    artifact, or it is invalid or older than the joblib file next to it.
+    """
+    artifact = compact_path(path)
+    if not os.path.exists(artifact):
+        if model_format == 'npz':
+            raise FileNotFoundError(f"Compact model not found at {artifact}")
+        return None
+
+    signature = model_signature(path)
+    try:
+        engine, header = load_compact_model(artifact)
+        source_version = header.get('source_version')
+        if path != artifact and os.path.exists(path) and source_version != file_version(path):
+            raise ValueError(f"{artifact} was exported from model {source_version}, "
+                             f"not from the current {path}")
+    except Exception as e:
+        if model_format == 'npz':
+            raise
+        print(f"⚠️ Ignoring compact model: {e}, loading {path}")
+        return None
+
+    print(f"⚡ Compact model loaded: {engine.n_trees} trees, {engine.n_nodes} nodes, depth {engine.max_depth}")
+    compaction = header.get('compaction')
+    if compaction is not None:
+        print(f"🗜️ Compacted forest: within {compaction.get('max_abs_error')} points of model "
+              f"{source_version} on held-out rows")
+    return LoadedModel(
+        pipeline=None,
+        compiled=engine,
+        # A compacted forest predicts differently, so it must not share
+        # cache entries (keyed by version) with the exact model
+        version=file_version(artifact) if compaction is not None or not source_version else source_version,
+        path=artifact,
+        signature=signature,
+        load_seconds=time.perf_counter() - started,
+        model_format='npz',
+        compaction=compaction
+    )
+
+
+def load_model_bundle(path, inference_engine='sklearn', mmap_mode=None, model_format='auto'):
+    """
+    Load the model at path, smoke-test it and build the optional compiled
+    engine. Returns a LoadedModel; raises if the file is missing or the
+    model cannot score the dummy row.
+
+    model_format picks the file: 'joblib' always unpickles path, 'npz'
+    requires its compact artifact (compact_path(path)), and 'auto' uses the
+    artifact when it exists and was exported from the current joblib file,
+    else falls back to joblib. A compact model always predicts with the
+    compiled engine, whatever inference_engine says, and keeps the version
+    of the joblib file it came from.
+    """
+    started = time.perf_counter()
+    if model_format not in MODEL_FORMATS:
+        raise ValueError(f"Unknown model format {model_format!r} (expected one of {MODEL_FORMATS})")
+    if model_format != 'joblib':
+        loaded = _load_compact_bundle(path, model_format, started)
+        if loaded is not None:
+            return loaded
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Model file not found at {path}")
+
+    signature = model_signature(path)
+    version = file_version(path)
+    pipeline = load_pipeline(path, mmap_mode)
+    print(f"📋 Model type: {type(pipeline)}")
+
+    # Test the model with dummy data
+    import pandas as pd
+    test_prediction = pipeline.predict(pd.DataFrame([SMOKE_TEST_FEATURES]))[0]
+    if not np.isfinite(test_prediction):
+        raise ValueError(f"Smoke test prediction is not finite: {test_prediction}")
+    print(f"🧪 Test prediction: {test_prediction:.2f}")
+
+    compiled = None
+    if inference_engine == 'compiled':
+        compiled = build_compiled_model(pipeline, [SMOKE_TEST_FEATURES])
+
+    return LoadedModel(
+        pipeline=pipeline,
+        compiled=compiled,
+        version=version,
+        path=path,
+        signature=signature,
+        load_seconds=time.perf_counter() - started
+    )
+
+
+if __name__ == '__main__':
+    # Export the compact artifact for an existing joblib model:
+    #   python model_loader.py models/trust_pipeline_best.joblib
+    import sys
+
+    source = sys.argv[1] if len(sys.argv) > 1 else os.getenv('MODEL_PATH', './models/trust_pipeline_best.joblib')
+    artifact = compact_path(source)
+    export_compact_model(load_pipeline(source), artifact, file_version(source))
+    print(f"📦 Wrote {artifact} ({os.path.getsize(artifact) / 1024:.0f} KB)")
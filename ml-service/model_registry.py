@@ -0,0 +1,283 @@
+# model_registry.py - Named models, per-role routing and shadow scoring
+#
+# app.py always serves its MODEL_PATH model under the name "default".
+# MODEL_REGISTRY_PATH points at a JSON file that adds more models, routes
+# the roles the Next.js app scores (client, resolver) to them, and can name a
+# candidate to shadow-score a sample of traffic with:
+#
+#   {
+#     "models": {
+#       "resolver-v2": {"path": "./models/resolver_v2.joblib"},
+#       "candidate": {"path": "./models/candidate.npz", "format": "npz"}
+#     },
+#     "routes": {"resolver": "resolver-v2"},
+#     "shadow": {"model": "candidate", "sample_rate": 0.05}
+#   }
+#
+# A model entry takes path plus optional engine, format and mmap_mode
+# (defaulting to INFERENCE_ENGINE, MODEL_FORMAT and MODEL_MMAP_MODE). A
+# request is served by its explicit "model" ("name" or "name@version"),
+# else by the route of its "role", else by "default". A role whose model is
+# not loaded (still loading, or failed to) is served by "default" until it is.
+#
+# The shadow model never answers a request: ShadowScorer queues the sampled
+# feature rows and the scores the primary model gave them, and a background
+# thread scores them with the candidate and records the deltas and latency.
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+import metrics
+
+DEFAULT_MODEL_NAME = 'default'
+
+# Keys a model entry may have
+_MODEL_KEYS = ('path', 'engine', 'format', 'mmap_mode')
+
+
+def load_registry_config(path):
+    """
+    Read and check a registry file. Returns {"models": {name: spec},
+    "routes": {role: name}, "shadow": {...} or None}; raises ValueError
+    naming the first problem.
+    """
+    with open(path) as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError('the registry must be a JSON object')
+
+    models = config.get('models') or {}
+    if not isinstance(models, dict):
+        raise ValueError('models must be an object of name: {"path": ...}')
+    for name, spec in models.items():
+        if name == DEFAULT_MODEL_NAME:
+            raise ValueError(f'"{DEFAULT_MODEL_NAME}" is reserved for MODEL_PATH')
+        if '@' in name:
+            raise ValueError(f'model name {name!r} cannot contain "@"')
+        if not isinstance(spec, dict) or not isinstance(spec.get('path'), str):
+            raise ValueError(f'model {name!r} needs a "path"')
+        unknown = set(spec) - set(_MODEL_KEYS)
+        if unknown:
+            raise ValueError(f"model {name!r} has unknown keys: {', '.join(sorted(unknown))}")
+        if spec.get('engine', 'sklearn') not in ('sklearn', 'compiled'):
+            raise ValueError(f"model {name!r}: engine must be sklearn or compiled")
+
+    known = set(models) | {DEFAULT_MODEL_NAME}
+    routes = config.get('routes') or {}
+    if not isinstance(routes, dict):
+        raise ValueError('routes must be an object of role: model name')
+    for role, name in routes.items():
+        if name not in known:
+            raise ValueError(f'route {role!r} points at unknown model {name!r}')
+
+    shadow = config.get('shadow')
+    if shadow is not None:
+        if not isinstance(shadow, dict) or shadow.get('model') not in known:
+            raise ValueError('shadow.model must name a registered model')
+        rate = shadow.get('sample_rate', 0.01)
+        if isinstance(rate, bool) or not isinstance(rate, (int, float)) or not 0 < rate <= 1:
+            raise ValueError('shadow.sample_rate must be in (0, 1]')
+        shadow = {'model': shadow['model'], 'sample_rate': float(rate)}
+
+    return {'models': models, 'routes': dict(routes), 'shadow': shadow}
+
+
+class ModelRegistry:
+    """
+    LoadedModels by name, plus the role routes.
+
+    Like app.model, the name -> model mapping is only ever replaced as a
+    whole, so a request resolves its model with one read and keeps that
+    LoadedModel even if a reload swaps the name to a newer one.
+    """
+
+    def __init__(self, specs=None, routes=None):
+        self.specs = dict(specs or {})
+        self.routes = dict(routes or {})
+        self._models = {}
+        self._lock = threading.Lock()
+        # Requests a route sent to "default" because its model was not loaded, by role
+        self.route_misses = {}
+
+    def names(self):
+        return [DEFAULT_MODEL_NAME] + sorted(self.specs)
+
+    def set(self, name, loaded):
+        """Put a freshly loaded model in service under name"""
+        with self._lock:
+            models = dict(self._models)
+            models[name] = loaded
+            self._models = models
+
+    def get(self, name):
+        """The LoadedModel serving name, or None if it is not loaded (yet)"""
+        return self._models.get(name)
+
+    def resolve(self, model=None, role=None):
+        """
+        (name, LoadedModel or None) for a request's "model" and "role"
+        fields. Raises LookupError for an explicit model that is not
+        registered, or that is not at the requested "name@version". A role
+        routed to a model that is not loaded gets "default" instead.
+        """
+        if model is not None:
+            if not isinstance(model, str):
+                raise LookupError('model must be a string: "name" or "name@version"')
+            name, _, version = model.partition('@')
+            if name != DEFAULT_MODEL_NAME and name not in self.specs:
+                raise LookupError(f"unknown model {name!r}; registered: {', '.join(self.names())}")
+            loaded = self.get(name)
+            if version and (loaded is None or loaded.version != version):
+                served = loaded.version if loaded is not None else 'not loaded'
+                raise LookupError(f"model {name!r} is at version {served}, not {version}")
+            return name, loaded
+        name = self.routes.get(role, DEFAULT_MODEL_NAME) if isinstance(role, str) else DEFAULT_MODEL_NAME
+        loaded = self.get(name)
+        if loaded is None and name != DEFAULT_MODEL_NAME:
+            self._route_miss(role, name)
+            return DEFAULT_MODEL_NAME, self.get(DEFAULT_MODEL_NAME)
+        return name, loaded
+
+    def _route_miss(self, role, name):
+        with self._lock:
+            first = role not in self.route_misses
+            self.route_misses[role] = self.route_misses.get(role, 0) + 1
+        metrics.ROUTE_MISSES.inc(role=role, model=name)
+        if first:
+            print(f"⚠️ Role {role!r} routes to model {name!r}, which is not loaded; serving it with {DEFAULT_MODEL_NAME!r}")
+
+    def describe(self):
+        """Name, version, engine and format of every model, and the routes (for /health)"""
+        models = {}
+        for name in self.names():
+            loaded = self.get(name)
+            models[name] = {
+                'version': loaded.version if loaded is not None else None,
+                'engine': loaded.engine if loaded is not None else None,
+                'format': loaded.format if loaded is not None else None,
+                'path': loaded.path if loaded is not None else self.specs.get(name, {}).get('path'),
+            }
+        return {'models': models, 'routes': self.routes, 'route_misses': dict(self.route_misses)}
+
+
+class ShadowScorer:
+    """
+    Score a sample of served rows with a candidate model, off the request
+    path.
+
+    offer() is called after the primary model answered. It keeps each row
+    with probability sample_rate and hands the kept rows to a background
+    thread through a bounded queue; when the queue is full the rows are
+    dropped rather than slowing the request down. The thread scores them
+    with the registry's current candidate and records, per row, the
+    candidate's score minus the primary's (0-100 scale), plus the
+    candidate's latency per call, in stats() and the trust_shadow_*
+    metrics.
+    """
+
+    def __init__(self, registry, model_name, sample_rate, queue_size=100):
+        self.registry = registry
+        self.model_name = model_name
+        self.sample_rate = sample_rate
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread_pid = None
+        self.offered = 0
+        self.scored = 0
+        self.dropped = 0
+        self.failed = 0
+        self.skipped = 0
+        self.delta_sum = 0.0
+        self.abs_delta_sum = 0.0
+        self.max_abs_delta = 0.0
+        self.seconds = 0.0
+        self.calls = 0
+
+    def _ensure_worker(self):
+        """Start the scoring thread in this process (again after a fork). Caller holds the lock."""
+        if self._thread_pid == os.getpid():
+            return
+        self._thread_pid = os.getpid()
+        threading.Thread(target=self._run, name='shadow-scorer', daemon=True).start()
+
+    def offer(self, matrix, primary_scores, primary):
+        """
+        Sample rows of a feature matrix the primary LoadedModel just scored
+        (primary_scores, clamped to 0-100). Never blocks.
+        """
+        if primary is None or len(matrix) == 0:
+            return
+        keep = np.random.random_sample(len(matrix)) < self.sample_rate
+        if not keep.any():
+            return
+        rows = int(keep.sum())
+        with self._lock:
+            self._ensure_worker()
+            self.offered += rows
+        try:
+            self._queue.put_nowait((matrix[keep], np.asarray(primary_scores)[keep], primary.version))
+        except queue.Full:
+            with self._lock:
+                self.dropped += rows
+            metrics.SHADOW_ROWS.inc(rows, model=self.model_name, outcome='dropped')
+
+    def _run(self):
+        with metrics.endpoint('shadow'):
+            while True:
+                matrix, primary_scores, primary_version = self._queue.get()
+                self._score(matrix, primary_scores, primary_version)
+
+    def _score(self, matrix, primary_scores, primary_version):
+        candidate = self.registry.get(self.model_name)
+        if candidate is None or candidate.version == primary_version:
+            # Not loaded yet, or the candidate is the model that answered
+            with self._lock:
+                self.skipped += len(matrix)
+            metrics.SHADOW_ROWS.inc(len(matrix), model=self.model_name, outcome='skipped')
+            return
+        started = time.perf_counter()
+        try:
+            scores = np.minimum(100.0, np.maximum(0.0, candidate.predict(matrix)))
+        except Exception as e:
+            print(f"⚠️ Shadow model {self.model_name} failed: {e}")
+            with self._lock:
+                self.failed += len(matrix)
+            metrics.SHADOW_ROWS.inc(len(matrix), model=self.model_name, outcome='failed')
+            return
+        seconds = time.perf_counter() - started
+        deltas = scores - primary_scores
+        abs_deltas = np.abs(deltas)
+        with self._lock:
+            self.scored += len(matrix)
+            self.calls += 1
+            self.seconds += seconds
+            self.delta_sum += float(deltas.sum())
+            self.abs_delta_sum += float(abs_deltas.sum())
+            self.max_abs_delta = max(self.max_abs_delta, float(abs_deltas.max()))
+        metrics.SHADOW_ROWS.inc(len(matrix), model=self.model_name, outcome='scored')
+        metrics.SHADOW_LATENCY.observe(seconds, model=self.model_name)
+        for delta in abs_deltas.tolist():
+            metrics.SHADOW_DELTA.observe(delta, model=self.model_name)
+
+    def stats(self):
+        with self._lock:
+            candidate = self.registry.get(self.model_name)
+            return {
+                'model': self.model_name,
+                'version': candidate.version if candidate is not None else None,
+                'sample_rate': self.sample_rate,
+                'offered': self.offered,
+                'scored': self.scored,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'skipped': self.skipped,
+                'queued': self._queue.qsize(),
+                'mean_delta': round(self.delta_sum / self.scored, 4) if self.scored else None,
+                'mean_abs_delta': round(self.abs_delta_sum / self.scored, 4) if self.scored else None,
+                'max_abs_delta': round(self.max_abs_delta, 4),
+                'mean_call_ms': round(self.seconds / self.calls * 1000, 3) if self.calls else None,
+            }
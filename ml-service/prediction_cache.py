@@ -0,0 +1,105 @@
+# prediction_cache.py - In-process LRU cache for model predictions
+#
+# Keys are feature vectors (the output of calculate_features() without the
+# TrustRating placeholder), values are raw model outputs. Entries expire after
+# a TTL, the least recently used entry is evicted when the cache is full, and
+# everything is dropped when the model file on disk changes.
+import threading
+import time
+from collections import OrderedDict
+
+
+class PredictionCache:
+    """
+    Bounded LRU + TTL cache, safe to share between request threads.
+
+    signature_fn returns something that changes whenever the model changes
+    (e.g. the model file's mtime and size). It is polled at most once every
+    signature_check_interval seconds and the cache is cleared on change.
+    """
+
+    def __init__(self, max_size=10000, ttl_seconds=300.0, signature_fn=None,
+                 signature_check_interval=1.0):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.signature_fn = signature_fn
+        self.signature_check_interval = signature_check_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._signature = signature_fn() if signature_fn else None
+        self._next_signature_check = time.monotonic() + signature_check_interval
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def _check_signature(self, now):
+        """Clear the cache if the model signature changed. Caller holds the lock."""
+        if self.signature_fn is None or now < self._next_signature_check:
+            return
+        self._next_signature_check = now + self.signature_check_interval
+        signature = self.signature_fn()
+        if signature != self._signature:
+            self._signature = signature
+            if self._entries:
+                self._entries.clear()
+                self.invalidations += 1
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self._check_signature(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = (value, now + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry, e.g. after a new model has been loaded"""
+        with self._lock:
+            if self._entries:
+                self._entries.clear()
+                self.invalidations += 1
+            if self.signature_fn is not None:
+                self._signature = self.signature_fn()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
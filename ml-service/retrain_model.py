@@ -1,5 +1,34 @@
 # retrain_model.py
 # Simple model retraining script - no Google Notebook needed!
+#
+#   python retrain_model.py                                  # same model as always
+#   python retrain_model.py --samples 1000000 --rng pcg64    # big, fast run
+#   python retrain_model.py --search                         # pick trees/depth
+#
+# The synthetic data is drawn with whole-array NumPy calls. With the default
+# --rng legacy the draws come from a RandomState in the same order the old
+# per-element loops made them, so the default run reproduces the previous
+# model file exactly. --rng pcg64 uses numpy's default Generator, which is
+# faster but gives different (equally valid) data for a given seed.
+#
+# --search trains every --search-trees x --search-depths combination on a
+# training split and measures each on the held-out rows: R², MAE, predict
+# latency for 1 and 1000 rows, and pickled size. Serving cost grows with
+# trees and depth, so it keeps the Pareto-optimal candidates and saves the
+# fastest one whose R² is within --r2-tolerance of the best.
+#
+# Every run writes a metadata sidecar next to the model (<name>.meta.json).
+# --export-npz also writes the compact artifact (<name>.npz) the service
+# loads with NumPy alone; see model_loader.export_compact_model(). --compact
+# writes a smaller, approximate one instead; see forest_compaction.py.
+
+import argparse
+import hashlib
+import io
+import json
+import statistics
+import sys
+import time
 
 import pandas as pd
 import numpy as np
@@ -7,12 +36,12 @@ from sklearn.ensemble import RandomForestRegressor
 from sklearn.preprocessing import StandardScaler
 from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
+from sklearn.metrics import mean_absolute_error, r2_score
+from sklearn.model_selection import train_test_split
 import joblib
+import sklearn
 import os
 
-print("🚀 Starting Simple Model Retraining\n")
-print(f"📊 Scikit-learn version: {joblib.__version__}")
-
 # Define features (these match your app.py)
 feature_columns = [
     'PortfolioCount', 'AverageRatings', 'TransactionCount',
@@ -23,136 +52,6 @@ feature_columns = [
     'EngagementIndex'
 ]
 
-print(f"✅ Using {len(feature_columns)} features")
-
-# Create synthetic training data
-# This creates realistic data based on the feature relationships
-np.random.seed(42)
-n_samples = 2000
-
-print(f"📊 Generating {n_samples} training samples...")
-
-data = {}
-
-# Generate base features
-data['PortfolioCount'] = np.random.randint(0, 25, n_samples)
-data['AverageRatings'] = np.random.uniform(1.5, 5.0, n_samples)
-data['TransactionCount'] = np.random.randint(1, 150, n_samples)
-data['CompletedTransactions'] = [
-    int(t * np.random.uniform(0.6, 1.0)) 
-    for t in data['TransactionCount']
-]
-data['ReviewCount'] = [
-    int(min(t * np.random.uniform(0.2, 0.8), c)) 
-    for t, c in zip(data['TransactionCount'], data['CompletedTransactions'])
-]
-data['StarCount'] = [
-    int(r * np.random.uniform(3, 5)) 
-    for r in data['ReviewCount']
-]
-
-# Sentiment reviews
-data['PositiveReviews'] = [
-    int(r * np.random.uniform(0.5, 0.9)) 
-    for r in data['ReviewCount']
-]
-data['NeutralReviews'] = [
-    int(r * np.random.uniform(0.0, 0.3)) 
-    for r in data['ReviewCount']
-]
-data['NegativeReviews'] = [
-    max(0, r - p - n) 
-    for r, p, n in zip(data['ReviewCount'], data['PositiveReviews'], data['NeutralReviews'])
-]
-
-# Calculated features
-data['CompletionRate'] = [
-    (c / t * 100) if t > 0 else 0 
-    for c, t in zip(data['CompletedTransactions'], data['TransactionCount'])
-]
-data['CancellationRate'] = [
-    ((t - c) / t * 100) if t > 0 else 0 
-    for c, t in zip(data['CompletedTransactions'], data['TransactionCount'])
-]
-
-data['BioLength'] = np.random.randint(0, 500, n_samples)
-data['BioWordCount'] = [int(bl / np.random.uniform(4, 8)) for bl in data['BioLength']]
-
-data['PositiveReviewRatio'] = [
-    (p / r) if r > 0 else 0.5 
-    for p, r in zip(data['PositiveReviews'], data['ReviewCount'])
-]
-data['ReviewCoverage'] = [
-    (r / t) if t > 0 else 0 
-    for r, t in zip(data['ReviewCount'], data['TransactionCount'])
-]
-
-data['EngagementIndex'] = [
-    tc + rc + pc + bl + bw 
-    for tc, rc, pc, bl, bw in zip(
-        data['TransactionCount'], 
-        data['ReviewCount'], 
-        data['PortfolioCount'],
-        data['BioLength'],
-        data['BioWordCount']
-    )
-]
-
-df = pd.DataFrame(data)
-
-# Create realistic trust scores based on the features
-# This mimics what a real trust score would look like
-trust_scores = (
-    df['AverageRatings'] * 12 +  # 0-60 points
-    df['CompletionRate'] * 0.25 +  # 0-25 points
-    df['PositiveReviewRatio'] * 15 +  # 0-15 points
-    np.clip(df['TransactionCount'] / 10, 0, 10) +  # 0-10 points (capped)
-    np.clip(df['PortfolioCount'], 0, 5) +  # 0-5 points (capped)
-    np.random.normal(0, 3, n_samples)  # Some noise
-)
-
-# Clamp to 0-100 range
-df['TrustRating'] = np.clip(trust_scores, 0, 100)
-
-print(f"✅ Data generated")
-print(f"   Trust Score range: {df['TrustRating'].min():.1f} - {df['TrustRating'].max():.1f}")
-print(f"   Trust Score mean: {df['TrustRating'].mean():.1f}")
-
-# Prepare features and target
-X = df[feature_columns]
-y = df['TrustRating']
-
-print(f"\n🔧 Building pipeline...")
-
-# Create preprocessing pipeline
-preprocessor = ColumnTransformer(
-    transformers=[
-        ('scaler', StandardScaler(), feature_columns)
-    ],
-    remainder='drop'
-)
-
-# Create full pipeline
-pipeline = Pipeline([
-    ('preprocessor', preprocessor),
-    ('regressor', RandomForestRegressor(
-        n_estimators=100,
-        max_depth=15,
-        min_samples_split=5,
-        min_samples_leaf=2,
-        random_state=42,
-        n_jobs=-1
-    ))
-])
-
-print(f"🎯 Training model...")
-pipeline.fit(X, y)
-
-# Evaluate on training data
-train_score = pipeline.score(X, y)
-print(f"✅ Training R² score: {train_score:.4f}")
-
-# Test prediction
 test_sample = pd.DataFrame([{
     'PortfolioCount': 5,
     'AverageRatings': 4.0,
@@ -172,33 +71,468 @@ test_sample = pd.DataFrame([{
     'EngagementIndex': 150
 }])
 
-prediction = pipeline.predict(test_sample)[0]
-print(f"🧪 Test prediction: {prediction:.2f}")
-
-# Save the model
-model_dir = 'models'
-os.makedirs(model_dir, exist_ok=True)
-model_path = os.path.join(model_dir, 'trust_pipeline_best.joblib')
-
-print(f"\n💾 Saving model to {model_path}...")
-joblib.dump(pipeline, model_path)
-
-file_size = os.path.getsize(model_path) / 1024
-print(f"✅ Model saved! Size: {file_size:.2f} KB")
-
-# Test loading the model
-print(f"\n🧪 Testing model loading...")
-loaded_model = joblib.load(model_path)
-test_pred = loaded_model.predict(test_sample)[0]
-print(f"✅ Model loads correctly! Test prediction: {test_pred:.2f}")
-
-print("\n" + "="*60)
-print("✅ SUCCESS! Model retrained and saved.")
-print("="*60)
-print("📦 Next steps:")
-print("   1. The new model is at: ./models/trust_pipeline_best.joblib")
-print("   2. Run: git add models/trust_pipeline_best.joblib")
-print("   3. Run: git commit -m 'Update ML model for compatibility'")
-print("   4. Run: git push origin main")
-print("   5. Redeploy on Render.com")
-print("="*60)
\ No newline at end of file
+
+def make_rng(seed, kind='legacy'):
+    """
+    Random source for generate_training_data(). 'legacy' is the Mersenne
+    Twister stream np.random.seed() used to drive; 'pcg64' is the modern
+    default Generator.
+    """
+    if kind == 'legacy':
+        return np.random.RandomState(seed)
+    if kind == 'pcg64':
+        return np.random.default_rng(seed)
+    raise ValueError(f"Unknown rng {kind!r} (expected 'legacy' or 'pcg64')")
+
+
+def _randint(rng, low, high, size):
+    # RandomState.randint and Generator.integers both exclude high
+    if isinstance(rng, np.random.RandomState):
+        return rng.randint(low, high, size)
+    return rng.integers(low, high, size)
+
+
+def generate_training_data(n_samples, rng):
+    """
+    Synthetic users with realistic relationships between their stats, plus
+    a TrustRating target. Every column is drawn or derived with one array
+    operation; draws happen in the order the original loops made them.
+    """
+    data = {}
+
+    # Generate base features
+    data['PortfolioCount'] = _randint(rng, 0, 25, n_samples)
+    data['AverageRatings'] = rng.uniform(1.5, 5.0, n_samples)
+    data['TransactionCount'] = _randint(rng, 1, 150, n_samples)
+    # int() truncation; every product here is non-negative
+    data['CompletedTransactions'] = (
+        data['TransactionCount'] * rng.uniform(0.6, 1.0, n_samples)
+    ).astype(np.int64)
+    data['ReviewCount'] = np.minimum(
+        data['TransactionCount'] * rng.uniform(0.2, 0.8, n_samples),
+        data['CompletedTransactions']
+    ).astype(np.int64)
+    data['StarCount'] = (data['ReviewCount'] * rng.uniform(3, 5, n_samples)).astype(np.int64)
+
+    # Sentiment reviews
+    data['PositiveReviews'] = (data['ReviewCount'] * rng.uniform(0.5, 0.9, n_samples)).astype(np.int64)
+    data['NeutralReviews'] = (data['ReviewCount'] * rng.uniform(0.0, 0.3, n_samples)).astype(np.int64)
+    data['NegativeReviews'] = np.maximum(
+        0, data['ReviewCount'] - data['PositiveReviews'] - data['NeutralReviews']
+    )
+
+    # Calculated features (TransactionCount is at least 1)
+    transactions = data['TransactionCount']
+    data['CompletionRate'] = data['CompletedTransactions'] / transactions * 100
+    data['CancellationRate'] = (transactions - data['CompletedTransactions']) / transactions * 100
+
+    data['BioLength'] = _randint(rng, 0, 500, n_samples)
+    data['BioWordCount'] = (data['BioLength'] / rng.uniform(4, 8, n_samples)).astype(np.int64)
+
+    reviews = data['ReviewCount']
+    data['PositiveReviewRatio'] = np.divide(
+        data['PositiveReviews'], reviews,
+        out=np.full(n_samples, 0.5), where=reviews > 0
+    )
+    data['ReviewCoverage'] = reviews / transactions
+
+    data['EngagementIndex'] = (
+        data['TransactionCount'] +
+        data['ReviewCount'] +
+        data['PortfolioCount'] +
+        data['BioLength'] +
+        data['BioWordCount']
+    )
+
+    df = pd.DataFrame(data)
+
+    # Create realistic trust scores based on the features
+    # This mimics what a real trust score would look like
+    trust_scores = (
+        df['AverageRatings'] * 12 +  # 0-60 points
+        df['CompletionRate'] * 0.25 +  # 0-25 points
+        df['PositiveReviewRatio'] * 15 +  # 0-15 points
+        np.clip(df['TransactionCount'] / 10, 0, 10) +  # 0-10 points (capped)
+        np.clip(df['PortfolioCount'], 0, 5) +  # 0-5 points (capped)
+        rng.normal(0, 3, n_samples)  # Some noise
+    )
+
+    # Clamp to 0-100 range
+    df['TrustRating'] = np.clip(trust_scores, 0, 100)
+    return df
+
+
+def build_pipeline(n_estimators=100, max_depth=15, n_jobs=-1, random_state=42, max_samples=None):
+    """Scaler + RandomForest pipeline the service expects"""
+    # Create preprocessing pipeline
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ('scaler', StandardScaler(), feature_columns)
+        ],
+        remainder='drop'
+    )
+
+    # Create full pipeline
+    return Pipeline([
+        ('preprocessor', preprocessor),
+        ('regressor', RandomForestRegressor(
+            n_estimators=n_estimators,
+            max_depth=max_depth,
+            min_samples_split=5,
+            min_samples_leaf=2,
+            max_samples=max_samples,
+            random_state=random_state,
+            n_jobs=n_jobs
+        ))
+    ])
+
+
+def parse_grid(text, allow_none=False):
+    """'50,100,None' -> [50, 100, None]"""
+    values = []
+    for item in text.split(','):
+        item = item.strip()
+        if allow_none and item.lower() == 'none':
+            values.append(None)
+        else:
+            values.append(int(item))
+    return values
+
+
+def median_ms(fn, repeats):
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000.0)
+    return statistics.median(samples)
+
+
+def serialized_size_kb(pipeline):
+    buffer = io.BytesIO()
+    joblib.dump(pipeline, buffer)
+    return buffer.tell() / 1024.0
+
+
+def evaluate_candidate(pipeline, X_test, y_test, latency_repeats):
+    """Held-out accuracy plus the serving costs of a fitted pipeline"""
+    predictions = pipeline.predict(X_test)
+    one_row = X_test.iloc[:1]
+    many_rows = X_test.iloc[:1000]
+    for _ in range(5):
+        pipeline.predict(one_row)  # warm-up
+    return {
+        'r2': round(float(r2_score(y_test, predictions)), 5),
+        'mae': round(float(mean_absolute_error(y_test, predictions)), 4),
+        'latency_1_ms': round(median_ms(lambda: pipeline.predict(one_row), latency_repeats), 3),
+        'latency_1000_ms': round(median_ms(lambda: pipeline.predict(many_rows), max(3, latency_repeats // 10)), 3),
+        'size_kb': round(serialized_size_kb(pipeline), 1),
+    }
+
+
+def _dominates(a, b):
+    """a is at least as good as b everywhere and strictly better somewhere"""
+    no_worse = (
+        a['r2'] >= b['r2'] and a['latency_1_ms'] <= b['latency_1_ms'] and
+        a['latency_1000_ms'] <= b['latency_1000_ms'] and a['size_kb'] <= b['size_kb']
+    )
+    better = (
+        a['r2'] > b['r2'] or a['latency_1_ms'] < b['latency_1_ms'] or
+        a['latency_1000_ms'] < b['latency_1000_ms'] or a['size_kb'] < b['size_kb']
+    )
+    return no_worse and better
+
+
+def pareto_front(results):
+    """Candidates no other candidate beats on R², both latencies and size at once"""
+    return [r for r in results if not any(_dominates(other, r) for other in results if other is not r)]
+
+
+# Single-row latencies this close to the fastest count as a tie (timer noise)
+LATENCY_TIE = 0.10
+
+
+def choose_candidate(front, min_r2, max_latency_ms=None):
+    """
+    The fastest single-row candidate on the front that is accurate enough;
+    among candidates within LATENCY_TIE of the fastest, the most accurate.
+    None if no candidate qualifies.
+    """
+    eligible = [
+        r for r in front
+        if r['r2'] >= min_r2 and (max_latency_ms is None or r['latency_1_ms'] <= max_latency_ms)
+    ]
+    if not eligible:
+        return None
+    fastest = min(r['latency_1_ms'] for r in eligible)
+    near = [r for r in eligible if r['latency_1_ms'] <= fastest * (1 + LATENCY_TIE)]
+    return max(near, key=lambda r: (r['r2'], -r['latency_1_ms']))
+
+
+def print_report(results, front, chosen):
+    print(f"\n{'trees':>5} {'depth':>5} {'R²':>8} {'MAE':>7} {'1 row ms':>9} {'1000 rows ms':>13} {'size KB':>9}")
+    for r in sorted(results, key=lambda r: (r['n_estimators'], r['max_depth'] or 10 ** 6)):
+        mark = '⭐' if r is chosen else ('◆' if r in front else '')
+        print(f"{r['n_estimators']:>5} {str(r['max_depth']):>5} {r['r2']:>8.4f} {r['mae']:>7.3f} "
+              f"{r['latency_1_ms']:>9.2f} {r['latency_1000_ms']:>13.2f} {r['size_kb']:>9.0f} {mark}")
+    print("◆ Pareto-optimal   ⭐ chosen")
+
+
+def run_search(args, X, y):
+    """
+    Fit every candidate on a training split and evaluate it on the rest.
+    Returns (chosen pipeline or None, search metadata).
+    """
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=args.test_size, random_state=args.seed
+    )
+    grid = [
+        (trees, depth)
+        for trees in parse_grid(args.search_trees)
+        for depth in parse_grid(args.search_depths, allow_none=True)
+    ]
+    print(f"🔎 Searching {len(grid)} candidates on {len(X_train)} training / {len(X_test)} held-out rows")
+
+    results = []
+    for trees, depth in grid:
+        pipeline = build_pipeline(
+            n_estimators=trees, max_depth=depth, n_jobs=args.n_jobs,
+            random_state=args.seed, max_samples=args.max_samples
+        )
+        started = time.perf_counter()
+        pipeline.fit(X_train, y_train)
+        result = {'n_estimators': trees, 'max_depth': depth,
+                  'fit_seconds': round(time.perf_counter() - started, 2)}
+        result.update(evaluate_candidate(pipeline, X_test, y_test, args.latency_repeats))
+        results.append(result)
+        print(f"   {trees:>4} trees, depth {str(depth):>4}: R² {result['r2']:.4f}, "
+              f"1 row {result['latency_1_ms']:.2f} ms, {result['size_kb']:.0f} KB")
+
+    front = pareto_front(results)
+    best_r2 = max(r['r2'] for r in results)
+    min_r2 = args.min_r2 if args.min_r2 is not None else best_r2 - args.r2_tolerance
+    chosen = choose_candidate(front, min_r2, args.max_latency_ms)
+    print_report(results, front, chosen)
+
+    metadata = {
+        'candidates': results,
+        'pareto_front': [results.index(r) for r in front],
+        'chosen': results.index(chosen) if chosen is not None else None,
+        'criteria': {'min_r2': round(min_r2, 5), 'max_latency_ms': args.max_latency_ms,
+                     'test_size': args.test_size},
+    }
+    if chosen is None:
+        return None, metadata
+
+    # Fitting is deterministic for a fixed random_state, so refitting the
+    # winner gives the model that was measured without keeping every
+    # candidate in memory
+    print(f"\n🏆 Chose {chosen['n_estimators']} trees, depth {chosen['max_depth']}")
+    pipeline = build_pipeline(
+        n_estimators=chosen['n_estimators'], max_depth=chosen['max_depth'], n_jobs=args.n_jobs,
+        random_state=args.seed, max_samples=args.max_samples
+    )
+    pipeline.fit(X_train, y_train)
+    return pipeline, metadata
+
+
+def write_metadata(model_path, metadata):
+    """Write <model>.meta.json; version matches the service's model_version"""
+    digest = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    metadata = dict(metadata, model_file=os.path.basename(model_path), version=digest.hexdigest()[:12])
+    sidecar = os.path.splitext(model_path)[0] + '.meta.json'
+    with open(sidecar, 'w') as f:
+        json.dump(metadata, f, indent=2)
+    return sidecar
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Train the trust rating model on synthetic data.')
+    parser.add_argument('--samples', type=int, default=2000, help='Training rows (default: 2000)')
+    parser.add_argument('--trees', type=int, default=100, help='Number of trees (default: 100)')
+    parser.add_argument('--max-depth', type=int, default=15, help='Maximum tree depth (default: 15)')
+    parser.add_argument('--max-samples', type=float, default=None,
+                        help='Fraction of rows bootstrapped per tree, e.g. 0.2 for big runs (default: all)')
+    parser.add_argument('--seed', type=int, default=42, help='Data and forest seed (default: 42)')
+    parser.add_argument('--rng', choices=['legacy', 'pcg64'], default='legacy',
+                        help='Random source for the data (default: legacy, reproduces earlier models)')
+    parser.add_argument('--n-jobs', type=int, default=-1, help='Training processes (default: all cores)')
+    parser.add_argument('--output', default=os.path.join('models', 'trust_pipeline_best.joblib'),
+                        help='Model file (default: models/trust_pipeline_best.joblib)')
+    parser.add_argument('--export-npz', action='store_true',
+                        help='Also write the compact .npz artifact next to the model')
+    parser.add_argument('--compact', action='store_true',
+                        help='Write a compacted .npz artifact instead (fewer trees and nodes, smaller dtypes)')
+    parser.add_argument('--compact-max-error', type=float, default=0.5,
+                        help='Score points the compacted forest may deviate on calibration rows (default: 0.5)')
+    search = parser.add_argument_group('search')
+    search.add_argument('--search', action='store_true',
+                        help='Choose trees and depth by held-out accuracy and predict latency')
+    search.add_argument('--search-trees', default='25,50,100,200', help='Tree counts to try')
+    search.add_argument('--search-depths', default='6,8,10,12,15,None', help='Depths to try (None = unlimited)')
+    search.add_argument('--test-size', type=float, default=0.2, help='Held-out fraction (default: 0.2)')
+    search.add_argument('--r2-tolerance', type=float, default=0.005,
+                        help='Accept candidates this far below the best R² (default: 0.005)')
+    search.add_argument('--min-r2', type=float, default=None, help='Absolute R² floor instead of --r2-tolerance')
+    search.add_argument('--max-latency-ms', type=float, default=None, help='Single-row predict budget')
+    search.add_argument('--latency-repeats', type=int, default=50, help='Timed single-row predicts per candidate')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    print("🚀 Starting Simple Model Retraining\n")
+    print(f"📊 Scikit-learn version: {sklearn.__version__}")
+    print(f"✅ Using {len(feature_columns)} features")
+
+    # Create synthetic training data
+    # This creates realistic data based on the feature relationships
+    n_samples = args.samples
+    print(f"📊 Generating {n_samples} training samples...")
+
+    started = time.perf_counter()
+    df = generate_training_data(n_samples, make_rng(args.seed, args.rng))
+    generate_seconds = time.perf_counter() - started
+
+    print(f"✅ Data generated in {generate_seconds:.2f}s")
+    print(f"   Trust Score range: {df['TrustRating'].min():.1f} - {df['TrustRating'].max():.1f}")
+    print(f"   Trust Score mean: {df['TrustRating'].mean():.1f}")
+
+    # Prepare features and target
+    X = df[feature_columns]
+    y = df['TrustRating']
+
+    metadata = {
+        'trained_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'sklearn_version': sklearn.__version__,
+        'data': {'samples': n_samples, 'seed': args.seed, 'rng': args.rng},
+    }
+
+    if args.search:
+        started = time.perf_counter()
+        pipeline, metadata['search'] = run_search(args, X, y)
+        fit_seconds = time.perf_counter() - started
+        if pipeline is None:
+            print("❌ No candidate meets the R²/latency criteria; nothing saved")
+            return 1
+        chosen = metadata['search']['candidates'][metadata['search']['chosen']]
+        metadata['metrics'] = {k: chosen[k] for k in ('r2', 'mae', 'latency_1_ms', 'latency_1000_ms')}
+    else:
+        print(f"\n🔧 Building pipeline...")
+        pipeline = build_pipeline(
+            n_estimators=args.trees,
+            max_depth=args.max_depth,
+            n_jobs=args.n_jobs,
+            random_state=args.seed,
+            max_samples=args.max_samples
+        )
+
+        print(f"🎯 Training model ({args.trees} trees, max depth {args.max_depth})...")
+        started = time.perf_counter()
+        pipeline.fit(X, y)
+        fit_seconds = time.perf_counter() - started
+        print(f"✅ Trained in {fit_seconds:.2f}s")
+
+        # Evaluate on training data
+        train_score = pipeline.score(X, y)
+        print(f"✅ Training R² score: {train_score:.4f}")
+        metadata['metrics'] = {'train_r2': round(float(train_score), 5)}
+
+    regressor = pipeline.named_steps['regressor']
+    metadata['params'] = {
+        'n_estimators': regressor.n_estimators,
+        'max_depth': regressor.max_depth,
+        'min_samples_split': regressor.min_samples_split,
+        'min_samples_leaf': regressor.min_samples_leaf,
+        'max_samples': regressor.max_samples,
+        'random_state': regressor.random_state,
+    }
+
+    # Test prediction
+    prediction = pipeline.predict(test_sample)[0]
+    print(f"🧪 Test prediction: {prediction:.2f}")
+
+    # Save the model
+    model_path = args.output
+    os.makedirs(os.path.dirname(model_path) or '.', exist_ok=True)
+
+    print(f"\n💾 Saving model to {model_path}...")
+    started = time.perf_counter()
+    joblib.dump(pipeline, model_path)
+    save_seconds = time.perf_counter() - started
+
+    file_size = os.path.getsize(model_path) / 1024
+    print(f"✅ Model saved in {save_seconds:.2f}s! Size: {file_size:.2f} KB")
+
+    # Test loading the model
+    print(f"\n🧪 Testing model loading...")
+    loaded_model = joblib.load(model_path)
+    test_pred = loaded_model.predict(test_sample)[0]
+    print(f"✅ Model loads correctly! Test prediction: {test_pred:.2f}")
+
+    print(f"\n⏱️ Timing: generate {generate_seconds:.2f}s, fit {fit_seconds:.2f}s, save {save_seconds:.2f}s")
+    metadata['timings'] = {
+        'generate_seconds': round(generate_seconds, 3),
+        'fit_seconds': round(fit_seconds, 3),
+        'save_seconds': round(save_seconds, 3),
+    }
+
+    from model_loader import compact_path, export_compact_model, file_version
+    artifact = compact_path(model_path)
+    if args.compact:
+        from forest_compaction import compact_model, print_report
+
+        print(f"\n🗜️ Compacting the forest into {artifact}...")
+        started = time.perf_counter()
+        try:
+            report = compact_model(pipeline, artifact, file_version(model_path),
+                                   max_error=args.compact_max_error)
+        except ValueError as e:
+            print(f"❌ Could not compact the model: {e}")
+            return 1
+        print_report(report)
+        metadata['timings']['compact_seconds'] = round(time.perf_counter() - started, 3)
+        metadata['compact_model'] = {
+            'file': os.path.basename(artifact),
+            'size_kb': report['artifact_kb'][1],
+            'nodes': report['nodes'][1],
+            'compaction': report,
+        }
+    elif args.export_npz:
+        print(f"\n📦 Exporting compact model to {artifact}...")
+        started = time.perf_counter()
+        try:
+            engine = export_compact_model(pipeline, artifact, file_version(model_path))
+        except ValueError as e:
+            print(f"❌ Could not export compact model: {e}")
+            return 1
+        metadata['timings']['export_seconds'] = round(time.perf_counter() - started, 3)
+        metadata['compact_model'] = {
+            'file': os.path.basename(artifact),
+            'size_kb': round(os.path.getsize(artifact) / 1024, 1),
+            'nodes': engine.n_nodes,
+        }
+        print(f"✅ Compact model saved! Size: {os.path.getsize(artifact) / 1024:.2f} KB")
+    elif os.path.exists(artifact):
+        print(f"⚠️ {artifact} is from an older model and will be ignored; "
+              f"rerun with --export-npz to replace it")
+    print(f"📝 Metadata written to {write_metadata(model_path, metadata)}")
+
+    print("\n" + "="*60)
+    print("✅ SUCCESS! Model retrained and saved.")
+    print("="*60)
+    print("📦 Next steps:")
+    print(f"   1. The new model is at: {model_path}")
+    print(f"   2. Run: git add {model_path}" + (f" {artifact}" if args.export_npz or args.compact else ''))
+    print("   3. Run: git commit -m 'Update ML model for compatibility'")
+    print("   4. Run: git push origin main")
+    print("   5. Redeploy on Render.com")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+# schema.py - Validation and coercion of /predict and /batch-predict payloads
+#
+# calculate_features() reads the raw stats with user_data.get() and no type
+# checks, so a "5" or a null used to blow up inside the model call and send
+# the row down the fallback path. The payload schema is compiled once into a
+# coercer per field; validate_batch() turns a list of payloads into typed
+# float64 columns (ready for calculate_features_columns()) in one pass per
+# field and reports every row it rejects by index. validate_columns() does the
+# same for the columns of a file read by batch_score.py.
+#
+# Rules, per RAW_FIELD_DEFAULTS field:
+#   missing or null      -> the field's default
+#   int or float         -> as is
+#   numeric string       -> parsed ("5", "4.5", "1e3"; JSON number syntax)
+#   anything else        -> the row is rejected (bools, lists, objects, text)
+# Values must be finite and within MAX_VECTOR_VALUE. Other keys (userId, ...)
+# are not checked.
+import re
+
+import numpy as np
+
+from features import MAX_VECTOR_VALUE, RAW_FIELD_DEFAULTS
+
+# A JSON number, optionally surrounded by whitespace
+_NUMBER_TEXT = re.compile(r'\s*-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?\s*')
+
+# Types whose lists NumPy converts straight to float64
+_NUMBER_TYPES = frozenset((int, float))
+
+
+def _describe(value):
+    text = repr(value)
+    return f"{type(value).__name__} {text if len(text) <= 40 else text[:37] + '...'}"
+
+
+def _compile_field(field, default):
+    """
+    The coercer for one field: value -> float, raising ValueError with a
+    message naming the field. Only used for values off the fast path.
+    """
+    def coerce(value):
+        value_type = type(value)
+        if value is None:
+            return float(default)
+        if value_type is str:
+            if not _NUMBER_TEXT.fullmatch(value):
+                raise ValueError(f"{field} must be a number, got {_describe(value)}")
+            number = float(value)
+        elif value_type in _NUMBER_TYPES:
+            try:
+                number = float(value)
+            except OverflowError:
+                number = float('inf')
+        else:
+            # bool is an int subclass, but true/false are not stats
+            raise ValueError(f"{field} must be a number, got {_describe(value)}")
+        if not abs(number) < MAX_VECTOR_VALUE:
+            raise ValueError(f"{field} must be a finite number within ±{MAX_VECTOR_VALUE:.0e}, got {_describe(value)}")
+        return number
+    return coerce
+
+
+class PayloadSchema:
+    """
+    The compiled /predict payload schema: one coercer per field.
+
+    validate(user_data) coerces one payload; validate_batch(users) a whole
+    list. Both produce exactly the floats calculate_features() would have
+    used for payloads that were already plain numbers.
+    """
+
+    __slots__ = ('fields', '_coercers')
+
+    def __init__(self, fields=RAW_FIELD_DEFAULTS):
+        self.fields = dict(fields)
+        self._coercers = tuple(
+            (field, default, _compile_field(field, default)) for field, default in self.fields.items()
+        )
+
+    def validate(self, user_data):
+        """
+        One payload as {field: float} with defaults filled in, or raise
+        ValueError listing every invalid field.
+        """
+        if not isinstance(user_data, dict):
+            raise ValueError(f"expected a JSON object, got {_describe(user_data)}")
+        values = {}
+        errors = []
+        for field, default, coerce in self._coercers:
+            value = user_data.get(field)
+            if type(value) in _NUMBER_TYPES and -MAX_VECTOR_VALUE < value < MAX_VECTOR_VALUE:
+                values[field] = float(value)
+                continue
+            try:
+                values[field] = coerce(value)
+            except ValueError as e:
+                errors.append(str(e))
+        if errors:
+            raise ValueError('; '.join(errors))
+        return values
+
+    def validate_batch(self, users):
+        """
+        Coerce a list of payloads into columns. Returns (raw, errors): raw
+        maps every field to a float64 array with one entry per user (rejected
+        rows hold defaults) and errors maps the index of every rejected row
+        to its message.
+        """
+        is_dict = [isinstance(user_data, dict) for user_data in users]
+        problems = {}
+        if not all(is_dict):
+            for i in np.flatnonzero(~np.array(is_dict, dtype=bool)).tolist():
+                problems[i] = [f"expected a JSON object, got {_describe(users[i])}"]
+            users = [user_data if ok else {} for user_data, ok in zip(users, is_dict)]
+
+        raw = {}
+        for field, default, coerce in self._coercers:
+            values = [user_data.get(field) for user_data in users]
+            raw[field] = self._coerce_column(default, coerce, values, problems)
+
+        errors = {i: '; '.join(messages) for i, messages in sorted(problems.items())}
+        return raw, errors
+
+    def validate_columns(self, columns, rows):
+        """
+        validate_batch() for payloads already split into columns (a file
+        read by batch_score.py): columns maps fields to lists of rows values,
+        with None for a missing value; a field not in columns takes its
+        default. Returns (raw, errors) as validate_batch() does.
+        """
+        problems = {}
+        raw = {}
+        for field, default, coerce in self._coercers:
+            if field in columns:
+                raw[field] = self._coerce_column(default, coerce, columns[field], problems)
+            else:
+                raw[field] = np.full(rows, default, dtype=np.float64)
+
+        errors = {i: '; '.join(messages) for i, messages in sorted(problems.items())}
+        return raw, errors
+
+    @staticmethod
+    def _coerce_column(default, coerce, values, problems):
+        """
+        One field's values as a float64 array; rows coerce rejects hold
+        default and get their message appended to problems[index]
+        """
+        originals = values
+        if _NUMBER_TYPES.issuperset(map(type, values)):
+            fast = np.ones(len(values), dtype=bool)
+        else:
+            fast = np.array([type(value) in _NUMBER_TYPES for value in values], dtype=bool)
+            values = [value if ok else 0.0 for value, ok in zip(values, fast)]
+        try:
+            column = np.array(values, dtype=np.float64)
+            fast &= np.abs(column) < MAX_VECTOR_VALUE  # also rejects NaN
+        except OverflowError:
+            # An int beyond float64: every value of this column takes the coercer
+            column = np.zeros(len(values), dtype=np.float64)
+            fast[:] = False
+        for i in np.flatnonzero(~fast).tolist():
+            try:
+                column[i] = coerce(originals[i])
+            except ValueError as e:
+                problems.setdefault(i, []).append(str(e))
+                column[i] = default
+        return column
+
+
+# The schema of /predict, /batch-predict and /batch-predict/stream payloads
+USER_SCHEMA = PayloadSchema()
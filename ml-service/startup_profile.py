@@ -0,0 +1,109 @@
+# startup_profile.py - Where the service's startup seconds go
+#
+# Imports app.py in a fresh interpreter under `python -X importtime`, waits
+# for the model to be in service and reports how long the import took, when
+# the model was ready, and the import time of every top-level package:
+#
+#   python startup_profile.py
+#   MODEL_LOAD_MODE=background MODEL_FORMAT=npz python startup_profile.py --top 10
+#
+# MODEL_PATH, MODEL_FORMAT, MODEL_LOAD_MODE and INFERENCE_ENGINE are passed
+# through from the environment, so profiles of different startup modes can
+# be compared side by side.
+import argparse
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Imports app.py, then waits (at most 120 s) for a background load to finish
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter() - started
+while app.model is None and app.last_reload['status'] == 'loading' and time.perf_counter() - started < 120:
+    time.sleep(0.005)
+active = app.model
+print(json.dumps({
+    'import_seconds': imported,
+    'ready_seconds': time.perf_counter() - started if active is not None else None,
+    'load_seconds': active.load_seconds if active is not None else None,
+    'model_format': active.format if active is not None else None,
+    'inference_engine': active.engine if active is not None else None,
+    'loaded': sorted(m for m in ('pandas', 'sklearn', 'joblib', 'scipy') if m in sys.modules),
+}))
+"""
+
+
+def parse_importtime(stderr):
+    """
+    Sum the self time of every module in -X importtime output by its
+    top-level package. Self times don't overlap, so the totals add up to
+    the interpreter's whole import time. Returns {package: seconds}.
+    """
+    totals = defaultdict(float)
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # the column header
+        package = fields[2].strip().split('.')[0]
+        totals[package] += int(fields[0]) / 1e6
+    return dict(totals)
+
+
+def profile_startup():
+    """Run the probe once. Returns (probe result, {package: seconds})"""
+    env = dict(os.environ, MODEL_WATCH_INTERVAL='0')
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE], cwd=SERVICE_DIR, env=env,
+        capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise SystemExit(f"❌ Importing app.py failed:\n{completed.stderr[-2000:]}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    return result, parse_importtime(completed.stderr)
+
+
+def print_profile(result, packages, top):
+    mode = os.getenv('MODEL_LOAD_MODE', 'sync')
+    print(f"🚀 MODEL_LOAD_MODE={mode}  MODEL_FORMAT={os.getenv('MODEL_FORMAT', 'auto')}")
+    print(f"   import app:      {result['import_seconds']:.3f}s")
+    if result['ready_seconds'] is None:
+        print("   model ready:     never (serving the fallback formula)")
+    else:
+        print(f"   model ready:     {result['ready_seconds']:.3f}s "
+              f"({result['model_format']}, {result['inference_engine']}, load {result['load_seconds']:.3f}s)")
+    print(f"   heavy modules:   {', '.join(result['loaded']) or 'none'}")
+
+    total = sum(packages.values())
+    print(f"\n{'package':<24} {'seconds':>8} {'share':>7}")
+    for name, seconds in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        print(f"{name:<24} {seconds:>8.3f} {seconds / total:>7.1%}")
+    print(f"{'all imports':<24} {total:>8.3f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Profile the import and model load of app.py.')
+    parser.add_argument('--top', type=int, default=15, help='Packages to list (default: 15)')
+    parser.add_argument('--json', action='store_true', help='Print the profile as JSON')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result, packages = profile_startup()
+    if args.json:
+        print(json.dumps(dict(result, packages=packages), indent=2))
+    else:
+        print_profile(result, packages, args.top)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+# test_features.py - The column versions of the feature code and the fallback
+# formula must match the per-row ones on every payload the schema accepts
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from features import (
+    RAW_FIELD_DEFAULTS, calculate_fallback_trust_score,
+    calculate_fallback_trust_score_columns, calculate_features,
+    calculate_features_columns
+)
+from model_loader import FEATURE_COLUMNS
+from schema import USER_SCHEMA
+
+# Values the schema must either coerce to what the per-row code sees or
+# reject: zeros, negatives, the MAX_VECTOR_VALUE boundary, ints beyond
+# float64, NaN, inf, strings, None, bools and lists
+SPECIAL_VALUES = [0, 0.0, -1, -7.5, 1, 0.5, 2 ** 49, -(2 ** 49), 2 ** 50, 10 ** 400, 1e300,
+                  float('nan'), float('inf'), '5', None, True, [1]]
+
+
+def random_users(n_users, seed):
+    """
+    Payloads mixing realistic stats with edge cases: missing fields,
+    SPECIAL_VALUES, fractional values, inconsistent totals and the odd
+    payload that is not a dict at all.
+    """
+    rng = np.random.default_rng(seed)
+    users = []
+    for _ in range(n_users):
+        user_data = {}
+        for field in RAW_FIELD_DEFAULTS:
+            kind = rng.random()
+            if kind < 0.1:
+                continue  # missing: default
+            if kind < 0.12:
+                user_data[field] = SPECIAL_VALUES[rng.integers(len(SPECIAL_VALUES))]
+            elif field == 'averageRatings':
+                user_data[field] = float(rng.uniform(-1, 7))
+            elif kind < 0.3:
+                user_data[field] = float(rng.uniform(-50, 500))
+            else:
+                user_data[field] = int(rng.integers(0, 200))
+        users.append(user_data if rng.random() > 0.001 else [user_data])
+    return users
+
+
+def same_bits(want, got):
+    # The scalar versions return ints 0 and 100 when clamping
+    return np.float64(want).tobytes() == np.float64(got).tobytes()
+
+
+def assert_columns_match_rows(users):
+    """
+    validate_batch() columns through the column functions give, bit for
+    bit, what the per-row functions give on validate() of each payload,
+    and both reject the same payloads.
+    """
+    raw, errors = USER_SCHEMA.validate_batch(users)
+    scores = calculate_fallback_trust_score_columns(raw)
+    matrix = calculate_features_columns(raw)
+    for i, user_data in enumerate(users):
+        try:
+            stats = USER_SCHEMA.validate(user_data)
+        except ValueError as e:
+            assert errors.get(i) == str(e), f"row {i} {user_data!r}"
+            continue
+        assert i not in errors, f"row {i} {user_data!r}: {errors[i]}"
+        # The scalar formula prints a warning for anything it cannot score
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = calculate_fallback_trust_score(stats)
+        assert same_bits(expected, scores[i]), f"fallback, row {i} {user_data!r}"
+        features = calculate_features(stats)
+        expected_row = [features[c] for c in FEATURE_COLUMNS]
+        mismatched = [c for c, want, got in zip(FEATURE_COLUMNS, expected_row, matrix[i].tolist())
+                      if not same_bits(want, got)]
+        assert not mismatched, f"features {mismatched}, row {i} {user_data!r}"
+
+
+def test_columns_match_rows_on_random_users():
+    assert_columns_match_rows(random_users(20000, seed=0))
+
+
+@pytest.mark.parametrize('value', SPECIAL_VALUES, ids=repr)
+@pytest.mark.parametrize('field', list(RAW_FIELD_DEFAULTS))
+def test_columns_match_rows_on_special_values(field, value):
+    assert_columns_match_rows([{field: value}, {field: value, 'reviewCount': 10, 'negativeReviews': 3}])
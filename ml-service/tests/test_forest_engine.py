@@ -0,0 +1,103 @@
+# test_forest_engine.py - The compiled forest must predict exactly what the
+# sklearn pipeline does, survive a .npz round trip unchanged, and stay within
+# the error compaction promises
+import numpy as np
+import pandas as pd
+import pytest
+
+from forest_compaction import compact_forest, prune_subtrees, sample_features
+from forest_engine import CompiledForest, probe_matrix
+from model_loader import FEATURE_COLUMNS
+from retrain_model import build_pipeline
+
+
+@pytest.fixture(scope='module')
+def pipeline():
+    X, y = sample_features(3000, seed=0)
+    # n_jobs=1 sums the trees in estimator order, as the engine does
+    fitted = build_pipeline(n_estimators=12, max_depth=10, n_jobs=1, random_state=0)
+    fitted.fit(pd.DataFrame(X, columns=FEATURE_COLUMNS), y)
+    return fitted
+
+
+@pytest.fixture(scope='module')
+def engine(pipeline):
+    return CompiledForest.from_pipeline(pipeline, FEATURE_COLUMNS)
+
+
+def random_rows(n_rows, seed):
+    """Realistic users plus uniform noise over (and beyond) the features' ranges"""
+    X, _ = sample_features(n_rows, seed)
+    rng = np.random.default_rng(seed)
+    noise = rng.uniform(-10, 1.5, size=X.shape) * (np.abs(X).max(axis=0) + 1)
+    return np.vstack([X, noise, np.zeros((1, X.shape[1]))])
+
+
+def boundary_rows(engine):
+    """Rows on folded thresholds, one float64 step either side, and NaNs where supported"""
+    X = np.vstack([probe_matrix(engine, seed=2), probe_matrix(engine, seed=3)])
+    below = probe_matrix(engine, seed=4)
+    X = np.vstack([X, np.nextafter(below, -np.inf)])
+    if engine.allow_missing:
+        with_missing = X[:200].copy()
+        with_missing[np.random.default_rng(5).random(with_missing.shape) < 0.2] = np.nan
+        X = np.vstack([X, with_missing])
+    return X
+
+
+def sklearn_predict(pipeline, X):
+    return pipeline.predict(pd.DataFrame(X, columns=FEATURE_COLUMNS))
+
+
+def test_compiled_matches_sklearn_on_random_rows(pipeline, engine):
+    X = random_rows(2000, seed=1)
+    np.testing.assert_array_equal(engine.predict(X), sklearn_predict(pipeline, X))
+
+
+def test_compiled_matches_sklearn_on_folded_thresholds(pipeline, engine):
+    X = boundary_rows(engine)
+    np.testing.assert_array_equal(engine.predict(X), sklearn_predict(pipeline, X))
+
+
+def test_save_load_round_trip(tmp_path, engine):
+    path = tmp_path / 'model.npz'
+    engine.save(str(path), FEATURE_COLUMNS, source_version='test')
+    loaded, header = CompiledForest.load(str(path), FEATURE_COLUMNS)
+    assert header['source_version'] == 'test'
+    for name in ('feature', 'threshold', 'left', 'right', 'value', 'roots', 'missing_left'):
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(engine, name), err_msg=name)
+    X = np.vstack([random_rows(500, seed=6), boundary_rows(engine)])
+    np.testing.assert_array_equal(loaded.predict(X), engine.predict(X))
+
+    with pytest.raises(ValueError):
+        CompiledForest.load(str(path), FEATURE_COLUMNS[::-1])
+
+
+def test_pruning_moves_no_prediction_beyond_tolerance(engine):
+    pruned = prune_subtrees(engine, 0.25)
+    assert pruned.n_nodes < engine.n_nodes
+    X = np.vstack([random_rows(2000, seed=7), boundary_rows(engine)])
+    assert np.abs(pruned.predict(X) - engine.predict(X)).max() <= 0.25 + 1e-9
+
+
+def test_compaction_bound_holds_for_any_input(engine):
+    # With float64 thresholds and every tree kept, the bound is guaranteed
+    X_calibration, _ = sample_features(2000, seed=8)
+    compacted, bound = compact_forest(engine, X_calibration, 0.25, 'float64', 'uint16', max_error=0)
+    X = np.vstack([random_rows(2000, seed=9), boundary_rows(engine)])
+    assert np.abs(compacted.predict(X) - engine.predict(X)).max() <= bound + 1e-9
+
+
+def test_compaction_stays_within_max_error_on_calibration_rows(tmp_path, engine):
+    X_calibration, _ = sample_features(2000, seed=10)
+    compacted, _ = compact_forest(engine, X_calibration, 0.25, 'float32', 'uint8', max_error=1.0)
+    assert compacted.n_trees < engine.n_trees
+    deviation = np.abs(compacted.predict(X_calibration) - engine.predict(X_calibration))
+    assert deviation.max() <= 1.0 + 1e-9
+
+    # Integer-coded values and float32 thresholds come back from disk as is
+    path = tmp_path / 'compact.npz'
+    compacted.save(str(path), FEATURE_COLUMNS)
+    loaded, _ = CompiledForest.load(str(path), FEATURE_COLUMNS)
+    X = random_rows(500, seed=11)
+    np.testing.assert_array_equal(loaded.predict(X), compacted.predict(X))
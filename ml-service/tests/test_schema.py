@@ -0,0 +1,48 @@
+# test_schema.py - batch_score.py must validate file cells as the API validates payloads
+import numpy as np
+import pandas as pd
+
+from batch_score import raw_columns
+from features import RAW_FIELD_DEFAULTS
+from schema import USER_SCHEMA
+
+# JSON values the schema coerces or rejects. NaN is left out: in a file it
+# is an empty cell, which takes the default like a missing field
+CELL_VALUES = [0, 0.0, -1, -7.5, 2 ** 60, 10 ** 400, 1e300, float('inf'), 1e15,
+               '5', ' 4.5 ', '1e3', '1e400', '0x10', 'abc', '', None, True, False]
+
+
+def random_rows(n_rows, seed):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for _ in range(n_rows):
+        user_data = {}
+        for field in RAW_FIELD_DEFAULTS:
+            kind = rng.random()
+            if kind < 0.1:
+                continue  # missing: default
+            if kind < 0.2:
+                user_data[field] = CELL_VALUES[rng.integers(len(CELL_VALUES))]
+            else:
+                user_data[field] = int(rng.integers(0, 200))
+        rows.append(user_data)
+    return rows
+
+
+def test_file_cells_validate_like_payloads():
+    rows = random_rows(5000, seed=0)
+    expected_raw, expected_errors = USER_SCHEMA.validate_batch(rows)
+    raw, errors = raw_columns(pd.DataFrame(rows, columns=list(RAW_FIELD_DEFAULTS), dtype=object))
+    assert errors == expected_errors
+    assert expected_errors  # the cases above must reject some rows
+    for field in RAW_FIELD_DEFAULTS:
+        np.testing.assert_array_equal(raw[field], expected_raw[field])
+
+
+def test_missing_columns_and_empty_cells_take_defaults():
+    raw, errors = raw_columns(pd.DataFrame({'portfolioCount': [3, None]}))
+    assert errors == {}
+    assert raw['portfolioCount'].tolist() == [3.0, RAW_FIELD_DEFAULTS['portfolioCount']]
+    for field, default in RAW_FIELD_DEFAULTS.items():
+        if field != 'portfolioCount':
+            assert raw[field].tolist() == [default, default]
@@ -0,0 +1,371 @@
+# user_stats.py - In-memory table of raw user stats, updated by delta events
+#
+# Instead of re-sending absolute totals for a user on every booking or
+# review, callers send what changed ("+1 completed transaction", "a 2-star
+# review"). The table keeps every user's raw counters in one float64 column
+# per RAW_FIELD_DEFAULTS field, so the touched rows can be handed straight
+# to calculate_features_columns() and scored in one model call.
+#
+# The table also remembers the last score it reported for each user, so a
+# caller can be told only about scores that moved by more than a threshold,
+# and the latest score computed for each user, which rescore() refreshes for
+# the whole population in chunks when a new model is loaded.
+#
+# load_dump() fills the table from a CSV or Parquet file in the batch_score.py
+# input format, a chunk at a time.
+import os
+import threading
+from decimal import ROUND_HALF_UP, Decimal
+
+import numpy as np
+
+from features import MAX_VECTOR_VALUE, RAW_FIELD_DEFAULTS
+
+FIELDS = tuple(RAW_FIELD_DEFAULTS)
+_FIELD_INDEX = {field: j for j, field in enumerate(FIELDS)}
+_DEFAULT_ROW = np.array([RAW_FIELD_DEFAULTS[f] for f in FIELDS], dtype=np.float64)
+
+# averageRatings is derived from these two, as in getUserStats()
+_AVERAGE_INPUTS = ('reviewCount', 'starCount')
+
+SNAPSHOT_FORMAT = 'trust-user-stats'
+SNAPSHOT_VERSION = 1
+
+
+def _is_number(value):
+    """A finite int or float within MAX_VECTOR_VALUE (bools are not numbers here)"""
+    return (isinstance(value, (int, float)) and not isinstance(value, bool)
+            and -MAX_VECTOR_VALUE < value < MAX_VECTOR_VALUE)
+
+
+def average_rating(star_count, review_count):
+    """
+    averageRatings as the Next.js getUserStats() computes it:
+    parseFloat((totalRating / reviewCount).toFixed(2)), or 1.0 without
+    reviews. toFixed() rounds the exact binary value half up, which
+    Decimal reproduces (round() would round half to even).
+    """
+    if review_count <= 0:
+        return 1.0
+    average = Decimal(float(star_count) / float(review_count))
+    return float(average.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+
+
+def parse_event(event):
+    """
+    Validate one event and return (user_id, set_values, deltas), or raise
+    ValueError with a message for the caller.
+
+    An event is {"userId": "...", "set": {...}, "delta": {...}, "review": 4}:
+    set replaces fields with absolute values, delta adds to them, and
+    review records one new review of that star rating (reviewCount +1,
+    starCount +rating and the matching positive/neutral/negative count).
+    """
+    if not isinstance(event, dict):
+        raise ValueError('each event must be a JSON object')
+    user_id = event.get('userId')
+    if not isinstance(user_id, str) or not user_id:
+        raise ValueError('userId must be a non-empty string')
+
+    set_values = event.get('set') or {}
+    deltas = event.get('delta') or {}
+    for name, values in (('set', set_values), ('delta', deltas)):
+        if not isinstance(values, dict):
+            raise ValueError(f'{name} must be an object')
+        for field, value in values.items():
+            if field not in _FIELD_INDEX:
+                raise ValueError(f'unknown field {field!r} in {name}')
+            if not _is_number(value):
+                raise ValueError(f'{name}.{field} must be a finite number')
+    if 'averageRatings' in deltas:
+        raise ValueError('averageRatings cannot take a delta; it follows starCount / reviewCount')
+
+    deltas = dict(deltas)
+    review = event.get('review')
+    if review is not None:
+        if not _is_number(review) or not 1 <= review <= 5:
+            raise ValueError('review must be a star rating from 1 to 5')
+        # Same buckets as getUserStats()
+        bucket = 'positiveReviews' if review >= 4 else 'neutralReviews' if review == 3 else 'negativeReviews'
+        for field, amount in (('reviewCount', 1), ('starCount', review), (bucket, 1)):
+            deltas[field] = deltas.get(field, 0) + amount
+
+    if not set_values and not deltas:
+        raise ValueError('event has no set, delta or review')
+    return user_id, set_values, deltas
+
+
+class UserStatsTable:
+    """
+    Raw stats for every known user, one row per user, safe to share
+    between request threads.
+
+    Rows live in a (capacity, len(FIELDS)) Fortran-order array, so each
+    field is a contiguous column; capacity doubles as users are added.
+    Per row, _reported is the last score reported to a caller and _latest
+    the last score computed (NaN if none yet), with _latest_fallback
+    marking scores that came from the fallback formula.
+    """
+
+    __slots__ = ('lock', '_index', '_ids', '_values', '_reported', '_latest',
+                 '_latest_fallback', '_size', 'dirty')
+
+    def __init__(self, capacity=1024):
+        self.lock = threading.RLock()
+        self._index = {}
+        self._ids = []
+        self._values = np.empty((capacity, len(FIELDS)), dtype=np.float64, order='F')
+        self._reported = np.empty(capacity, dtype=np.float64)
+        self._latest = np.empty(capacity, dtype=np.float64)
+        self._latest_fallback = np.empty(capacity, dtype=bool)
+        self._size = 0
+        self.dirty = False
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self, needed):
+        capacity = len(self._reported)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        size = self._size
+        values = np.empty((capacity, len(FIELDS)), dtype=np.float64, order='F')
+        values[:size] = self._values[:size]
+        self._values = values
+        for name in ('_reported', '_latest', '_latest_fallback'):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:size] = old[:size]
+            setattr(self, name, new)
+
+    def _add_rows(self, user_ids):
+        """Append rows with default stats and no scores; returns their indices"""
+        start = self._size
+        self._grow(start + len(user_ids))
+        stop = start + len(user_ids)
+        self._values[start:stop] = _DEFAULT_ROW
+        self._reported[start:stop] = np.nan
+        self._latest[start:stop] = np.nan
+        self._latest_fallback[start:stop] = False
+        for row, user_id in enumerate(user_ids, start):
+            self._index[user_id] = row
+        self._ids.extend(user_ids)
+        self._size = stop
+        return np.arange(start, stop, dtype=np.intp)
+
+    def apply(self, events):
+        """
+        Apply a list of events in order. Returns (rows, errors): the sorted
+        rows of every user touched, and (position, message) for each event
+        that was rejected and left the table unchanged.
+
+        A user is created by an event whose set carries absolute stats;
+        deltas for a user the table has never seen are rejected, since they
+        would be added to zeros rather than the user's real totals.
+        """
+        touched = set()
+        errors = []
+        with self.lock:
+            for position, event in enumerate(events):
+                try:
+                    user_id, set_values, deltas = parse_event(event)
+                    row = self._index.get(user_id)
+                    if row is None:
+                        if not set_values:
+                            raise ValueError(f'unknown user {user_id}; send its absolute stats in "set" first')
+                        row = self._add_rows([user_id])[0]
+                except ValueError as e:
+                    errors.append((position, str(e)))
+                    continue
+
+                values = self._values
+                for field, value in set_values.items():
+                    values[row, _FIELD_INDEX[field]] = value
+                for field, amount in deltas.items():
+                    values[row, _FIELD_INDEX[field]] += amount
+                if any(field in deltas for field in _AVERAGE_INPUTS):
+                    values[row, _FIELD_INDEX['averageRatings']] = average_rating(
+                        values[row, _FIELD_INDEX['starCount']],
+                        values[row, _FIELD_INDEX['reviewCount']]
+                    )
+                touched.add(row)
+            if touched:
+                self.dirty = True
+        return np.array(sorted(touched), dtype=np.intp), errors
+
+    def upsert(self, user_ids, raw):
+        """
+        Store absolute stats for many users at once: raw maps fields to
+        float64 arrays aligned with user_ids (missing fields keep their
+        current value, or the default for new users). When a userId appears
+        more than once the last row wins. Returns the rows written.
+        """
+        with self.lock:
+            rows = np.empty(len(user_ids), dtype=np.intp)
+            new_ids = {}
+            for i, user_id in enumerate(user_ids):
+                row = self._index.get(user_id)
+                if row is None:
+                    row = new_ids.get(user_id)
+                    if row is None:
+                        row = new_ids[user_id] = self._size + len(new_ids)
+                rows[i] = row
+            if new_ids:
+                self._add_rows(list(new_ids))
+            # NumPy leaves the winner of repeated fancy-index writes
+            # unspecified, so keep only the last occurrence of each row
+            _, last = np.unique(rows[::-1], return_index=True)
+            keep = len(rows) - 1 - last
+            for field, values in raw.items():
+                self._values[rows[keep], _FIELD_INDEX[field]] = values[keep]
+            if len(rows):
+                self.dirty = True
+        return rows
+
+    def user_ids(self, rows):
+        return [self._ids[row] for row in rows]
+
+    def raw_columns(self, rows):
+        """The raw stats of rows as {field: float64 array}, ready for calculate_features_columns()"""
+        with self.lock:
+            block = self._values[rows]
+        return {field: block[:, j] for j, field in enumerate(FIELDS)}
+
+    def row_payload(self, row):
+        """One row as a /predict payload, for the per-row fallback formula"""
+        with self.lock:
+            return dict(zip(FIELDS, self._values[row].tolist()))
+
+    def set_latest(self, rows, scores, fallback):
+        """Record freshly computed scores for rows"""
+        with self.lock:
+            self._latest[rows] = scores
+            self._latest_fallback[rows] = fallback
+            if len(rows):
+                self.dirty = True
+
+    def take_changed(self, rows, scores, threshold):
+        """
+        Compare new scores for rows with the last ones reported and record
+        the ones that moved by at least threshold (or were never reported).
+        Returns (changed mask, previous scores).
+        """
+        with self.lock:
+            previous = self._reported[rows]
+            changed = np.isnan(previous) | (np.abs(scores - previous) >= threshold)
+            self._reported[rows[changed]] = scores[changed]
+            if changed.any():
+                self.dirty = True
+        return changed, previous
+
+    def rescore(self, score_rows, chunk_size=10000, should_stop=None):
+        """
+        Refresh the latest score of every row, chunk_size rows at a time.
+        score_rows(rows) returns (scores, used_fallback) arrays for those
+        rows. The lock is held for each chunk, so events are never applied
+        between a chunk being read and its scores being stored; they wait
+        for at most one chunk. should_stop() is checked between chunks, so a
+        rescore for a model that has since been replaced can give up.
+
+        Returns the number of rows rescored.
+        """
+        done = 0
+        while True:
+            if should_stop is not None and should_stop():
+                break
+            with self.lock:
+                if done >= self._size:
+                    break
+                rows = np.arange(done, min(done + chunk_size, self._size), dtype=np.intp)
+                scores, fallback = score_rows(rows)
+                self.set_latest(rows, scores, fallback)
+            done += len(rows)
+        return done
+
+    def iter_latest(self, chunk_size=10000):
+        """
+        Yield (user_ids, scores, used_fallback) for every row in chunks;
+        rows never scored have NaN scores.
+        """
+        start = 0
+        while True:
+            with self.lock:
+                stop = min(start + chunk_size, self._size)
+                if start >= stop:
+                    return
+                ids = self._ids[start:stop]
+                scores = self._latest[start:stop].copy()
+                fallback = self._latest_fallback[start:stop].copy()
+            yield ids, scores, fallback
+            start = stop
+
+    def save(self, path):
+        """Snapshot the table to an .npz at path, written atomically"""
+        with self.lock:
+            size = self._size
+            ids = np.array(self._ids, dtype=str) if size else np.empty(0, dtype='<U1')
+            arrays = {
+                'values': self._values[:size].copy(),
+                'reported': self._reported[:size].copy(),
+                'latest': self._latest[:size].copy(),
+                'latest_fallback': self._latest_fallback[:size].copy(),
+            }
+            self.dirty = False
+        tmp_path = f'{path}.tmp{os.getpid()}'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f, format=np.array(SNAPSHOT_FORMAT), version=np.array(SNAPSHOT_VERSION),
+                fields=np.array(FIELDS), user_ids=ids, **arrays
+            )
+        os.replace(tmp_path, path)
+        return size
+
+    @classmethod
+    def load(cls, path):
+        """Read a snapshot written by save(); raises ValueError if it does not match this schema"""
+        with np.load(path, allow_pickle=False) as data:
+            if str(data['format']) != SNAPSHOT_FORMAT or int(data['version']) != SNAPSHOT_VERSION:
+                raise ValueError(f"{path} is not a version {SNAPSHOT_VERSION} user stats snapshot")
+            if tuple(data['fields'].tolist()) != FIELDS:
+                raise ValueError(f"{path} has different stat fields")
+            ids = data['user_ids'].tolist()
+            arrays = {name: data[name] for name in ('values', 'reported', 'latest', 'latest_fallback')}
+        if any(len(array) != len(ids) for array in arrays.values()):
+            raise ValueError(f"{path} has columns of different lengths")
+        if len(set(ids)) != len(ids):
+            raise ValueError(f"{path} lists a userId more than once")
+
+        table = cls(capacity=max(1024, len(ids)))
+        table._add_rows(ids)
+        for name, array in arrays.items():
+            getattr(table, '_' + name)[:len(ids)] = array
+        return table
+
+
+def load_dump(table, path, chunk_size=50000):
+    """
+    Upsert every row of a CSV or Parquet dump into table. Columns are the
+    batch_score.py input columns plus userId; missing columns and empty
+    cells take the /predict defaults. Rows without a userId, or with stats
+    USER_SCHEMA rejects, are skipped.
+
+    Returns (rows stored, rows skipped).
+    """
+    # pandas (and pyarrow for Parquet) are only needed for dumps
+    from batch_score import raw_columns, read_chunks
+
+    stored = skipped = 0
+    for frame in read_chunks(path, chunk_size, dtype={'userId': str}):
+        if 'userId' not in frame.columns:
+            raise ValueError(f"{path} has no userId column")
+        raw, errors = raw_columns(frame)
+        valid = np.ones(len(frame), dtype=bool)
+        valid[list(errors)] = False
+        ids = frame['userId']
+        valid &= ids.notna().to_numpy() & (ids.astype(str).str.len() > 0).to_numpy()
+        table.upsert([str(user_id) for user_id in ids[valid]], {f: v[valid] for f, v in raw.items()})
+        stored += int(valid.sum())
+        skipped += len(frame) - int(valid.sum())
+    return stored, skipped